@@ -0,0 +1,140 @@
+"""
+Gathers data headless from a scan spec, without the panel server or any plotting library. EX: scan.toml
+    ensemble = "RASHG"
+    sample = "MoS2"
+    chunk_depth = -1
+
+    [params]
+    wavstart = 780
+    wavend = 800
+
+    [orderings]
+    Polarization = "serpentine"
+"""
+import argparse
+import signal
+import sys
+import time
+from pathlib import Path
+
+from . import backend, utils
+
+# options of the spec besides params and their defaults, same as the gui
+OPTIONS = {
+    "institution": "University of North Texas",
+    "sample": "MoS2",
+    "chunk_depth": -1,
+    "writers": 2,
+    "queue_depth": 4,
+    "orderings": {},
+    "online_fit": False,
+    "dry_run": False,
+    "simulate": False,
+}
+
+
+def load_spec(filename: str) -> dict:
+    """
+    Reads a scan spec from TOML or YAML
+    :param filename: .toml, .yaml or .yml file
+    :type filename: str
+    :return: spec
+    :rtype: dict
+    """
+    path = Path(filename)
+    if path.suffix == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(path, "rb") as file:
+            spec = tomllib.load(file)
+    elif path.suffix in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError as ex:
+            raise ImportError("YAML scan specs need PyYAML, install neogiDashboard[yaml]") from ex
+        with open(path) as file:
+            spec = yaml.safe_load(file) or {}
+    else:
+        raise ValueError(f"{filename} isn't a TOML or YAML file")
+    if "ensemble" not in spec:
+        raise ValueError(f"{filename} doesn't name an ensemble")
+    unknown = set(spec) - set(OPTIONS) - {"ensemble", "params"}
+    if unknown:
+        raise ValueError(f"Unknown options in {filename}: {', '.join(sorted(unknown))}")
+    return {**OPTIONS, "params": {}, **spec}
+
+
+def acquire(spec: dict) -> int:
+    """
+    Gathers data the way Gui.gather_data does, in this process: initialize, create the store, start, get_frame for
+    every step, stop. Ctrl+C stops after the current frame, everything gathered so far is written
+    :param spec: spec returned by load_spec
+    :type spec: dict
+    :return: exit code
+    :rtype: int
+    """
+    if spec["simulate"]:
+        backend.simulate()
+    from .ensembles import instruments
+    from .ensembles.acquisition import Acquisition
+    from .ensembles.store import Store, metadata, claim
+
+    if spec["ensemble"] not in instruments:
+        print(f"Unknown ensemble {spec['ensemble']}, choose from {', '.join(instruments)}")
+        return 2
+    ensemble = instruments[spec["ensemble"]].Ensemble()
+    for parameter, value in spec["params"].items():
+        if parameter not in ensemble.param:
+            print(f"{spec['ensemble']} has no parameter {parameter}")
+            return 2
+        setattr(ensemble, parameter, value)
+    ensemble.initialize()
+    if spec["dry_run"]:
+        store = Store.from_ensemble(ensemble, {}, spec["chunk_depth"])
+    else:
+        claim(ensemble)
+        store = Store.from_ensemble(ensemble, metadata(ensemble, spec["institution"], spec["sample"]),
+                                    spec["chunk_depth"])
+    acquisition = Acquisition(ensemble, store, spec["writers"], spec["queue_depth"],
+                              {**ensemble.orderings, **spec["orderings"]}, spec["online_fit"])
+    if acquisition.total == 0:
+        print("Empty list or 0 pol step. Check your parameters")
+        return 1
+    if spec["dry_run"]:
+        print(acquisition.plan.describe())
+        return 0
+    store.create()
+    signal.signal(signal.SIGINT, lambda signum, frame: acquisition.stop())
+    start = time.perf_counter()
+    acquisition.run()
+    seconds = time.perf_counter() - start
+    print(f"Wrote {store.filename} in {utils.convert(seconds)}")
+    for stage, spent in acquisition.timings.items():
+        print(f"{stage}: {spent:.2f} s")
+    return 0
+
+
+def main() -> None:
+    """
+    Command line entry point
+
+    :rtype: None
+    """
+    parser = argparse.ArgumentParser(prog="dashboard-acquire", description="Gathers data headless from a scan spec")
+    parser.add_argument("spec", help="TOML or YAML file naming the ensemble, its params and the gui options")
+    parser.add_argument("--simulate", dest="simulate", help="Uses simulated instruments instead of neogiinstruments",
+                        action="store_const", const=True, default=None)
+    parser.add_argument("--dry-run", dest="dry_run", help="Prints the scan plan and estimated time instead",
+                        action="store_const", const=True, default=None)
+    args = parser.parse_args()
+    spec = load_spec(args.spec)
+    for option in ("simulate", "dry_run"):
+        if getattr(args, option) is not None:
+            spec[option] = True
+    sys.exit(acquire(spec))
+
+
+if __name__ == '__main__':
+    main()
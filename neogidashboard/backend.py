@@ -0,0 +1,46 @@
+"""
+Selects where ensembles get their instruments from: neogiinstruments or the simulated instruments
+"""
+import os
+from types import ModuleType
+
+SIMULATE = "NEOGI_SIMULATE"
+
+
+def simulating() -> bool:
+    """
+    Whether the simulated instruments are selected, set NEOGI_SIMULATE=1 to select them
+
+    :return: whether to simulate
+    :rtype: bool
+    """
+    return os.environ.get(SIMULATE, "").lower() in ["1", "true", "yes", "on"]
+
+
+def simulate(enable: bool = True) -> None:
+    """
+    Selects the simulated instruments for every ensemble created from now on. Uses the environment so worker processes
+    inherit it
+
+    :param enable: whether to simulate
+    :type enable: bool
+    :rtype: None
+    """
+    if enable:
+        os.environ[SIMULATE] = "1"
+    else:
+        os.environ.pop(SIMULATE, None)
+
+
+def instruments() -> ModuleType:
+    """
+    Module providing camera, rotator, MaiTai, PowerMeter, Photodiode and StellarNet
+
+    :return: neogiinstruments or neogidashboard.simulated
+    :rtype: ModuleType
+    """
+    if simulating():
+        from . import simulated
+        return simulated
+    import neogiinstruments
+    return neogiinstruments
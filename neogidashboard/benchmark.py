@@ -0,0 +1,235 @@
+"""
+Benchmarks data gathering on the simulated instruments: frames per second, time per frame split by stage of the loop
+and peak memory of the worker process, for scans of different sizes. Also checks how long the dashboard takes to import
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field, asdict
+
+from . import backend
+
+# parameters of every benchmarked scan, by ensemble and size
+SCANS = {
+    "RASHG": {
+        "small": {"x2": 64, "y2": 64, "wavstart": 780, "wavend": 782, "pow_start": 5, "pow_stop": 10},
+        "medium": {"x2": 256, "y2": 256, "wavstart": 780, "wavend": 784, "pow_start": 5, "pow_stop": 10},
+        "large": {"x2": 1024, "y2": 1024, "wavstart": 780, "wavend": 784, "pow_start": 5, "pow_stop": 10},
+    },
+    "WavelengthPoweredCalib": {
+        "small": {"wavstart": 780, "wavend": 784, "pstop": 10},
+        "medium": {"wavstart": 780, "wavend": 800, "pstop": 45},
+        "large": {"wavstart": 780, "wavend": 820, "pstop": 90},
+    },
+    "stellarnet": {
+        "small": {"wavstart": 780, "wavend": 784, "pstop": 5},
+        "medium": {"wavstart": 780, "wavend": 800, "pstop": 10},
+        "large": {"wavstart": 780, "wavend": 820, "pstop": 10, "pstep": 0.25},
+    },
+}
+# parameters removing the waits meant for real instruments
+NO_WAIT = {
+    "RASHG": {"exp_time": 0, "wavwait": 0, "escape_delay": 0, "settle_floor": 0},
+    "WavelengthPoweredCalib": {"debug": True, "mai_time": 0, "pwait": 0, "settle_floor": 0},
+    "stellarnet": {"debug": True, "mai_time": 0, "pwait": 0, "settle_floor": 0},
+}
+STARTUP_BUDGET = 5.0  # seconds importing neogidashboard.combined may take
+# imports module in a fresh interpreter, prints the seconds it took and the plugins it imported
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+plugins = []
+for package, registry in [("neogidashboard.ensembles", "instruments"), ("neogidashboard.visualizer", "types")]:
+    if package in sys.modules:
+        plugins += getattr(sys.modules[package], registry).loaded
+print(json.dumps({"seconds": seconds, "plugins": plugins}))
+"""
+
+
+@dataclass
+class Result:
+    """
+    Outcome of one benchmarked scan
+    """
+    ensemble: str
+    size: str
+    frames: int = 0
+    seconds: float = 0.0
+    stages: dict = field(default_factory=dict)  # seconds per frame spent in every stage of the loop
+    peak_rss: float = 0.0  # megabytes, worker process
+    error: str = ""
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.0
+
+
+def run(ensemble_name: str, size: str, directory: str) -> Result:
+    """
+    Runs one scan the way Gui.gather_data does: initialize, create the store, gather in a worker process while polling
+    its status and frames
+    :param ensemble_name: name of the ensemble
+    :param size: key of SCANS
+    :param directory: empty directory to run in, the calibration and the store are written there
+    :return: result
+    """
+    result = Result(ensemble_name, size)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        from . import simulated
+        from .ensembles import instruments
+        from .ensembles.acquisition import Acquisition
+        from .ensembles.store import Store
+        from .ensembles.worker import AcquisitionProcess
+
+        os.chdir(directory)
+        simulated.write_calibration("calib/simulated.zarr")
+        ensemble = instruments[ensemble_name].Ensemble()
+        for parameter, value in {**NO_WAIT[ensemble_name], **SCANS[ensemble_name][size]}.items():
+            setattr(ensemble, parameter, value)
+        ensemble.filename = "data/benchmark.zarr"
+        ensemble.initialize()
+        store = Store.from_ensemble(ensemble, {"data_type": ensemble.data})
+        store.create()
+        acquisition = Acquisition(ensemble, store)
+        process = AcquisitionProcess(acquisition)
+        start = time.perf_counter()
+        process.start()
+        while process.state == "running":
+            time.sleep(0.05)
+            for message in process.poll():
+                if message["state"] == "error":
+                    result.error = message["error"]
+                if message["state"] == "finished":
+                    result.stages = {stage: seconds / acquisition.total
+                                     for stage, seconds in message["timings"].items()}
+            process.frames.read()
+        result.seconds = time.perf_counter() - start
+        process.stop()
+    result.frames = acquisition.total
+    result.peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return result
+
+
+def _runner(ensemble_name: str, size: str, results: multiprocessing.Queue) -> None:
+    """
+    Entry point of the process running one scan, so memory and instruments start fresh for every scan
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            result = run(ensemble_name, size, directory)
+        except Exception as ex:
+            result = Result(ensemble_name, size, error=repr(ex))
+    results.put(result)
+
+
+def benchmark(ensemble_name: str, size: str) -> Result:
+    """
+    Benchmarks one scan in its own process
+    :param ensemble_name: name of the ensemble
+    :param size: key of SCANS
+    :return: result
+    """
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=_runner, args=(ensemble_name, size, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def startup(module: str = "neogidashboard.combined", repeats: int = 3) -> tuple[float, list]:
+    """
+    Times importing a module in fresh interpreters
+    :param module: module to import
+    :param repeats: interpreters started, the fastest counts so disk caches don't
+    :return: seconds and the plugins imported along the way, none if the registry stays lazy
+    :rtype: tuple[float, list]
+    """
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, module], check=True, capture_output=True,
+                                text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    best = min(runs, key=lambda run: run["seconds"])
+    return best["seconds"], best["plugins"]
+
+
+def check_startup(budget: float = STARTUP_BUDGET, module: str = "neogidashboard.combined") -> bool:
+    """
+    Checks importing the dashboard stays within budget and imports no plugin
+    :param budget: seconds
+    :param module: module to import
+    :return: whether the check passed
+    :rtype: bool
+    """
+    seconds, plugins = startup(module)
+    print(f"import {module}: {seconds:.2f} s of {budget:.2f} s budget, plugins imported: {plugins or 'none'}")
+    return seconds <= budget and not plugins
+
+
+def report(results: list) -> str:
+    """
+    Table of results
+    :param results: results
+    :return: table
+    """
+    stages = sorted({stage for result in results for stage in result.stages})
+    header = ["ensemble", "size", "frames", "frames/s"] + [f"{stage} ms" for stage in stages] + ["peak MB"]
+    lines = ["\t".join(header)]
+    for result in results:
+        if result.error:
+            lines.append(f"{result.ensemble}\t{result.size}\tfailed: {result.error}")
+            continue
+        row = [result.ensemble, result.size, str(result.frames), f"{result.frames_per_second:.1f}"]
+        row += [f"{result.stages.get(stage, 0) * 1000:.2f}" for stage in stages]
+        row.append(f"{result.peak_rss:.0f}")
+        lines.append("\t".join(row))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    """
+    Command line entry point
+
+    :rtype: None
+    """
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmarks data gathering on simulated instruments")
+    parser.add_argument("--ensembles", nargs="+", default=list(SCANS), choices=list(SCANS))
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium", "large"],
+                        choices=["small", "medium", "large"])
+    parser.add_argument("--time-scale", dest="time_scale", type=float, default=0.0,
+                        help="scales the simulated instrument delays, 0 measures the dashboard alone")
+    parser.add_argument("--json", dest="json", help="also writes the results to this file", default=None)
+    parser.add_argument("--startup", dest="startup", action="store_const", const=True, default=False,
+                        help="only checks importing the dashboard stays within --budget seconds and imports no plugin")
+    parser.add_argument("--budget", dest="budget", type=float, default=STARTUP_BUDGET)
+    args = parser.parse_args()
+    if args.startup:
+        sys.exit(0 if check_startup(args.budget) else 1)
+    backend.simulate()
+    os.environ["NEOGI_SIMULATE_TIME_SCALE"] = str(args.time_scale)
+    results = []
+    for ensemble_name in args.ensembles:
+        for size in args.sizes:
+            result = benchmark(ensemble_name, size)
+            print(report([result]).splitlines()[-1])
+            results.append(result)
+    print(report(results))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump([{**asdict(result), "frames_per_second": result.frames_per_second} for result in results],
+                      file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
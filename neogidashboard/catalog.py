@@ -0,0 +1,281 @@
+"""
+Houses the catalog of zarr stores, a SQLite index of their attributes kept next to the data
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Union
+
+FILENAME = ".neogi_catalog.sqlite"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime INTEGER, children TEXT);
+CREATE TABLE IF NOT EXISTS stores (path TEXT PRIMARY KEY, mtime INTEGER, data_type TEXT, sample TEXT, date TEXT,
+                                   title TEXT, attrs TEXT, complete INTEGER);
+CREATE INDEX IF NOT EXISTS stores_data_type ON stores (data_type);
+"""
+
+
+def read_attrs(store: str) -> Optional[dict]:
+    """
+    Reads the attributes of a zarr store from its consolidated metadata or .zattrs without opening it
+    :param store: zarr store
+    :type store: str
+    :return: attributes, None if the store has no metadata yet
+    :rtype: Optional[dict]
+    """
+    try:
+        with open(os.path.join(store, ".zmetadata")) as file:
+            return json.load(file)["metadata"].get(".zattrs", {})
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+    try:
+        with open(os.path.join(store, ".zattrs")) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def store_mtime(store: str) -> int:
+    """
+    Latest change to the metadata of a zarr store
+    :param store: zarr store
+    :type store: str
+    :return: nanoseconds since the epoch
+    :rtype: int
+    """
+    mtimes = []
+    for path in [store, os.path.join(store, ".zmetadata"), os.path.join(store, ".zattrs")]:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            pass
+    return max(mtimes, default=0)
+
+
+def is_complete(attrs: dict) -> bool:
+    """
+    :param attrs: attributes of the store
+    :return: whether every step was gathered. Stores written before the complete attribute existed count as complete
+    :rtype: bool
+    """
+    return bool(attrs.get("complete", True))
+
+
+def date_of(attrs: dict, mtime: int) -> str:
+    """
+    :param attrs: attributes of the store
+    :param mtime: nanoseconds since the epoch the store last changed, used if attrs has no time
+    :return: date the data was gathered, YYYY-MM-DD
+    :rtype: str
+    """
+    try:
+        return time.strftime("%Y-%m-%d", time.strptime(attrs["time"], "%a, %d %b %Y %H:%M:%S"))
+    except (KeyError, TypeError, ValueError):
+        return time.strftime("%Y-%m-%d", time.localtime(mtime / 1e9))
+
+
+class Catalog:
+    """
+    Index of every zarr store under a directory by data type, sample and date. Refreshing only lists directories
+    whose modification time changed and only reads the metadata of stores which changed, never opening a store
+    """
+
+    def __init__(self, root: str = ".", database: str = None):
+        """
+        :param root: directory searched for zarr stores
+        :type root: str
+        :param database: SQLite file, defaults to .neogi_catalog.sqlite in root. Kept in memory if it can't be written
+        :type database: str
+        """
+        self.root = root
+        self.watched = False  # a Watcher keeps it refreshed
+        self.lock = threading.Lock()
+        database = database or os.path.join(root, FILENAME)
+        try:
+            self.connection = sqlite3.connect(database, check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+        except sqlite3.Error as ex:
+            print(f"Can't write {database}, keeping the catalog in memory. Exception {ex}")
+            self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(stores)")]
+        if "complete" not in columns:  # cataloged by an older version, read every store again
+            with self.connection:
+                self.connection.execute("ALTER TABLE stores ADD COLUMN complete INTEGER")
+                self.connection.execute("UPDATE stores SET mtime = NULL")
+
+    def _path(self, path: str) -> str:
+        return os.path.join(self.root, path)
+
+    def refresh(self) -> None:
+        """
+        Brings the catalog up to date with the directory tree. Hidden directories and the inside of zarr stores are
+        skipped, symlinks are only followed to zarr stores
+
+        :rtype: None
+        """
+        with self.lock, self.connection:
+            directories = {path: (mtime, children) for path, mtime, children in
+                           self.connection.execute("SELECT path, mtime, children FROM directories")}
+            stores = dict(self.connection.execute("SELECT path, mtime FROM stores"))
+            seen_directories, seen_stores = set(), set()
+            pending = ["."]
+            while pending:
+                directory = pending.pop()
+                try:
+                    mtime = os.stat(self._path(directory)).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                seen_directories.add(directory)
+                if directory in directories and directories[directory][0] == mtime:
+                    children = json.loads(directories[directory][1])
+                else:
+                    # stores may be symlinks, EX: datasets on a network share, other directories aren't followed
+                    children = sorted(entry.name for entry in os.scandir(self._path(directory))
+                                      if not entry.name.startswith(".") and
+                                      entry.is_dir(follow_symlinks=entry.name.endswith(".zarr")))
+                    self.connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+                                            (directory, mtime, json.dumps(children)))
+                for name in children:
+                    child = os.path.normpath(os.path.join(directory, name))
+                    if name.endswith(".zarr"):
+                        seen_stores.add(child)
+                        self._update_store(child, stores.get(child))
+                    else:
+                        pending.append(child)
+            for path in set(directories) - seen_directories:
+                self.connection.execute("DELETE FROM directories WHERE path = ?", (path,))
+            for path in set(stores) - seen_stores:
+                self.connection.execute("DELETE FROM stores WHERE path = ?", (path,))
+
+    def _update_store(self, path: str, known: Optional[int]) -> None:
+        """
+        Reads the metadata of a store if it changed since it was cataloged
+        :param path: store relative to root
+        :param known: modification time in the catalog
+        :rtype: None
+        """
+        mtime = store_mtime(self._path(path))
+        if mtime == known:
+            return
+        attrs = read_attrs(self._path(path))
+        if attrs is None:  # still being created or empty, cataloged without a data type
+            row = (path, mtime, None, None, None, None, None, 0)
+        else:
+            row = (path, mtime, attrs.get("data_type"), attrs.get("sample"), date_of(attrs, mtime),
+                   attrs.get("title"), json.dumps(attrs, default=str), int(is_complete(attrs)))
+        self.connection.execute("INSERT OR REPLACE INTO stores (path, mtime, data_type, sample, date, title, attrs, "
+                                "complete) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def query(self, data_type: Union[str, list] = None, sample: str = None, date: str = None,
+              complete: Optional[bool] = None) -> dict:
+        """
+        Stores matching every given filter
+        :param data_type: data type or list of data types
+        :type data_type: Union[str, list]
+        :param sample: sample
+        :type sample: str
+        :param date: date or its start, EX: 2021-07-14 or 2021-07
+        :type date: str
+        :param complete: only stores which were (True) or weren't (False) gathered completely, None for both
+        :type complete: Optional[bool]
+        :return: mapping from stores to their data type
+        :rtype: dict
+        """
+        conditions, values = ["data_type IS NOT NULL"], []
+        if data_type is not None:
+            data_types = [data_type] if isinstance(data_type, str) else list(data_type)
+            conditions.append(f"data_type IN ({', '.join('?' * len(data_types))})")
+            values += data_types
+        if sample is not None:
+            conditions.append("sample = ?")
+            values.append(sample)
+        if date is not None:
+            conditions.append("date LIKE ?")
+            values.append(f"{date}%")
+        if complete is not None:
+            conditions.append("complete = ?")
+            values.append(int(complete))
+        with self.lock:
+            rows = self.connection.execute(f"SELECT path, data_type FROM stores WHERE {' AND '.join(conditions)} "
+                                           f"ORDER BY path", values).fetchall()
+        return {Path(self._path(path)): data_type for path, data_type in rows}
+
+    def mtimes(self) -> dict:
+        """
+        :return: mapping from every store with a data type to when its metadata last changed and whether it's complete
+        :rtype: dict
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT path, mtime, complete FROM stores "
+                                           "WHERE data_type IS NOT NULL").fetchall()
+        return {Path(self._path(path)): (mtime, bool(complete)) for path, mtime, complete in rows}
+
+    def complete(self, store: Union[str, Path]) -> bool:
+        """
+        :param store: store returned by query
+        :return: whether every step of the store was gathered, False if it isn't cataloged
+        :rtype: bool
+        """
+        path = os.path.normpath(os.path.relpath(store, self.root))
+        with self.lock:
+            row = self.connection.execute("SELECT complete FROM stores WHERE path = ?", (path,)).fetchone()
+        return row is not None and bool(row[0])
+
+    def attrs(self, store: Union[str, Path]) -> Optional[dict]:
+        """
+        :param store: store returned by query
+        :return: attributes of the store, None if it isn't cataloged
+        :rtype: Optional[dict]
+        """
+        path = os.path.normpath(os.path.relpath(store, self.root))
+        with self.lock:
+            row = self.connection.execute("SELECT attrs FROM stores WHERE path = ?", (path,)).fetchone()
+        return None if row is None or row[0] is None else json.loads(row[0])
+
+
+@lru_cache(maxsize=None)
+def _catalog(directory: str, root: str) -> Catalog:
+    """
+    Cached by catalog, directory keeps relative roots apart when the working directory changes
+    """
+    return Catalog(root)
+
+
+def catalog(root: str = ".") -> Catalog:
+    """
+    Catalog of a directory shared by the whole process
+    :param root: directory searched for zarr stores, stores are returned relative to it like rglob
+    :type root: str
+    :return: catalog, not refreshed
+    :rtype: Catalog
+    """
+    return _catalog(os.path.abspath(root), root)
+
+
+def main() -> None:
+    """
+    Command line entry point, lists the stores matching the filters
+
+    :rtype: None
+    """
+    parser = argparse.ArgumentParser(prog="catalog", description="Lists zarr stores by data type, sample and date")
+    parser.add_argument("--root", dest="root", default=".")
+    parser.add_argument("--data-type", dest="data_type", nargs="+", default=None)
+    parser.add_argument("--sample", dest="sample", default=None)
+    parser.add_argument("--date", dest="date", default=None, help="YYYY-MM-DD or its start, EX: 2021-07")
+    parser.add_argument("--complete", dest="complete", action="store_true", help="only completely gathered stores")
+    args = parser.parse_args()
+    stores = catalog(args.root)
+    stores.refresh()
+    for store, data_type in stores.query(args.data_type, args.sample, args.date, args.complete or None).items():
+        print(f"{data_type}\t{store}")
+
+
+if __name__ == '__main__':
+    main()
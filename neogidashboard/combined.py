@@ -5,12 +5,15 @@ import argparse
 import socket
 import sys
 import time
+from collections.abc import Callable
 from typing import Union, Optional
 
 import holoviews as hv
 import panel as pn
 import param
+from tornado.web import RequestHandler
 
+from . import backend
 from .ensembles import instruments, Gui
 from .visualizer import types, Viewer
 
@@ -31,6 +34,28 @@ def is_port_in_use(port):
         return socket_to_check.connect_ex(('localhost', port)) == 0
 
 
+class TelemetryHandler(RequestHandler):
+    """
+    Serves the telemetry of the running acquisition as JSON at /telemetry
+    """
+
+    def initialize(self, source: Callable[[], str]) -> None:
+        """
+        :param source: returns the telemetry as JSON
+        :type source: Callable[[], str]
+        """
+        self.source = source
+
+    def get(self) -> None:
+        """
+        Writes the telemetry
+
+        :rtype: None
+        """
+        self.set_header("Content-Type", "application/json")
+        self.write(self.source())
+
+
 # wrapper around viewer class to interface with instrumental class
 class Combined(param.Parameterized):
     """
@@ -82,6 +107,17 @@ class Combined(param.Parameterized):
         """
         return self.applet.graph
 
+    def telemetry(self) -> str:
+        """
+        Telemetry of the instrumental applet as JSON
+
+        :return: JSON
+        :rtype: str
+        """
+        if isinstance(self.applet, Gui):
+            return self.applet.telemetry_json()
+        return '{"state": "idle"}'
+
     def quit(self, event: tuple = None) -> None:
         """
         closes dashboard
@@ -120,7 +156,8 @@ def serve(port: int = 5006, open_browser: bool = True) -> None:
     view = Combined()
     while is_port_in_use(port):
         port += 1
-    view.view().show(port=port, open=open_browser)
+    view.view().show(port=port, open=open_browser,
+                     extra_patterns=[(r"/telemetry", TelemetryHandler, {"source": view.telemetry})])
     # if you need to change this, change this on your own or implement ports yourself. It
     # isn't very hard
 
@@ -137,7 +174,11 @@ def main() -> None:
                         const=True, default=False)
     parser.add_argument('--fit', dest='filename', help='fits datafile and saves to file from command line',
                         action='store', default=False)
+    parser.add_argument('--simulate', dest='simulate', help='Uses simulated instruments instead of neogiinstruments',
+                        action='store_const', const=True, default=False)
     args = parser.parse_args()
+    if args.simulate:
+        backend.simulate()
     if args.server:
         serve(open_browser=False)
     elif args.local:
@@ -1,12 +1,13 @@
 """
 Various Utilities for command line. Formerly converter.py
 """
+import argparse
 import os
 from pathlib import Path
 import zarr
 import xarray as xr
 from zarr.errors import GroupNotFoundError
-from neogidashboard import utils
+from neogidashboard import utils, pixelfit, polar_export, summed_area
 
 compressor = zarr.Blosc(cname="zstd", clevel=3, shuffle=2)
 
@@ -17,7 +18,7 @@ def convert():
     # client = Client()
     for file in list(Path("..").rglob("*.zarr")):
         print(file)
-        ds1 = xr.open_dataset(file, engine="zarr")
+        ds1 = utils.open_store(file)
         if not "data_type" in ds1.attrs:
             ds1.attrs["data_type"] = "RASHG"
             ds1.to_zarr(file, mode="w", compute=True)
@@ -48,5 +49,43 @@ def clean():
             os.removedirs(file)
 
 
+def fit_maps():
+    """Fits the RASHG model to every pixel of the files given on the command line and saves the parameter maps"""
+    parser = argparse.ArgumentParser(prog="fitmaps", description="Fits every pixel of RASHG datasets")
+    parser.add_argument("files", nargs="+", help="zarr stores")
+    parser.add_argument("--max-iter", dest="max_iter", type=int, default=100, help="maximum steps per pixel")
+    args = parser.parse_args()
+    for file in args.files:
+        print(file)
+        pixelfit.fit_maps(file, max_iter=args.max_iter)
+
+
+def sum_area():
+    """Builds the summed-area table of the RASHG files given on the command line, so averages over a box are fast"""
+    parser = argparse.ArgumentParser(prog="sumarea", description="Builds the summed-area table of RASHG datasets")
+    parser.add_argument("files", nargs="+", help="zarr stores")
+    args = parser.parse_args()
+    for file in args.files:
+        print(file)
+        summed_area.build(file)
+
+
+def export_polars():
+    """Exports the polar plots of the RASHG files given on the command line"""
+    parser = argparse.ArgumentParser(prog="polars", description="Exports the polar plots of RASHG datasets")
+    parser.add_argument("files", nargs="+", help="zarr stores")
+    parser.add_argument("--box", nargs=4, type=float, default=None, metavar=("X0", "X1", "Y0", "Y1"),
+                        help="average over this box instead of every pixel")
+    parser.add_argument("--layout", choices=polar_export.LAYOUTS, default="files",
+                        help="one image per plot, one tiled image per power and Orientation, or one html page")
+    parser.add_argument("--format", dest="image_format", default="png", help="png, svg, pdf...")
+    parser.add_argument("--workers", type=int, default=None, help="processes rendering images, one per CPU by default")
+    args = parser.parse_args()
+    for file in args.files:
+        print(file)
+        polar_export.export_polars(file, box=args.box and tuple(args.box), layout=args.layout,
+                                   workers=args.workers, image_format=args.image_format)
+
+
 if __name__ == '__main__':
     convert()
@@ -1,20 +1,17 @@
 """
-Provides collections of ensembles for gathering data
+Provides collections of ensembles for gathering data. An ensemble and the GUI are only imported when first used, so
+gathering data headless doesn't import the GUI stack
 """
-import os
-from pathlib import Path
-from importlib import import_module
-from .gui import Gui
-instruments = {}
-for directory in os.scandir(str(Path(__file__).resolve().parent)):
-    if directory.is_dir():
-        for file in os.listdir(directory):
-            if str(file).__contains__("ensemble_"):
-                if not str(file).__contains__("base"):
-                    sname = file.replace(".py", "")
-                    try:
-                        module = import_module(f"{__name__}.{directory.name}.{sname}")
-                    except Exception as ex:
-                        print(f"{file} import failed. Exception {Exception}")
-                    else:
-                        instruments[module.name] = module
+from ..registry import Registry
+
+instruments = Registry(__name__, "ensemble_", "name", exclude="base")
+
+
+def __getattr__(name: str):
+    """
+    Imports Gui on first use
+    """
+    if name == "Gui":
+        from .gui import Gui
+        return Gui
+    raise AttributeError(f"module {__name__} has no attribute {name}")
@@ -0,0 +1,196 @@
+"""
+Houses the data gathering loop, independent of the GUI
+"""
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from contextlib import contextmanager
+from functools import partial
+from typing import Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from .ensemblebase import EnsembleBase
+from .fitting import OnlineFit
+from .reductions import Reduction
+from .scanplan import ScanPlan
+from .scheduler import Scheduler, Action
+from .store import Store, COMPLETE
+from .telemetry import Telemetry
+from .writer import Writer
+
+
+class Acquisition:
+    """
+    Loops through the loop coordinates of an initialized ensemble and writes every frame to the store
+    """
+    buffers: dict
+    writer: Writer = None
+    scheduler: Scheduler
+    timings: dict  # seconds spent in every stage of the loop
+    telemetry: Telemetry  # timings of the latest steps
+
+    def __init__(self, ensemble: EnsembleBase, store: Store, writers: int = 2, queue_depth: int = 4,
+                 orderings: dict = None, fit: bool = False):
+        """
+        :param ensemble: initialized ensemble
+        :type ensemble: EnsembleBase
+        :param store: created store
+        :type store: Store
+        :param writers: threads writing chunks to disk
+        :type writers: int
+        :param queue_depth: chunks waiting for the disk before the scan pauses
+        :type queue_depth: int
+        :param orderings: ordering of the loop coordinates, defaults to the orderings of the ensemble
+        :type orderings: dict
+        :param fit: whether to fit every sweep while gathering, if the ensemble has a fit
+        :type fit: bool
+        """
+        self.ensemble = ensemble
+        self.store = store
+        self.writers = writers
+        self.queue_depth = queue_depth
+        self.stopping = threading.Event()
+        self.timings = defaultdict(float)
+        self.telemetry = Telemetry()
+        if orderings is None:
+            orderings = ensemble.orderings
+        self.plan = ScanPlan(ensemble.coords, ensemble.loop_coords, store.depth, ensemble.durations(), orderings)
+        self.total = len(self.plan)
+        self.reductions = [Reduction(name, dataset, reduce, store, *mask)
+                           for name, (dataset, reduce, *mask) in ensemble.reductions.items()]
+        self.fit = None
+        if fit and ensemble.fit is not None:
+            name, function, param_names, kwargs, *seed = ensemble.fit
+            reduction = next(reduction for reduction in self.reductions if reduction.name == name)
+            self.fit = OnlineFit(reduction, function, param_names, store, kwargs, *seed)
+
+    def run(self, on_frame: Optional[Callable[[dict, int], None]] = None,
+            on_fit: Optional[Callable[[dict], None]] = None) -> None:
+        """
+        Starts data gathering loop. Iterates over ensemble.loop_coords
+        :param on_frame: called with every frame and the number of the step
+        :param on_fit: called with the coordinates and parameters of every fitted sweep, from the fit thread
+        :rtype: None
+        """
+        if self.total == 0:
+            raise ValueError("Empty list or 0 pol step. Check your parameters")
+        print(self.plan.describe())
+        self.ensemble.start()
+        '''
+        The infinite loop:
+        not because it is an actual infinite loop but because it supports a theoretical infinite number of dimensions
+        memory limits nonwithstanding
+        The steps come from the scan plan, computed once.
+        Chunks are handed to the writer whenever one of the outer chunk_depth coordinates changes and written to
+        their region of the store in the background.
+        Every step runs the moves of the ensemble concurrently, copying the previous frame into the chunk buffer at
+        the same time unless the chunk is about to be handed to the writer. Ensembles writing the frame straight into
+        the slot passed to get_frame skip the copy
+        Once the outer coordinates of the fit change, the sweep just gathered is fitted in the background
+        '''
+        if self.fit is not None:
+            self.fit.on_fit = on_fit
+            self.fit.create()
+        self.writer = Writer(self.store, self.writers, self.queue_depth)
+        self.scheduler = Scheduler()
+        self.buffers = self.writer.acquire()
+        previous = None
+        data = None
+        try:
+            for number, step in enumerate(tqdm(self.plan.steps)):
+                if self.stopping.is_set():
+                    print("Stopped early")
+                    break
+                start = time.perf_counter()
+                before = dict(self.timings)
+                persisted = self.writer.persisted
+                dim = self.ensemble.loop_coords[step.changed]
+                actions = self.ensemble.actions(step.coords, dim)
+                if previous is not None:
+                    if step.chunk != previous.chunk:
+                        with self.stage("readout"):
+                            self.readout(data, previous.indices)
+                        with self.stage("write"):
+                            self.writer.put(self.buffers, previous.indices)
+                            self.buffers = self.writer.acquire()
+                    else:
+                        actions.append(Action("readout", partial(self.readout, data, previous.indices)))
+                with self.stage("move"):
+                    moves = self.scheduler.run(actions)
+                if self.fit is not None and previous is not None:
+                    if step.indices[:self.fit.depth] != previous.indices[:self.fit.depth]:
+                        self.fit.submit(previous.indices[:self.fit.depth])
+                timestamp = time.time()
+                self.store.stamp(self.buffers, step.indices, timestamp)
+                with self.stage("get_frame"):
+                    data = self.ensemble.get_frame(step.coords, self.store.slots(self.buffers, step.indices))
+                spent = {stage: self.timings[stage] - before.get(stage, 0.0) for stage in self.timings}
+                moves.setdefault("readout", spent.get("readout", 0.0))
+                self.telemetry.add({"step": number, "time": timestamp, "actions": moves,
+                                    "get_frame": spent["get_frame"], "write": spent.get("write", 0.0),
+                                    "persist": self.writer.persisted - persisted, "queue": self.writer.qsize(),
+                                    "duration": time.perf_counter() - start})
+                previous = step
+                if on_frame is not None:
+                    with self.stage("publish"):
+                        on_frame(data, number)
+            if previous is not None:
+                with self.stage("readout"):
+                    self.readout(data, previous.indices)
+                with self.stage("write"):
+                    self.writer.put(self.buffers, previous.indices)
+                if self.fit is not None and not self.stopping.is_set():
+                    self.fit.submit(previous.indices[:self.fit.depth])
+        finally:
+            with self.stage("drain"):
+                self.writer.drain()
+            self.scheduler.shutdown()
+            self.ensemble.stop()
+        if self.reductions:
+            with self.stage("reductions"):
+                self.store.append({reduction.name: (reduction.dims, reduction.result())
+                                   for reduction in self.reductions})
+        if self.fit is not None:
+            with self.stage("fit"):
+                self.fit.finish(not self.stopping.is_set())
+        if not self.stopping.is_set():
+            self.store.update_attrs({COMPLETE: True})  # offered to file selectors from now on
+        print("Finished")
+        self.ensemble.settler.report()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Adds the time spent inside to a stage of the loop
+        :param name: stage: move, readout, write, get_frame, publish, drain, reductions or fit
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def stop(self) -> None:
+        """
+        Stops the loop after the current frame, everything gathered so far is written
+
+        :rtype: None
+        """
+        self.stopping.set()
+
+    def readout(self, data: dict, indices: tuple) -> None:
+        """
+        Copies a frame into the chunk buffers, unless get_frame already wrote it there, and adds it to the reductions
+        :param data: frame returned by get_frame
+        :param indices: indices of the loop coordinates
+        :rtype: None
+        """
+        for dataset in self.ensemble.datasets:
+            buffer = self.buffers[dataset]
+            if not np.may_share_memory(data[dataset], buffer):
+                buffer[self.store.address(dataset, indices)] = data[dataset]
+        for reduction in self.reductions:
+            reduction.add(data[reduction.dataset], indices, None if reduction.mask is None else data[reduction.mask])
@@ -4,11 +4,15 @@ Specifies base class
 from array import array
 from collections.abc import Callable
 from dataclasses import dataclass, field
-from typing import Union, ClassVar
+from functools import partial
+from typing import Union, ClassVar, Optional
 
 import numpy as np
 import param
 
+from .scheduler import Action
+from .settle import Settler
+
 
 @dataclass
 class Coordinate:
@@ -66,9 +70,20 @@ class EnsembleBase(param.Parameterized):
     title: str = param.String(default="Power/Wavelength dependent RASHG")
     filename: str = param.String(default="data/testfolder.zarr")
     datasets: array = ["ds1"]
+    dtypes: Union[dict, type] = np.float64
+    fill_values: Union[dict, float, None] = None
+    orderings: dict = {}
+    reductions: dict = {}
+    fit: Optional[tuple] = None
+    file_selectors: dict = {}  # parameters selecting a dataset, mapped to its data type, kept up to date by the gui
     live: bool = True
     gather: bool = True
     coords: Coordinates
+    settler: Settler
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.settler = Settler()
 
     def initialize(self):
         """
@@ -77,14 +92,42 @@ class EnsembleBase(param.Parameterized):
         """
         pass
 
-    def get_frame(self, coords):
+    def actions(self, coords, dim) -> list[Action]:
+        """
+        Moves to run before capturing the frame. Actions without dependencies on each other run at the same time.
+        Defaults to the step function of the changed coordinate
+        :param coords: list of data in order of loop_coords
+        :param dim: name of the first changed loop coordinate
+        :return: actions
+        """
+        return [Action(dim, partial(self.coords[dim], coords))]
+
+    def durations(self) -> dict:
+        """
+        Estimated seconds per step, keyed by the outermost loop coordinate changing at that step. "frame" is added to
+        every step. Used to estimate how long a scan takes
+        :return: durations
+        """
+        return {}
+
+    def get_frame(self, coords, out=None):
         """
         Captures the frame
         :param coords: list of data in order of loop_coords
+        :param out: views into the chunk buffer for every dataset. Writing the frame into them and returning them avoids
+        a copy
         :return: data
         """
         pass
 
+    def update(self, data):
+        """
+        Receives the latest frame while data is gathered in the worker process, runs in the GUI process
+        :param data: frame as returned by get_frame
+        :return:
+        """
+        pass
+
     def widgets(self):
         """
         Widgets to pass to dashboard
@@ -0,0 +1,139 @@
+"""
+Houses the fit run on every sweep as soon as it is gathered
+"""
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+from scipy.optimize import curve_fit
+
+from .reductions import Reduction
+from .store import Store
+
+
+class OnlineFit:
+    """
+    Fits a model along the last dimension of a reduction, EX: heatmap_all along Polarization, every time a sweep of
+    that dimension is gathered. Fits run on a background thread and are written to the store as "fitted" and
+    "covariance", laid out like xarray's curvefit, so they are ready when the scan finishes
+    """
+
+    def __init__(self, reduction: Reduction, function: Callable, param_names: list, store: Store,
+                 kwargs: dict = None, seed: Optional[Callable] = None):
+        """
+        :param reduction: reduction whose dimensions are the outer loop dimensions followed by the fitted dimension
+        :type reduction: Reduction
+        :param function: model taking the fitted coordinate followed by the parameters
+        :type function: Callable
+        :param param_names: names of the parameters
+        :type param_names: list
+        :param store: store the fits are written to
+        :type store: Store
+        :param kwargs: passed to scipy.optimize.curve_fit
+        :type kwargs: dict
+        :param seed: returns p0 from the fitted coordinate and a curve, EX: harmonics.seed
+        :type seed: Optional[Callable]
+        """
+        self.reduction = reduction
+        self.function = function
+        self.param_names = param_names
+        self.store = store
+        self.kwargs = kwargs or {}
+        self.seed = seed
+        self.depth = len(reduction.dims) - 1  # a sweep is gathered once these loop dimensions change
+        self.outer = reduction.dims[:self.depth]
+        self.dim = reduction.dims[-1]
+        if self.outer != store.loop_dims[:self.depth]:
+            raise ValueError(f"Can't fit {reduction.name} while gathering, its dimensions must be the outer loop "
+                             f"dimensions followed by the fitted dimension")
+        coordinate = self._coordinate(self.dim)
+        if coordinate is None:
+            raise ValueError(f"Can't fit {reduction.name} while gathering, {self.dim} has no coordinate")
+        self.x = np.asarray(store.coords[coordinate][1], dtype=np.float64)
+        shape = reduction.sums.shape[:self.depth]
+        size = len(param_names)
+        self.fitted = np.full(shape + (size,), np.nan)
+        self.covariance = np.full(shape + (size, size), np.nan)
+        self.on_fit: Optional[Callable[[dict], None]] = None
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="fit")
+        self.futures = []
+
+    def _coordinate(self, dim: str) -> Optional[str]:
+        """
+        Name of the coordinate along a dimension, the coordinate named like the dimension if there are several
+        :param dim: dimension
+        :return: name, None if the dimension has no coordinate
+        """
+        names = [name for name, (dims, _) in self.store.coords.items() if list(np.atleast_1d(dims)) == [dim]]
+        if dim in names:
+            return dim
+        return names[0] if names else None
+
+    def create(self) -> None:
+        """
+        Adds empty fitted and covariance datasets to the store
+
+        :rtype: None
+        """
+        ones = (1,) * self.depth
+        size = len(self.param_names)
+        self.store.append({"fitted": (self.outer + ["param"], self.fitted),
+                           "covariance": (self.outer + ["cov_i", "cov_j"], self.covariance)},
+                          coords={"param": self.param_names, "cov_i": self.param_names, "cov_j": self.param_names},
+                          chunks={"fitted": ones + (size,), "covariance": ones + (size, size)})
+
+    def submit(self, indices: tuple) -> None:
+        """
+        Fits a gathered sweep in the background
+        :param indices: indices of the outer loop dimensions of the sweep
+        :rtype: None
+        """
+        curve = self.reduction.result(indices).copy()
+        self.futures.append(self.executor.submit(self._fit, indices, curve))
+
+    def _fit(self, indices: tuple, curve: np.ndarray) -> None:
+        """
+        Fits a sweep and writes the result to its region of the store
+        :param indices: indices of the outer loop dimensions of the sweep
+        :param curve: mean along the fitted dimension
+        :rtype: None
+        """
+        finite = np.isfinite(curve)
+        if np.count_nonzero(finite) < len(self.param_names):
+            return  # stopped before the sweep was gathered
+        kwargs = self.kwargs
+        if self.seed is not None:
+            kwargs = {**kwargs, "p0": self.seed(self.x[finite], curve[finite])}
+        try:
+            popt, pcov = curve_fit(self.function, self.x[finite], curve[finite], **kwargs)
+        except (RuntimeError, ValueError) as ex:
+            print(f"Fit at {indices} failed: {ex}")
+            return
+        self.fitted[indices] = popt
+        self.covariance[indices] = pcov
+        index = (np.newaxis,) * self.depth
+        fit = xr.Dataset({"fitted": (self.outer + ["param"], popt[index]),
+                          "covariance": (self.outer + ["cov_i", "cov_j"], pcov[index])})
+        self.store.write_region(fit, {dim: slice(i, i + 1) for dim, i in zip(self.outer, indices)})
+        if self.on_fit is not None:
+            record = {}
+            for dim, i in zip(self.outer, indices):
+                name = self._coordinate(dim)
+                record[dim] = self.store.coords[name][1][i].item() if name is not None else i
+            record.update(zip(self.param_names, popt.tolist()))
+            self.on_fit(record)
+
+    def finish(self, complete: bool) -> None:
+        """
+        Waits for every fit and reraises errors writing them. Marks the store as fitted if every sweep was gathered so
+        viewers don't fit it again
+        :param complete: whether every sweep was gathered
+        :rtype: None
+        """
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        if complete:
+            self.store.update_attrs({"fit_version": 1})
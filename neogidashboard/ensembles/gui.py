@@ -1,41 +1,25 @@
 """
 houses gui class
 """
-import os
-import sys
-import time
+import json
 
-import numpy as np
+import pandas as pd
 import panel as pn
 import param
-import xarray as xr
-import zarr
-from numba import njit
-from tqdm.contrib.itertools import product
 
+from .acquisition import Acquisition
 from .ensemblebase import EnsembleBase, Coordinates
-
-compressor = zarr.Blosc(cname="zstd", clevel=3, shuffle=2)
-
-
-@njit(cache=True)
-def compare(coords, dim_cache):
-    """
-    Get first different dimension
-    :param coords: new coordinates
-    :param dim_cache: old coordinates
-    :return: index of changed coordinate
-    """
-    for i, coord in enumerate(coords):
-        if coord > dim_cache[i]:
-            return i
-    raise Exception("Coordinates identical")
+from .store import Store, metadata, claim
+from .telemetry import Telemetry
+from .worker import AcquisitionProcess
+from .. import utils
+from ..watcher import watcher
 
 
 class Gui(param.Parameterized):
     """
     Essentially the backbone of the data collection
-    Loops through dimensions
+    Configures the ensemble and runs the acquisition in a worker process
     """
     ensemble: EnsembleBase
     coordinates: Coordinates
@@ -47,16 +31,23 @@ class Gui(param.Parameterized):
     live = param.Boolean(default=False, precedence=-1)
     refresh = 5  # refresh every 5 seconds #make it a parameter
     live_refresh = param.Integer(default=5)
-    dim_cache = np.array([0, 0, 0, 0])
+    chunk_depth = param.Integer(default=-1, doc="Outer loop coordinates per chunk written to disk, negative values "
+                                                "count from the innermost")
+    writers = param.Integer(default=2, bounds=(1, None), doc="Threads writing chunks to disk")
+    queue_depth = param.Integer(default=4, bounds=(1, None), doc="Chunks waiting for the disk before the scan pauses")
+    orderings = param.Dict(default={}, doc="Ordering of loop coordinates: ascending, serpentine or nearest")
+    dry_run = param.Boolean(default=False, doc="Print the scan plan and estimated time instead of gathering data")
+    online_fit = param.Boolean(default=False, doc="Fit every sweep while gathering, if the ensemble has a fit")
     ensembles = param.ObjectSelector()  # Initializes a blank object selector, fills it in later
     confirmed = param.Boolean(default=False, precedence=-1)
     button2 = pn.widgets.Button(name='Confirm', button_type='primary')
     cap_coords: dict
     attrs: dict
-    datasets: dict
-    mask: dict
-    encoders: dict
-    data: xr.Dataset
+    dimensions: dict
+    store: Store
+    process: AcquisitionProcess = None
+    fits: list  # parameters of every sweep fitted while gathering
+    telemetry: Telemetry  # timings of the latest steps, forwarded by the worker
 
     def __init__(self, ensembles):
         self.ensemble_classes = ensembles
@@ -70,7 +61,15 @@ class Gui(param.Parameterized):
             i += 1
         self.param["ensembles"].objects = ensembles
         super().__init__()
+        self.fits = []
+        self.fit_table = pn.pane.DataFrame(None, visible=False)
+        self.telemetry = Telemetry()
+        self.progress = pn.pane.Markdown("", visible=False)
+        self.stage_table = pn.pane.DataFrame(None, visible=False)
         self.callback = pn.state.add_periodic_callback(self.live_view, period=self.live_refresh * 1000, start=False)
+        self.subscription = watcher().subscribe()
+        self.subscription.drain()  # the ensembles read the files already there when they load
+        self.file_callback = pn.state.add_periodic_callback(self.update_files, period=2000)
         self.button.disabled = True
         self.load()
         self.button2.on_click(self.initialize)
@@ -86,6 +85,10 @@ class Gui(param.Parameterized):
             self.ensemble = self.ensemble_classes[self.ensembles].Ensemble()
         except:
             print("Ensemble didn't initialize")
+            if self.ensembles not in self.ensemble_classes:  # failed to import, the registry dropped it
+                self.param["ensembles"].objects = list(self.ensemble_classes)
+        else:
+            self.orderings = dict(self.ensemble.orderings)
 
     def initialize(self, event=None):
         """
@@ -104,7 +107,7 @@ class Gui(param.Parameterized):
         if self.ensemble.live:
             self.live = True
             self.callback.start()
-        exclude = ["c_pol", "live"]
+        exclude = ["c_pol", "live", "dry_run", "orderings", "online_fit"]
         for parameter in self.param:
             if parameter not in exclude:
                 self.param[parameter].constant = True
@@ -115,123 +118,147 @@ class Gui(param.Parameterized):
         :return:
         """
         # populate metadata
-        self.attrs = {
-            "title": self.ensemble.title,
-            "institution": self.institution,
-            "sample": self.sample,
-            "source": self.ensemble.type,
-            "data_type": self.ensemble.data,
-            "time": time.strftime('%a, %d %b %Y %H:%M:%S', time.localtime()),
-            "fit_version": 0,
-            "data_version": 2
-        }
+        self.attrs = metadata(self.ensemble, self.institution, self.sample)
         self.coordinates = self.ensemble.coords
         self.coords = {coord.name: ([coord.dimension], coord.values) for coord in self.coordinates}
-        for coord in self.coordinates:
-            self.attrs[coord.name] = coord.unit
 
         # data.date = str(datetime.date.today()) #out of date
-        # create variables; in this case, the only dependent variable is 'shg',
-        # which is the shg intensity along the specified dimensions
-        # populate coordinate dimensions
-        dimensions = self.ensemble.dimensions
-        if type(dimensions) is list:
-            dimensions = {dataset: dimensions for dataset in self.ensemble.datasets}
         self.cap_coords = self.ensemble.cap_coords
         if type(self.cap_coords) is list:
             self.cap_coords = {dataset: self.cap_coords for dataset in self.ensemble.datasets}
-        zeros = {}
-        for dataset in self.ensemble.datasets:
-            zero_array = [self.ensemble.coords[coord].values.size for coord in dimensions[dataset]]
-            zero_array[0] = 1
-            zeros[dataset] = xr.DataArray(np.zeros(zero_array), dims=dimensions[dataset])
-        self.datasets = {dataset: (dimensions[dataset], zeros[dataset], self.attrs) for dataset in
-                         self.ensemble.datasets}
-        self.encoders = {dataset: {"compressor": compressor} for dataset in self.ensemble.datasets}
-        # Get filename
-        fname = self.ensemble.filename
-        i = 2
-        while os.path.isdir(self.ensemble.filename):
-            self.ensemble.param["filename"].constant = False
-            self.ensemble.filename = fname.replace(".zarr", f"{i}.zarr")
-            i += 1
-            print(f"Zarr store exists, trying {self.ensemble.filename}")
-            self.ensemble.param["filename"].constant = True
-        os.makedirs(self.ensemble.filename)
 
     def gather_data(self, event=None):
         """
-        Starts data gathering loop. Iterates over self.instruments.loop_coords
+        Creates the store and starts gathering data in a worker process. The live view callback polls its status from
+        then on. A dry run only prints the scan plan, nothing is written
         :param event: needed for button
         :return:
         """
+        if self.dry_run:
+            store = Store.from_ensemble(self.ensemble, {}, self.chunk_depth)
+        else:
+            claim(self.ensemble)
+            store = Store.from_ensemble(self.ensemble, self.attrs, self.chunk_depth)
+        acquisition = Acquisition(self.ensemble, store, self.writers, self.queue_depth, self.orderings,
+                                  self.online_fit)
+        if acquisition.total == 0:
+            print("Empty list or 0 pol step. Check your parameters")
+            return
+        if self.dry_run:
+            print(acquisition.plan.describe())
+            return
+        self.store = store
+        self.dimensions = store.dimensions
+        self.store.create()
         if self.ensemble.live:
             self.callback.stop()
         self.button.disabled = True
         self.button2.disabled = True
         self.live = False
-        first = 0
-        ranges = [self.ensemble.coords[coord].values for coord in self.ensemble.loop_coords]
-        self.ensemble.start()
-        '''
-        The infinite loop:
-        not because it is an actual infinite loop but because it supports a theoretical infinite number of dimensions
-        memory limits nonwithstanding
-        The generator should be lazy and not overflow your memory. Theoretically.
-        '''
-        try:
-            self.mask = {dim: min(self.ensemble.coords[dim].values) for dim in self.ensemble.loop_coords}
-        except ValueError:
-            print("Empty list or 0 pol step. Check your parameters")
-            sys.exit()
-        for coords in product(*ranges):
-            dim, dim_num = self.find_dim(coords)
-            if dim_num == 0:
-                if first == 0:
-                    first = 1
-                elif first == 1:
-                    self.data.to_zarr(self.ensemble.filename, encoding=self.encoders)
-                    first += 1
-                else:
-                    self.data.to_zarr(self.ensemble.filename, append_dim=self.ensemble.loop_coords[0])
-                self.coords[self.ensemble.loop_coords[0]] = ([dim], [coords[0]])  # update 1st coord after saving
-                self.data = xr.Dataset(
-                    data_vars=self.datasets,
-                    coords=self.coords,
-                    attrs=self.attrs
-                )
-            self.mask[dim] = coords[dim_num]
-            self.ensemble.coords[dim](coords)
-            data = self.ensemble.get_frame(coords)
-            for dataset in self.ensemble.datasets:
-                self.data[dataset].loc[self.mask] = xr.DataArray(data[dataset],
-                                                                 dims=self.cap_coords[dataset])
+        self.telemetry = Telemetry()
+        self.process = AcquisitionProcess(acquisition)
+        self.process.start()
+        self.callback.start()
+
+    def poll(self) -> None:
+        """
+        Handles status messages from the worker and shows the latest frame
+
+        :rtype: None
+        """
+        for message in self.process.poll():
+            if message["state"] == "error":
+                print(f"Acquisition failed: {message['error']}")
+            if "fit" in message:
+                self.fits.append(message["fit"])
+            self.telemetry.extend(message.get("telemetry", []))
+        self.show_telemetry()
+        if self.fits:
+            self.fit_table.object = pd.DataFrame(self.fits)
+            self.fit_table.visible = True
+        frame = self.process.frames.read()
+        if frame is not None:
+            self.ensemble.update(frame)
             if self.GUIupdate:
                 self.c_pol += 1  # refresh the GUI
-        self.data.to_zarr(self.ensemble.filename, append_dim=self.ensemble.loop_coords[0])
-        self.ensemble.stop()
-        print("Finished")
-        self.c_pol = self.c_pol + 1
-        self.data.close()
-        sys.exit()
+        if self.process.state != "running":
+            self.callback.stop()
+            self.process.stop()
+            self.c_pol = self.c_pol + 1
+
+    def eta(self) -> float:
+        """
+        Estimated seconds left, from the timings of the latest steps or from the scan plan before any arrive
+        :return: seconds
+        :rtype: float
+        """
+        if self.process is None:
+            return 0.0
+        acquisition = self.process.acquisition
+        if self.process.state != "running":
+            return 0.0
+        if self.telemetry.records:
+            return self.telemetry.eta(acquisition.total - self.process.step)
+        return acquisition.plan.remaining(max(self.process.step - 1, 0))
+
+    def show_telemetry(self) -> None:
+        """
+        Updates the progress, ETA and the average time per step of every stage
 
-    def find_dim(self, xs):
+        :rtype: None
         """
-        finds the changed dimension and the index of the changed dimension
-        :param xs:
-        :return: changed dimension name and index of changed dimension
+        total = self.process.acquisition.total
+        self.progress.object = (f"**{self.process.state}** step {self.process.step} of {total}, "
+                                f"{utils.convert(self.eta())} left")
+        self.progress.visible = True
+        if self.telemetry.records:
+            summary = self.telemetry.summary(self.process.step, total)
+            stages = pd.DataFrame({"ms per step": {stage: seconds * 1000
+                                                   for stage, seconds in summary["stages"].items()}})
+            stages.loc["queue (chunks)"] = summary["queue"]["latest"]
+            self.stage_table.object = stages
+            self.stage_table.visible = True
+
+    def telemetry_json(self) -> str:
+        """
+        Progress, ETA, average stage timings, queue depths and the latest step records as JSON, served at /telemetry
+        :return: JSON
+        :rtype: str
+        """
+        if self.process is None:
+            return json.dumps({"state": "idle"})
+        summary = json.loads(self.telemetry.json(self.process.step, self.process.acquisition.total))
+        eta = self.eta()
+        return json.dumps({"state": self.process.state, **summary, "eta": eta, "eta_text": utils.convert(eta)})
+
+    def update_files(self) -> None:
+        """
+        Adds datasets finished since the last call to the file selectors of the ensemble and drops deleted ones, as
+        reported by the watcher. Stores still being gathered are preallocated with zeros, so they aren't offered
+
+        :rtype: None
         """
-        typed_a = np.array(xs, dtype=np.float64)
-        dim = compare(typed_a, self.dim_cache)
-        self.dim_cache = typed_a
-        return self.ensemble.loop_coords[dim], dim
+        updated, removed = self.subscription.drain()
+        if not (updated or removed) or not hasattr(self, "ensemble"):
+            return
+        files = watcher().catalog
+        complete = {file for file in updated if files.complete(file)}
+        for parameter, data_type in self.ensemble.file_selectors.items():
+            objects = [file for file in self.ensemble.param[parameter].objects
+                       if file not in removed and (file not in updated or file in complete)]
+            objects += [file for file, kind in updated.items()
+                        if kind == data_type and file in complete and file not in objects]
+            self.ensemble.param[parameter].objects = objects
 
     def live_view(self):
         """
-        Actually all this does is update the c_pol parameter to make param update the live view
+        Actually all this does is update the c_pol parameter to make param update the live view. Polls the worker
+        while gathering data
         :return:
         """
-        if self.live:
+        if self.process is not None:
+            self.poll()
+        elif self.live:
             if self.ensemble.debug:
                 print("Updating live view")
             self.c_pol = self.c_pol + 1
@@ -252,14 +279,18 @@ class Gui(param.Parameterized):
         Renders everything but the graph
         :return:
         """
-        return pn.Row(pn.Column(self.param, self.button2, self.button), self.ensemble.param,
-                      self.ensemble.widgets)
+        return pn.Row(pn.Column(self.param, self.button2, self.button, self.progress, self.stage_table,
+                                self.fit_table), self.ensemble.param, self.ensemble.widgets)
 
     def stop(self):
         """
         Stops the server
         :return:
         """
+        if self.process is not None:
+            self.process.stop()
+        self.file_callback.stop()
+        watcher().unsubscribe(self.subscription)
         self.ensemble.stop()
         if self.ensemble.live and self.callback.running:
             self.callback.stop()
@@ -0,0 +1,72 @@
+"""
+Houses the table of attenuator positions for every wavelength and power of a scan
+"""
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+
+class PositionTable:
+    """
+    Positions from the reversed calibration for every wavelength and power of a scan, computed once before the scan.
+    Looking up a step is a dictionary and an array read instead of label indexing, and positions the attenuator
+    can't move to are known up front
+    """
+
+    def __init__(self, pc_reverse: xr.DataArray, wavelengths: np.ndarray, powers: np.ndarray,
+                 bounds: tuple = (-360, 360)):
+        """
+        :param pc_reverse: reversed calibration returned by utils.interpolate
+        :type pc_reverse: xr.DataArray
+        :param wavelengths: wavelengths of the scan
+        :type wavelengths: np.ndarray
+        :param powers: powers of the scan
+        :type powers: np.ndarray
+        :param bounds: positions the attenuator can move to, exclusive
+        :type bounds: tuple
+        """
+        table = pc_reverse.reindex(wavelength=wavelengths, power=powers)  # NaN where the calibration has no value
+        self.positions = np.asarray(table.transpose("wavelength", "power").values, dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            self.valid = np.isfinite(self.positions) & (self.positions > bounds[0]) & (self.positions < bounds[1])
+        self.wavelengths = {value: i for i, value in enumerate(np.asarray(wavelengths).tolist())}
+        self.powers = {value: i for i, value in enumerate(np.asarray(powers).tolist())}
+
+    def __call__(self, wavelength: float, power: float) -> Optional[float]:
+        """
+        :param wavelength: wavelength of the step
+        :param power: power of the step
+        :return: position, None if the attenuator can't move there
+        :rtype: Optional[float]
+        """
+        i, j = self.wavelengths[wavelength], self.powers[power]
+        if self.valid[i, j]:
+            return float(self.positions[i, j])
+        return None
+
+    def invalid(self) -> list:
+        """
+        :return: wavelength, power and position of every step the attenuator can't move to
+        :rtype: list
+        """
+        wavelengths, powers = list(self.wavelengths), list(self.powers)
+        return [(wavelengths[i], powers[j], float(self.positions[i, j])) for i, j in np.argwhere(~self.valid)]
+
+    def report(self, limit: int = 10) -> str:
+        """
+        Summary of the steps the attenuator can't move to, printed before the scan
+        :param limit: steps listed
+        :return: summary, empty if every position is valid
+        :rtype: str
+        """
+        invalid = self.invalid()
+        if not invalid:
+            return ""
+        lines = [f"{len(invalid)} of {self.valid.size} wavelength/power steps are outside the calibration, the "
+                 f"attenuator won't move for them:"]
+        lines += [f"  wavelength {wavelength}, power {power}: {position}"
+                  for wavelength, power, position in invalid[:limit]]
+        if len(invalid) > limit:
+            lines.append(f"  and {len(invalid) - limit} more")
+        return "\n".join(lines)
@@ -1,11 +1,12 @@
-import time
+from functools import partial
 
-import neogiinstruments
 import numpy as np
-import panel as pn
 import param
 
 from ..ensemblebase import EnsembleBase, Coordinate, Coordinates
+from ..scheduler import Action
+from ..settle import wavelength_reached, position_reached
+from ... import backend
 
 name = "WavelengthPoweredCalib"
 
@@ -19,37 +20,57 @@ class Ensemble(EnsembleBase):
     pstep = param.Number(default=0.5)
     pwait = param.Integer(default=1)
     mai_time = param.Integer(default=30)
+    settle_floor = param.Number(default=1, doc="Minimum seconds the MaiTai settles for, rotator waits end as soon "
+                                                   "as it reports its position")
     type = name
     data = "WavelengthPoweredCalib"
     dimensions = ["wavelength", "Polarization"]
     cap_coords = []
     loop_coords = ["wavelength", "Polarization"]
     datasets = ["Pwr", "Pwrstd", "Vol", "Volstd"]
+    dtypes = np.float32
     debug = param.Boolean(default=False)
     live = False
     def start(self):
-        self.rotator.home()
+        self.rotator.instrument.home()
     def __init__(self):
         super().__init__()
         self.filename = "calib/WavelengthPowerCalib.zarr"
+        neogiinstruments = backend.instruments()
         self.rotator = neogiinstruments.rotator("rotator")
         self.MaiTai = neogiinstruments.MaiTai()
         self.PowerMeter = neogiinstruments.PowerMeter()
         self.Photodiode = neogiinstruments.Photodiode()
 
-    def wav_step(self, xs):
+    def tune(self, xs):
         if self.debug:
             print(f'moving to {xs[0]}')
         self.MaiTai.instrument.Set_Wavelength(xs[0])
-        time.sleep(self.mai_time)
-        self.pol_step(xs)
-        if not self.debug:
-            time.sleep(10)
+        fallback = self.mai_time if self.debug else self.mai_time + 10
+        elapsed = self.settler.wait("MaiTai", wavelength_reached(self.MaiTai, xs[0]), fallback, self.settle_floor)
+        if self.debug:
+            print(f"MaiTai settled in {elapsed:.1f} s")
+
+    def open_shutter(self, xs):
         self.MaiTai.instrument.Shutter(1)
         if self.debug:
             print(f'starting loop at {xs[0]}')
         if not self.debug:
-            time.sleep(5)
+            self.settler.wait("shutter", None, 5)
+
+    def wav_step(self, xs):
+        self.tune(xs)
+        self.pol_step(xs)
+        self.open_shutter(xs)
+
+    def actions(self, coords, dim):
+        """
+        Rotates while the MaiTai tunes, the shutter opens once both are done
+        """
+        if dim == "wavelength":
+            return [Action("MaiTai", partial(self.tune, coords)), Action("rotator", partial(self.pol_step, coords)),
+                    Action("shutter", partial(self.open_shutter, coords), depends=["MaiTai", "rotator"])]
+        return super().actions(coords, dim)
 
     def initialize(self):
         self.initialized = True
@@ -75,9 +96,12 @@ class Ensemble(EnsembleBase):
         if self.debug:
             print(f"moving to {pol}")
         self.rotator.instrument.move_abs(pol)
-        time.sleep(self.pwait)
+        self.settler.wait("rotator", position_reached(self.rotator, pol), self.pwait)
+
+    def durations(self):
+        return {"wavelength": self.mai_time + 15 + self.pwait, "Polarization": self.pwait}
 
-    def get_frame(self, coords):
+    def get_frame(self, coords, out=None):
         if self.debug:
             print("Gathering power data")
         p = self.PowerMeter.instrument.PowAvg()
@@ -91,6 +115,7 @@ class Ensemble(EnsembleBase):
         return {"Pwr": Pwr, "Pwrstd": Pwrstd, "Vol": V, "Volstd": Vstd}
 
     def widgets(self):
+        import panel as pn
         if self.initialized:
             return pn.Column(self.rotator.view, self.PowerMeter.view, self.Photodiode.view, self.MaiTai.view)
         else:
@@ -1,17 +1,28 @@
 import time
+from functools import lru_cache, partial
 
-import holoviews as hv
-import neogiinstruments
 import numpy as np
-import panel as pn
 import param
 
 from ..ensemblebase import EnsembleBase, Coordinate, Coordinates
-from ... import utils
+from ..positions import PositionTable
+from ..scheduler import Action
+from ..settle import wavelength_reached, position_reader
+from ... import utils, backend, harmonics
 
 name = "RASHG"
 
-hv.extension('bokeh')
+
+@lru_cache(maxsize=None)
+def colormaps() -> tuple:
+    """
+    Colormaps for the graph, listed once holoviews is imported by graph() or widgets()
+
+    :return: names of the colormaps
+    :rtype: tuple
+    """
+    import holoviews as hv
+    return tuple(hv.plotting.util.list_cmaps())
 
 
 def get_calibs() -> list:
@@ -21,7 +32,7 @@ def get_calibs() -> list:
     :return: list of all calibration files
     :rtype: list of PosixPath
     """
-    return list(utils.scan_directory({"WavelengthPoweredCalib": None}).keys())
+    return list(utils.scan_directory({"WavelengthPoweredCalib": None}, complete=True).keys())
 
 
 class Ensemble(EnsembleBase):
@@ -41,18 +52,27 @@ class Ensemble(EnsembleBase):
     exp_time = param.Number(default=10000)
     escape_delay = param.Integer(default=120)  # should beep at 45
     wavwait = param.Number(default=5)
+    settle_floor = param.Number(default=1)
+    fly_scan = param.Boolean(default=False, doc="Rotate the polarization continuously and bin frames onto the "
+                                                "Polarization grid instead of stepping")
+    fly_speed = param.Number(default=10, bounds=(0, None), inclusive_bounds=(False, True),
+                             doc="Degrees per second while fly scanning")
     debug = param.Boolean(default=False)
     live = param.Boolean(default=True)
-    colorMap = param.ObjectSelector(default="fire", objects=hv.plotting.util.list_cmaps())
-    cam = neogiinstruments.camera("Camera")
-    rbot, rtop, atten = [neogiinstruments.rotator(name) for name in ["rbot", "rtop", "atten"]]
-    MaiTai = neogiinstruments.MaiTai("MaiTai")
+    # every holoviews colormap is listed by graph() and widgets(), holoviews isn't imported when gathering data headless
+    colorMap = param.ObjectSelector(default="fire", objects=["fire"], check_on_set=False)
     type = name
     data = "RASHG"
     dimensions = ["wavelength", "power", "Orientation", "Polarization", "x", "y"]
     cap_coords = ["x", "y"]
+    dtypes = np.uint16  # camera frames
+    orderings = {"power": "serpentine", "Polarization": "serpentine"}
+    reductions = {"navigation": ("ds1", ["Polarization"]), "heatmap_all": ("ds1", ["x", "y"])}  # for the visualizer
+    fit = ("heatmap_all", utils.rashg, harmonics.PARAM_NAMES, {"maxfev": 10000, "xtol": 10 ** -9, "ftol": 10 ** -9},
+           harmonics.seed)  # same fit as the visualizer
     loop_coords = ["wavelength", "power", "Orientation", "Polarization"]
     calibration_file = param.ObjectSelector()
+    file_selectors = {"calibration_file": "WavelengthPoweredCalib"}
 
     @param.depends("debug", watch=True)
     def no_wait(self):
@@ -77,8 +97,10 @@ class Ensemble(EnsembleBase):
         self.param["calibration_file"].objects = files
         self.param["calibration_file"].default = files[0]
         super().__init__()
-        self.xDim = hv.Dimension('x', unit="micrometers")
-        self.yDim = hv.Dimension('y', unit="micrometers")
+        neogiinstruments = backend.instruments()
+        self.cam = neogiinstruments.camera("Camera")
+        self.rbot, self.rtop, self.atten = [neogiinstruments.rotator(name) for name in ["rbot", "rtop", "atten"]]
+        self.MaiTai = neogiinstruments.MaiTai("MaiTai")
 
     def initialize(self):
         self.initialized = True
@@ -87,6 +109,19 @@ class Ensemble(EnsembleBase):
             if not param in exclude:
                 self.param[param].constant = True
 
+        if self.fly_scan:
+            for rotator in [self.rbot, self.rtop]:
+                if not hasattr(rotator.instrument, "move_continuous"):
+                    raise ValueError("Fly scanning needs rotators supporting move_continuous")
+            self.loop_coords = ["wavelength", "power", "Orientation"]
+            self.datasets = ["ds1", "counts"]
+            self.dimensions = {"ds1": Ensemble.dimensions,
+                               "counts": ["wavelength", "power", "Orientation", "Polarization"]}
+            self.cap_coords = {"ds1": ["Polarization", "x", "y"], "counts": ["Polarization"]}
+            self.dtypes = {"ds1": np.uint16, "counts": np.uint32}
+            self.orderings = {"power": "serpentine"}
+            self.reductions = {name: (dataset, reduce, "counts")  # bins without a frame are left out
+                               for name, (dataset, reduce) in Ensemble.reductions.items()}
         self.cam.instrument.roi(self.x1, self.x2, self.y1, self.y2)
         self.cam.instrument.binning(self.xbin, self.ybin)
         if self.xbin != self.ybin:
@@ -124,8 +159,12 @@ class Ensemble(EnsembleBase):
         self.Polarization_radians = np.arange(0, 360, self.pol_step, dtype=np.uint16) * np.pi / 180
         self.pwr = np.arange(self.pow_start, self.pow_stop, self.pow_step, dtype=np.uint16)
         self.pc_reverse = utils.interpolate(self.calibration_file, self.pwr)
+        self.atten_positions = PositionTable(self.pc_reverse, self.wavelength, self.pwr)
+        report = self.atten_positions.report()
+        if report:
+            print(report)
 
-    def get_frame(self, coords):
+    def pol_positions(self, coords):
         o = coords[2]
         p = coords[3] * 180 / np.pi
         if o == 1:
@@ -133,43 +172,160 @@ class Ensemble(EnsembleBase):
         else:
             sys_offset = 0
         pos = p * 180 / np.pi
-        pos_top = int(pos + sys_offset)
-        pos_bot = int(pos)
+        return int(pos + sys_offset), int(pos)
+
+    def move_top(self, pos_top):
         if self.debug:
             print(f"Moving A to {pos_top}")
         self.rtop.instrument.move_abs(pos_top)
+
+    def move_bot(self, pos_bot):
         if self.debug:
             print(f"Moving B to {pos_bot}")
         self.rbot.instrument.move_abs(pos_bot)
+
+    def actions(self, coords, dim):
+        """
+        The polarization rotators, the attenuator and the MaiTai are independent and move at the same time.
+        Fly scans move the rotators to the start of the sweep
+        """
+        if self.fly_scan:
+            pos_top, pos_bot = (45 if coords[2] == 1 else 0), 0
+        else:
+            pos_top, pos_bot = self.pol_positions(coords)
+        actions = [Action("rtop", partial(self.move_top, pos_top)), Action("rbot", partial(self.move_bot, pos_bot))]
+        if dim in ["wavelength", "power"]:
+            actions.append(Action("atten", partial(self.pow_step_func, coords)))
+        if dim == "wavelength":
+            actions.append(Action("MaiTai", partial(self.tune, coords)))
+        return actions
+
+    def durations(self):
+        if self.fly_scan:
+            return {"wavelength": self.wavwait, "frame": 360 / self.fly_speed + self.exp_time / 1000}
+        return {"wavelength": self.wavwait, "frame": self.exp_time / 1000}
+
+    def get_frame(self, coords, out=None):
         if self.debug:
             print(f"Capturing frame")
-        self.cache = self.live_call()
-        return {"ds1": self.cache}
+        if self.fly_scan:
+            return self.fly(out)
+        if out is None:
+            self.cache = self.live_call()
+            return {"ds1": self.cache}
+        self.cache = self.live_call(out["ds1"])
+        return out
+
+    def fly(self, out=None):
+        """
+        Rotates both polarization rotators through a full turn while capturing frames. Every frame is placed at the
+        position of the bottom rotator halfway through its exposure, read from the encoder or computed from the
+        commanded speed if the rotator can't report its position, and averaged into the nearest bin of the
+        Polarization grid. Binning as frames arrive gives the same result as binning afterwards without keeping every
+        frame. Bins which got no frame keep the fill value and a count of 0, the reductions leave them out
+        :param out: views into the chunk buffer
+        :return: mean frame and number of frames for every bin of Polarization
+        """
+        bins = len(self.Polarization)
+        read = position_reader(self.rbot)
+        sums = None
+        counts = np.zeros(bins, dtype=np.uint32)
+        travelled = 0.0
+        start = time.monotonic()
+        last = read() if read is not None else 0.0
+
+        def advance() -> float:
+            nonlocal travelled, last
+            if read is None:
+                return self.fly_speed * (time.monotonic() - start)
+            position = read()
+            step = (position - last) % 360  # never half a turn between reads, wrapped into (-180, 180]
+            if step > 180:
+                step -= 360
+            if step > 0:  # rotating forwards, a reading slightly behind the last one is encoder jitter
+                travelled += step
+                last = position
+            return travelled
+
+        self.rbot.instrument.move_continuous(self.fly_speed)
+        self.rtop.instrument.move_continuous(self.fly_speed)
+        try:
+            before = advance()
+            while before < 360:
+                frame = self.live_call()
+                after = advance()
+                position = (before + after) / 2
+                if sums is None:
+                    sums = np.zeros((bins,) + frame.shape, dtype=np.float64)
+                index = int(round(position / self.pol_step)) % bins
+                sums[index] += frame
+                counts[index] += 1
+                before = after
+        finally:
+            self.rbot.instrument.stop()
+            self.rtop.instrument.stop()
+        self.cache = frame
+        empty = np.count_nonzero(counts == 0)
+        if empty:
+            print(f"{empty} of {bins} polarization bins got no frame, slow down fly_speed or shorten exp_time")
+        mean = np.rint(sums / np.maximum(counts, 1)[:, np.newaxis, np.newaxis])
+        if out is None:  # like a freshly allocated chunk buffer
+            out = {"ds1": np.zeros(sums.shape, dtype=np.uint16), "counts": np.zeros(bins, dtype=np.uint32)}
+        np.copyto(out["ds1"], mean, casting="unsafe", where=(counts > 0)[:, np.newaxis, np.newaxis])
+        np.copyto(out["counts"], counts)
+        return out
+
+    def update(self, data):
+        if self.fly_scan:
+            self.cache = data["ds1"].mean(axis=0, dtype=np.float64)
+            return
+        self.cache = data["ds1"]
 
     def pow_step_func(self, xs):
         pw = xs[1]
         w = xs[0]
-        atten_pos = self.pc_reverse.sel(wavelength=w, power=pw)  # technically can interp here again but don't need to
-        if -360 < atten_pos < 360:
+        atten_pos = self.atten_positions(w, pw)
+        if atten_pos is not None:
             self.atten.instrument.move_abs(atten_pos)
 
+    def _list_colormaps(self):
+        selector = self.param["colorMap"]
+        listed = colormaps()
+        if not set(listed).issubset(selector.objects):
+            selector.objects = list(listed) + [name for name in selector.objects if name not in listed]
+
     def graph(self, live=False):
+        import holoviews as hv
+        self._list_colormaps()
         if live:
             self.cache = self.live_call()
         output = self.cache
         self.zdim = hv.Dimension('Intensity', range=(output.min(), output.max()))
         opts = [hv.opts.Image(colorbar=True, cmap=self.colorMap, tools=['hover'], framewise=True, logz=True)]
-        return hv.Image(output, vdims=self.zdim).opts(opts).redim(x=self.xDim, y=self.yDim)
+        x_dim = hv.Dimension('x', unit="micrometers")
+        y_dim = hv.Dimension('y', unit="micrometers")
+        return hv.Image(output, vdims=self.zdim).opts(opts).redim(x=x_dim, y=y_dim)
 
-    def live_call(self):
-        return self.cam.instrument.get_frame(exp_time=self.exp_time)
+    def live_call(self, out=None):
+        frame = self.cam.instrument.get_frame(exp_time=self.exp_time)
+        if out is None:
+            return frame
+        np.copyto(out, frame, casting="unsafe")
+        return out
 
-    def wav_step(self, xs):
-        time.sleep(self.wavwait)
+    def tune(self, xs):
         self.MaiTai.instrument.Set_Wavelength(xs[0])
+        elapsed = self.settler.wait("MaiTai", wavelength_reached(self.MaiTai, xs[0]), self.wavwait, self.settle_floor)
+        if self.debug:
+            print(f"MaiTai settled in {elapsed:.1f} s")
+
+    def wav_step(self, xs):
+        self.tune(xs)
         self.pow_step_func(xs)
 
     def widgets(self):
+        import panel as pn
+        self._list_colormaps()
         if self.initialized:
             return pn.Column(self.atten.view, self.rbot.view, self.rtop.view, self.cam.view, self.MaiTai.view)
         else:
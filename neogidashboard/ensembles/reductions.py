@@ -0,0 +1,73 @@
+"""
+Houses the running means kept while gathering data
+"""
+from typing import Optional
+
+import numpy as np
+
+from .store import Store
+
+
+class Reduction:
+    """
+    Running mean of a dataset over some of its dimensions, updated with every frame so it is ready when the scan
+    finishes without another pass over the data
+    """
+
+    def __init__(self, name: str, dataset: str, reduce: list, store: Store, mask: Optional[str] = None):
+        """
+        :param name: name of the reduced dataset written to the store
+        :type name: str
+        :param dataset: dataset to reduce
+        :type dataset: str
+        :param reduce: dimensions averaged over
+        :type reduce: list
+        :param store: store the dataset is written to
+        :type store: Store
+        :param mask: dataset marking the slots of a frame which got data with anything but 0, EX: the frame counts of a
+                     fly scan. Its captured dimensions must be captured dimensions of dataset
+        :type mask: Optional[str]
+        """
+        self.name = name
+        self.dataset = dataset
+        self.mask = mask
+        dims = store.dimensions[dataset]
+        self.dims = [dim for dim in dims if dim not in reduce]  # dimensions of the result
+        loop = set(store.loop_dims)
+        captured = [dim for dim in dims if dim not in loop]
+        self.axes = tuple(i for i, dim in enumerate(captured) if dim in reduce)  # frame axes averaged over
+        self.per_frame = int(np.prod([store.sizes[dim] for dim in captured if dim in reduce]))
+        self._recipe = [store.loop_dims.index(dim) if dim in loop else slice(None) for dim in self.dims]
+        self.sums = np.zeros([store.sizes[dim] for dim in self.dims], dtype=np.float64)
+        if mask is None:
+            self.counts = np.zeros([store.sizes[dim] if dim in loop else 1 for dim in self.dims], dtype=np.int64)
+        else:  # slots are counted one by one
+            self.counts = np.zeros(self.sums.shape, dtype=np.int64)
+            masked = [dim for dim in store.dimensions[mask] if dim not in loop]
+            self._mask_shape = tuple(store.sizes[dim] if dim in masked else 1 for dim in captured)
+
+    def add(self, frame: np.ndarray, indices: tuple, mask: Optional[np.ndarray] = None) -> None:
+        """
+        Adds a frame
+        :param frame: frame of the dataset
+        :param indices: indices of the loop coordinates
+        :param mask: frame of the mask dataset, slots where it is 0 got no data and are left out
+        :rtype: None
+        """
+        position = tuple(indices[item] if isinstance(item, int) else item for item in self._recipe)
+        if mask is None:
+            self.sums[position] += np.sum(frame, axis=self.axes, dtype=np.float64)
+            self.counts[position] += self.per_frame
+            return
+        valid = np.broadcast_to(np.reshape(mask != 0, self._mask_shape), np.shape(frame))
+        self.sums[position] += np.sum(frame, axis=self.axes, dtype=np.float64, where=valid)
+        self.counts[position] += np.count_nonzero(valid, axis=self.axes)
+
+    def result(self, position: tuple = ()) -> np.ndarray:
+        """
+        :param position: indices of the leading dimensions to select, everything by default
+        :return: mean, NaN where no frame was added
+        :rtype: np.ndarray
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.counts[position] > 0, self.sums[position] / self.counts[position], np.nan)
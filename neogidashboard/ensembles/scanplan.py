@@ -0,0 +1,178 @@
+"""
+Houses the scan plan, computed once before data is gathered
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .ensemblebase import Coordinates
+from .. import utils
+
+
+@dataclass
+class Step:
+    """
+    A single frame of the scan
+    """
+    indices: tuple  # index along every loop coordinate
+    coords: tuple  # value of every loop coordinate
+    changed: int  # position in loop_coords of the outermost loop coordinate that changed
+    chunk: tuple  # indices of the outer loop coordinates, selects the chunk of the store
+    duration: float  # estimated seconds
+
+
+ORDERINGS = ["ascending", "serpentine", "nearest"]
+
+
+class ScanPlan:
+    """
+    Ordered list of every step of the scan with the loop coordinate changing at each step, the chunk each step is
+    written to and an estimated duration. Replaces comparing coordinates on every step, so loop coordinates with a
+    single value or decreasing values work.
+    Every loop coordinate can be swept in one of the orderings:
+
+    * ascending: from the first to the last value every sweep
+    * serpentine: reverses direction every sweep, so the instrument never travels back across the range
+    * nearest: starts at the value nearest to where the previous sweep ended and always moves to the nearest value left
+
+    Orderings only reorder values within a sweep, so every chunk is still gathered in one piece
+    """
+
+    def __init__(self, coordinates: Coordinates, loop_coords: list, depth: int, durations: dict = None,
+                 orderings: dict = None):
+        """
+        :param coordinates: coordinates of the ensemble
+        :type coordinates: Coordinates
+        :param loop_coords: names of the loop coordinates, outermost first
+        :type loop_coords: list
+        :param depth: number of outer loop coordinates selecting a chunk
+        :type depth: int
+        :param durations: estimated seconds for a step, keyed by the loop coordinate that changed. "frame" is added to
+        every step
+        :type durations: dict
+        :param orderings: ordering of the loop coordinates, ascending if not specified
+        :type orderings: dict
+        """
+        self.loop_coords = loop_coords
+        self.depth = depth
+        self.durations = durations or {}
+        self.orderings = orderings or {}
+        for coord, ordering in self.orderings.items():
+            if coord not in loop_coords:
+                print(f"{coord} isn't a loop coordinate, ignoring its ordering")
+            if ordering not in ORDERINGS:
+                raise ValueError(f"Unknown ordering {ordering}, choose from {ORDERINGS}")
+        self.ranges = [np.asarray(coordinates[coord].values) for coord in loop_coords]
+        self.steps = self._gen_steps(self._gen_order())
+        self.elapsed = np.cumsum([step.duration for step in self.steps])  # estimated seconds at the end of every step
+
+    def _gen_order(self):
+        """
+        Generates the indices of every step, sweeping every loop coordinate in its ordering
+        :return: generator of index tuples
+        """
+        if any(len(values) == 0 for values in self.ranges):
+            return
+        last = [None] * len(self.ranges)
+        sweeps = [0] * len(self.ranges)
+
+        def sweep(axis: int) -> list:
+            values = self.ranges[axis]
+            ordering = self.orderings.get(self.loop_coords[axis], "ascending")
+            order = list(range(len(values)))
+            if ordering == "serpentine" and sweeps[axis] % 2:
+                order.reverse()
+            elif ordering == "nearest" and last[axis] is not None:
+                order = []
+                left = np.ones(len(values), dtype=bool)
+                position = values[last[axis]]
+                while left.any():
+                    distance = np.where(left, np.abs(values - position), np.inf)
+                    index = int(np.argmin(distance))
+                    order.append(index)
+                    left[index] = False
+                    position = values[index]
+            sweeps[axis] += 1
+            return order
+
+        def walk(axis: int, prefix: tuple):
+            for index in sweep(axis):
+                last[axis] = index
+                if axis == len(self.ranges) - 1:
+                    yield prefix + (index,)
+                else:
+                    yield from walk(axis + 1, prefix + (index,))
+
+        yield from walk(0, ())
+
+    def _gen_steps(self, order) -> list[Step]:
+        """
+        Generates the steps for an order of indices
+        :param order: iterable of index tuples
+        :return: steps
+        """
+        frame = self.durations.get("frame", 0)
+        steps = []
+        previous = None
+        for indices in order:
+            if previous is None:
+                changed = 0
+            else:
+                changed = next(i for i, (new, old) in enumerate(zip(indices, previous)) if new != old)
+            coords = tuple(values[index] for values, index in zip(self.ranges, indices))
+            duration = self.durations.get(self.loop_coords[changed], 0) + frame
+            steps.append(Step(indices, coords, changed, indices[:self.depth], duration))
+            previous = indices
+        return steps
+
+    def __iter__(self):
+        yield from self.steps
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    @property
+    def estimate(self) -> float:
+        """
+        :return: estimated seconds for the whole scan
+        :rtype: float
+        """
+        return float(self.elapsed[-1]) if self.steps else 0.0
+
+    def remaining(self, step: int) -> float:
+        """
+        Estimated seconds left after a step
+        :param step: number of the step
+        :type step: int
+        :return: seconds
+        :rtype: float
+        """
+        return self.estimate - float(self.elapsed[step])
+
+    def describe(self) -> str:
+        """
+        Summary of the plan, printed before the scan and for dry runs
+        :return: summary
+        :rtype: str
+        """
+        sizes = ", ".join(f"{coord}: {len(values)}" for coord, values in zip(self.loop_coords, self.ranges))
+        chunks = len({step.chunk for step in self.steps})
+        changes = np.bincount([step.changed for step in self.steps], minlength=len(self.loop_coords))
+        moves = ", ".join(f"{coord}: {count}" for coord, count in zip(self.loop_coords, changes))
+        travel = ", ".join(f"{coord}: {distance:g}" for coord, distance in self.travel().items())
+        return (f"{len(self.steps)} frames ({sizes}) in {chunks} chunks\n"
+                f"outermost change per step: {moves}\n"
+                f"travel: {travel}\n"
+                f"estimated time: {utils.convert(self.estimate)}")
+
+    def travel(self) -> dict:
+        """
+        Total distance every loop coordinate travels over the scan, in the units of the coordinate
+        :return: mapping from loop coordinate to distance
+        :rtype: dict
+        """
+        if not self.steps:
+            return {coord: 0.0 for coord in self.loop_coords}
+        coords = np.array([step.coords for step in self.steps], dtype=np.float64)
+        distance = np.abs(np.diff(coords, axis=0)).sum(axis=0)
+        return {coord: float(value) for coord, value in zip(self.loop_coords, distance)}
@@ -0,0 +1,75 @@
+"""
+Houses the scheduler running independent instrument moves at the same time
+"""
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Action:
+    """
+    Definition of something a device does before a frame is captured
+    """
+    name: str
+    function: Callable[[], None]
+    depends: list[str] = field(default_factory=list)
+
+
+class Scheduler:
+    """
+    Runs actions on a thread pool. Every action starts as soon as the actions it depends on have finished, so
+    independent devices move at the same time
+    """
+
+    def __init__(self, workers: int = 4):
+        """
+        :param workers: maximum number of actions running at once
+        :type workers: int
+        """
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scheduler")
+
+    @staticmethod
+    def _after(futures: list, function: Callable[[], None]) -> float:
+        """
+        Runs function once futures have finished
+        :param futures: futures of the dependencies
+        :param function: function to run
+        :return: seconds function took, not counting the wait for dependencies
+        :rtype: float
+        """
+        for future in futures:
+            future.result()
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+    def run(self, actions: list[Action]) -> dict:
+        """
+        Runs actions and waits for all of them. Dependencies must be listed before their dependents, the pool is
+        first in first out so a dependency is always running or finished by the time its dependent gets a thread.
+        Dependencies on devices which aren't part of this step are ignored
+        :param actions: actions to run
+        :type actions: list[Action]
+        :return: seconds every action took
+        :rtype: dict
+        """
+        futures = {}
+        submitted = []
+        for action in actions:
+            depends = [futures[name] for name in action.depends if name in futures]
+            futures[action.name] = self.pool.submit(self._after, depends, action.function)
+            submitted.append(futures[action.name])
+        wait(submitted)
+        for future in submitted:
+            future.result()
+        return {name: future.result() for name, future in futures.items()}
+
+    def shutdown(self) -> None:
+        """
+        Stops the threads
+
+        :rtype: None
+        """
+        self.pool.shutdown()
@@ -0,0 +1,143 @@
+"""
+Houses the readiness layer replacing fixed sleeps while instruments settle
+"""
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Optional
+
+from .. import utils
+
+
+@dataclass
+class Wait:
+    """
+    Record of a single wait
+    """
+    name: str
+    elapsed: float
+    settled: bool  # False if the instrument timed out or can't report whether it settled
+
+
+class Settler:
+    """
+    Polls instruments until they report settled instead of sleeping a fixed time. Keeps a record of every wait
+    """
+
+    def __init__(self, poll: float = 0.1):
+        """
+        :param poll: seconds between polls
+        :type poll: float
+        """
+        self.poll = poll
+        self.waits: list[Wait] = []
+        self.lock = threading.Lock()
+
+    def wait(self, name: str, ready: Optional[Callable[[], bool]], fallback: float, floor: float = 0) -> float:
+        """
+        Waits until ready returns True, for at least floor and at most fallback seconds. Instruments that can't
+        report whether they settled (ready is None or raises) wait the full fallback like a fixed sleep
+        :param name: name of the instrument, used in the record
+        :type name: str
+        :param ready: returns True once the instrument settled
+        :type ready: Callable[[], bool]
+        :param fallback: timeout, and the fixed wait for instruments that can't report
+        :type fallback: float
+        :param floor: minimum wait
+        :type floor: float
+        :return: seconds waited
+        :rtype: float
+        """
+        start = time.monotonic()
+        settled = False
+        if ready is not None:
+            try:
+                while time.monotonic() - start < fallback:
+                    if ready() and time.monotonic() - start >= floor:
+                        settled = True
+                        break
+                    time.sleep(self.poll)
+            except Exception as ex:
+                print(f"{name} can't report whether it settled, waiting {fallback} s. Exception {ex}")
+        remaining = (floor if settled else fallback) - (time.monotonic() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+        elapsed = time.monotonic() - start
+        with self.lock:
+            self.waits.append(Wait(name, elapsed, settled))
+        return elapsed
+
+    def summary(self) -> dict:
+        """
+        Total time spent waiting on every instrument
+        :return: mapping from instrument to number of waits, number of settled waits and total seconds
+        :rtype: dict
+        """
+        summary = {}
+        with self.lock:
+            for record in self.waits:
+                count, settled, total = summary.get(record.name, (0, 0, 0.0))
+                summary[record.name] = (count + 1, settled + record.settled, total + record.elapsed)
+        return summary
+
+    def report(self) -> None:
+        """
+        Prints the summary
+
+        :rtype: None
+        """
+        for name, (count, settled, total) in self.summary().items():
+            print(f"{name}: {count} waits, {settled} settled early, {total / count:.2f} s average, "
+                  f"{utils.convert(total)} total")
+
+
+def wavelength_reached(maitai, wavelength: float, tolerance: float = 1) -> Optional[Callable[[], bool]]:
+    """
+    Readiness check for the MaiTai locking onto a wavelength
+    :param maitai: MaiTai from neogiinstruments
+    :param wavelength: target wavelength
+    :param tolerance: allowed difference in nanometers
+    :return: readiness check or None if the MaiTai can't report its wavelength
+    """
+    get_wavelength = getattr(maitai.instrument, "Get_Wavelength", None)
+    if get_wavelength is None:
+        return None
+    return lambda: abs(get_wavelength() - wavelength) <= tolerance
+
+
+def position_reader(rotator) -> Optional[Callable[[], float]]:
+    """
+    Reads the position of a rotator
+    :param rotator: rotator from neogiinstruments
+    :return: function returning the position in degrees or None if the rotator can't report its position
+    """
+    for attribute in ["get_position", "position"]:
+        get_position = getattr(rotator.instrument, attribute, None)
+        if get_position is not None:
+            if not callable(get_position):
+                return lambda: float(getattr(rotator.instrument, attribute))
+            return lambda: float(get_position())
+    return None
+
+
+def position_reached(rotator, position: float, tolerance: float = 0.1) -> Optional[Callable[[], bool]]:
+    """
+    Readiness check for a rotator reaching a position
+    :param rotator: rotator from neogiinstruments
+    :param position: target position in degrees
+    :param tolerance: allowed difference in degrees
+    :return: readiness check or None if the rotator can't report its position
+    """
+    read = position_reader(rotator)
+    if read is None:
+        return None
+    return lambda: _angle_within(read(), position, tolerance)
+
+
+def _angle_within(current: float, target: float, tolerance: float) -> bool:
+    """
+    Compares angles in degrees
+    """
+    difference = (float(current) - float(target)) % 360
+    return min(difference, 360 - difference) <= tolerance
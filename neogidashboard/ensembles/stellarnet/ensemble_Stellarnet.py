@@ -1,14 +1,20 @@
-import time
 from array import array
+from functools import partial
 
-import neogiinstruments
 import numpy as np
-import panel as pn
 import param
-import stellarnet
 
 from ..ensemblebase import EnsembleBase, Coordinate, Coordinates
-from ... import utils
+from ..positions import PositionTable
+from ..scheduler import Action
+from ..settle import wavelength_reached, position_reached
+from ... import utils, backend
+
+try:
+    from stellarnet import NotFoundError
+except ImportError:  # only the simulated backend works without the stellarnet driver
+    class NotFoundError(Exception):
+        pass
 
 name = "stellarnet"
 
@@ -20,7 +26,7 @@ def get_calibs() -> list:
     :return: list of all calibration files
     :rtype: list of PosixPath
     """
-    return list(utils.scan_directory({"WavelengthPoweredCalib": None}).keys())
+    return list(utils.scan_directory({"WavelengthPoweredCalib": None}, complete=True).keys())
 
 
 class Ensemble(EnsembleBase):
@@ -32,16 +38,21 @@ class Ensemble(EnsembleBase):
     pstep = param.Number(default=0.5)
     mai_time = param.Integer(default=30)
     pwait = param.Integer(default=1)
+    settle_floor = param.Number(default=1, doc="Minimum seconds the MaiTai settles for, rotator waits end as soon "
+                                                   "as it reports its position")
     type = name
     data = "stellarnet"
     datasets = ["Stellarnet", "V", "Vstd"]
     dimensions = {"Stellarnet": ["wavelength", "power", "emission_wavelength"], "V": ["wavelength", "power"],
                   "Vstd": ["wavelength", "power"]}
     cap_coords = {"Stellarnet": ["emission_wavelength"], "V": [], "Vstd": []}
+    dtypes = np.float32
+    orderings = {"power": "serpentine"}
     loop_coords = ["wavelength", "power"]
     debug = param.Boolean(default=False)
     live = False
     calibration_file = param.ObjectSelector()
+    file_selectors = {"calibration_file": "WavelengthPoweredCalib"}
 
     def __init__(self):
         files = get_calibs()
@@ -51,12 +62,13 @@ class Ensemble(EnsembleBase):
         self.param["calibration_file"].default = files[0]
         super().__init__()
         self.filename = "data/stellarnet.zarr"
+        neogiinstruments = backend.instruments()
         self.rotator = neogiinstruments.rotator("rotator")
         self.MaiTai = neogiinstruments.MaiTai()
         try:
             self.StellarNet = neogiinstruments.StellarNet()
-        except stellarnet.NotFoundError:
-            raise stellarnet.NotFoundError("Can't run stellarnet without stellarnet")
+        except NotFoundError:
+            raise NotFoundError("Can't run stellarnet without stellarnet")
         self.Photodiode = neogiinstruments.Photodiode()
         self.coords = Coordinates([
             Coordinate("wavelength", "nanometer", "wavelength", step_function=self.wav_step),
@@ -64,19 +76,35 @@ class Ensemble(EnsembleBase):
             Coordinate("emission_wavelength", "nanometers", "emission_wavelength")]
         )
 
-    def wav_step(self, xs):
+    def tune(self, xs):
         self.MaiTai.instrument.Set_Wavelength(xs[0])
         if self.debug:
             print(f'moving to {xs[0]}')
-        time.sleep(self.mai_time)
-        self.pow_step(xs)
-        if not self.debug:
-            time.sleep(10)
+        fallback = self.mai_time if self.debug else self.mai_time + 10
+        elapsed = self.settler.wait("MaiTai", wavelength_reached(self.MaiTai, xs[0]), fallback, self.settle_floor)
+        if self.debug:
+            print(f"MaiTai settled in {elapsed:.1f} s")
+
+    def open_shutter(self, xs):
         self.MaiTai.instrument.Shutter(1)
         if self.debug:
             print(f'starting loop at {xs[0]}')
         if not self.debug:
-            time.sleep(5)
+            self.settler.wait("shutter", None, 5)
+
+    def wav_step(self, xs):
+        self.tune(xs)
+        self.pow_step(xs)
+        self.open_shutter(xs)
+
+    def actions(self, coords, dim):
+        """
+        Sets the power while the MaiTai tunes, the shutter opens once both are done
+        """
+        if dim == "wavelength":
+            return [Action("MaiTai", partial(self.tune, coords)), Action("rotator", partial(self.pow_step, coords)),
+                    Action("shutter", partial(self.open_shutter, coords), depends=["MaiTai", "rotator"])]
+        return super().actions(coords, dim)
 
     def initialize(self):
         self.initialized = True
@@ -98,23 +126,33 @@ class Ensemble(EnsembleBase):
         self.emission_length = len(emission_wavelength)
         self.coords["emission_wavelength"].values = emission_wavelength
         self.pc_reverse = utils.interpolate(self.calibration_file, pwr=power)
+        self.rotator_positions = PositionTable(self.pc_reverse, self.coords["wavelength"].values, power)
+        report = self.rotator_positions.report()
+        if report:
+            print(report)
 
     def pow_step(self, xs: array):
         pow = xs[1]
         wav = xs[0]
-        pol = self.pc_reverse.sel(power=pow, wavelength=wav).values
+        pol = self.rotator_positions(wav, pow)
         if self.debug:
             print(f"moving to {pol}")
-        if -360 < pol < 360:
+        if pol is not None:
             self.rotator.instrument.move_abs(pol)
-        time.sleep(self.pwait)
+            self.settler.wait("rotator", position_reached(self.rotator, pol), self.pwait)
+        else:
+            self.settler.wait("rotator", None, self.pwait)
+
+    def durations(self):
+        return {"wavelength": self.mai_time + 15 + self.pwait, "power": self.pwait}
 
-    def get_frame(self, coords):
+    def get_frame(self, coords, out=None):
         data = self.StellarNet.instrument.GetSpec()[1]
         V, Vstd = self.Photodiode.instrument.gather_data()
         return {"Stellarnet": data, "V": V, "Vstd": Vstd}
 
     def widgets(self):
+        import panel as pn
         if self.initialized:
             return pn.Column(self.rotator.view, self.StellarNet.view, self.MaiTai.view, self.Photodiode.view)
         else:
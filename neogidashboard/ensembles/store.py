@@ -0,0 +1,311 @@
+"""
+Houses the preallocated zarr store used while gathering data
+"""
+import os
+import time
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+import zarr
+
+from .ensemblebase import EnsembleBase
+
+compressor = zarr.Blosc(cname="zstd", clevel=3, shuffle=2)
+TIMESTAMP = "timestamp"  # coordinate holding the time every frame was captured
+COMPLETE = "complete"  # attribute set once every step was gathered, stores are preallocated with zeros before that
+
+
+def metadata(ensemble: EnsembleBase, institution: str, sample: str) -> dict:
+    """
+    Attributes of a new store: title, institution, sample, data type, time and the unit of every coordinate
+    :param ensemble: initialized ensemble
+    :type ensemble: EnsembleBase
+    :param institution: institution the data was gathered at
+    :type institution: str
+    :param sample: sample measured
+    :type sample: str
+    :return: attributes
+    :rtype: dict
+    """
+    attrs = {
+        "title": ensemble.title,
+        "institution": institution,
+        "sample": sample,
+        "source": ensemble.type,
+        "data_type": ensemble.data,
+        "time": time.strftime('%a, %d %b %Y %H:%M:%S', time.localtime()),
+        "fit_version": 0,
+        "data_version": 2
+    }
+    for coord in ensemble.coords:
+        attrs[coord.name] = coord.unit
+    return attrs
+
+
+def claim(ensemble: EnsembleBase) -> str:
+    """
+    Creates the directory of the store, numbering the filename of the ensemble if it already exists
+    :param ensemble: initialized ensemble, its filename is updated
+    :type ensemble: EnsembleBase
+    :return: filename
+    :rtype: str
+    """
+    fname = ensemble.filename
+    i = 2
+    while os.path.isdir(ensemble.filename):
+        ensemble.param["filename"].constant = False
+        ensemble.filename = fname.replace(".zarr", f"{i}.zarr")
+        i += 1
+        print(f"Zarr store exists, trying {ensemble.filename}")
+        ensemble.param["filename"].constant = True
+    os.makedirs(ensemble.filename)
+    return ensemble.filename
+
+
+class Store:
+    """
+    Zarr store created up front from the coordinates of an ensemble and filled by region writes.
+    The loop coordinates are split in two: the outer ``depth`` coordinates select a chunk, the inner ones are
+    gathered into the chunk buffer. Only one chunk is ever held in memory.
+    The time every frame was captured is kept in the timestamp coordinate along the loop dimensions
+    """
+
+    def __init__(self, filename: str, coords: dict, dimensions: dict, attrs: dict, loop_dims: list, depth: int = -1,
+                 dtypes: dict = None, fill_values: dict = None):
+        """
+        :param filename: zarr store to create
+        :type filename: str
+        :param coords: coordinates in the form {name: ([dimension], values)}
+        :type coords: dict
+        :param dimensions: dimensions of every dataset
+        :type dimensions: dict
+        :param attrs: attributes written to the store and every dataset
+        :type attrs: dict
+        :param loop_dims: dimensions looped over, outermost first
+        :type loop_dims: list
+        :param depth: number of outer loop dimensions per chunk, negative values count from the innermost
+        :type depth: int
+        :param dtypes: dtype of every dataset, defaults to float64
+        :type dtypes: dict
+        :param fill_values: value of anything never written for every dataset, defaults to NaN for floats and 0 for
+        integers. Chunks of integer datasets which are never written (scan stopped early) are undefined
+        :type fill_values: dict
+        """
+        self.filename = filename
+        self.coords = coords
+        self.dimensions = dimensions
+        self.attrs = {**attrs, TIMESTAMP: "seconds since the epoch", COMPLETE: False}
+        self.loop_dims = loop_dims
+        if depth < 0:
+            depth += len(loop_dims)
+        self.depth = min(max(depth, 0), len(loop_dims))
+        self.sizes = {dims[0]: len(values) for dims, values in coords.values()}
+        dtypes = dtypes or {}
+        fill_values = fill_values or {}
+        self.dtypes = {dataset: np.dtype(dtypes.get(dataset, np.float64)) for dataset in dimensions}
+        self.fill_values = {}
+        for dataset, dtype in self.dtypes.items():
+            fill_value = fill_values.get(dataset)
+            if fill_value is None:
+                fill_value = np.nan if dtype.kind in "fc" else 0
+            self.fill_values[dataset] = dtype.type(fill_value)
+        self._addresses = {dataset: self._gen_address(dims) for dataset, dims in dimensions.items()}
+
+    @classmethod
+    def from_ensemble(cls, ensemble: EnsembleBase, attrs: dict, depth: int = -1) -> "Store":
+        """
+        Store for the filename, coordinates, datasets, dtypes and fill values of an initialized ensemble. Per dataset
+        attributes of the ensemble can be a single value, a list or a dict keyed by dataset
+        :param ensemble: initialized ensemble
+        :type ensemble: EnsembleBase
+        :param attrs: attributes written to the store and every dataset
+        :type attrs: dict
+        :param depth: number of outer loop dimensions per chunk, negative values count from the innermost
+        :type depth: int
+        :return: store, not created yet
+        :rtype: Store
+        """
+        coords = {coord.name: ([coord.dimension], coord.values) for coord in ensemble.coords}
+        dimensions = ensemble.dimensions
+        if type(dimensions) is list:
+            dimensions = {dataset: dimensions for dataset in ensemble.datasets}
+        dimensions = {dataset: dimensions[dataset] for dataset in ensemble.datasets}
+        loop_dims = [ensemble.coords[coord].dimension for coord in ensemble.loop_coords]
+        dtypes = ensemble.dtypes
+        if type(dtypes) is not dict:
+            dtypes = {dataset: dtypes for dataset in ensemble.datasets}
+        fill_values = ensemble.fill_values
+        if type(fill_values) is not dict:
+            fill_values = {dataset: fill_values for dataset in ensemble.datasets}
+        return cls(ensemble.filename, coords, dimensions, attrs, loop_dims, depth, dtypes, fill_values)
+
+    def _gen_address(self, dims: list) -> list:
+        """
+        Generates the recipe used by address: a loop position for inner loop dimensions, 0 for outer loop
+        dimensions and a full slice for captured dimensions
+        :param dims: dimensions of the dataset
+        :return:
+        """
+        recipe = []
+        for dim in dims:
+            if dim in self.loop_dims:
+                position = self.loop_dims.index(dim)
+                recipe.append(position if position >= self.depth else None)
+            else:
+                recipe.append(slice(None))
+        return recipe
+
+    def chunks(self, dataset: str) -> tuple:
+        """
+        Shape of one chunk of a dataset
+        :param dataset: dataset name or timestamp
+        :return: chunk shape
+        """
+        dims = self.loop_dims if dataset == TIMESTAMP else self.dimensions[dataset]
+        return tuple(1 if dim in self.loop_dims[:self.depth] else self.sizes[dim] for dim in dims)
+
+    def frame_shape(self, dataset: str) -> tuple:
+        """
+        Shape of a single frame of a dataset, the captured dimensions
+        :param dataset: dataset name
+        :return: frame shape
+        """
+        return tuple(self.sizes[dim] for dim in self.dimensions[dataset] if dim not in self.loop_dims)
+
+    def encoders(self) -> dict:
+        """
+        zarr encoding for every dataset, chunked along the chunk boundaries so region writes never overlap.
+        Every dataset uses its fill value as _FillValue, so chunks never written, EX: in a stopped scan, read back as
+        it. Open integer datasets with utils.open_store so they aren't decoded to floats
+        :return: encoding
+        """
+        encoders = {dataset: {"compressor": compressor, "chunks": self.chunks(dataset),
+                              "_FillValue": self.fill_values[dataset]} for dataset in self.dimensions}
+        encoders[TIMESTAMP] = {"compressor": compressor, "chunks": self.chunks(TIMESTAMP), "_FillValue": np.nan}
+        return encoders
+
+    def create(self) -> None:
+        """
+        Writes coordinates and metadata for the whole scan without allocating the data
+
+        :rtype: None
+        """
+        data_vars = {}
+        for dataset, dims in self.dimensions.items():
+            shape = [self.sizes[dim] for dim in dims]
+            data_vars[dataset] = (dims, da.zeros(shape, chunks=self.chunks(dataset), dtype=self.dtypes[dataset]),
+                                  {name: value for name, value in self.attrs.items() if name != COMPLETE})
+        shape = [self.sizes[dim] for dim in self.loop_dims]
+        timestamp = (self.loop_dims, da.full(shape, np.nan, chunks=self.chunks(TIMESTAMP)))
+        template = xr.Dataset(data_vars=data_vars, coords={**self.coords, TIMESTAMP: timestamp}, attrs=self.attrs)
+        template.to_zarr(self.filename, encoding=self.encoders(), compute=False, consolidated=True)
+
+    def allocate(self) -> dict:
+        """
+        Allocates buffers for a single chunk
+        :return: buffers for every dataset and the timestamps
+        :rtype: dict
+        """
+        buffers = {dataset: np.full(self.chunks(dataset), self.fill_values[dataset], dtype=self.dtypes[dataset])
+                   for dataset in self.dimensions}
+        buffers[TIMESTAMP] = np.full(self.chunks(TIMESTAMP), np.nan)
+        return buffers
+
+    def reset(self, buffers: dict) -> dict:
+        """
+        Refills recycled buffers, so slots left unfilled by a stopped scan aren't written with an earlier chunk's frames
+        :param buffers: buffers for every dataset and the timestamps
+        :return: buffers, as if just allocated
+        :rtype: dict
+        """
+        for dataset in self.dimensions:
+            buffers[dataset].fill(self.fill_values[dataset])
+        buffers[TIMESTAMP].fill(np.nan)
+        return buffers
+
+    def address(self, dataset: str, indices: tuple) -> tuple:
+        """
+        Position of a frame inside the chunk buffer of a dataset. Ends in an Ellipsis so indexing always gives a view,
+        even for scalar frames
+        :param dataset: dataset name
+        :param indices: indices of the loop coordinates
+        :return: index into the buffer
+        """
+        return tuple(0 if item is None else item if isinstance(item, slice) else indices[item]
+                     for item in self._addresses[dataset]) + (Ellipsis,)
+
+    def slots(self, buffers: dict, indices: tuple) -> dict:
+        """
+        Views into the chunk buffers where the frame at indices belongs
+        :param buffers: buffers for every dataset
+        :param indices: indices of the loop coordinates
+        :return: views for every dataset
+        """
+        return {dataset: buffers[dataset][self.address(dataset, indices)] for dataset in self.dimensions}
+
+    def stamp(self, buffers: dict, indices: tuple, timestamp: float) -> None:
+        """
+        Records when the frame at indices was captured
+        :param buffers: buffers for every dataset and the timestamps
+        :param indices: indices of the loop coordinates
+        :param timestamp: seconds since the epoch
+        :rtype: None
+        """
+        buffers[TIMESTAMP][tuple(0 if i < self.depth else index for i, index in enumerate(indices))] = timestamp
+
+    def region(self, indices: tuple) -> dict:
+        """
+        Region of the store occupied by the chunk containing indices
+        :param indices: indices of the loop coordinates
+        :return: region
+        """
+        return {dim: slice(index, index + 1) for dim, index in zip(self.loop_dims[:self.depth], indices)}
+
+    def write(self, buffers: dict, indices: tuple) -> None:
+        """
+        Writes a chunk to the store
+        :param buffers: buffers for every dataset
+        :param indices: indices of any frame in the chunk
+        :rtype: None
+        """
+        chunk = xr.Dataset({dataset: (self.dimensions[dataset], buffers[dataset]) for dataset in self.dimensions})
+        chunk[TIMESTAMP] = (self.loop_dims, buffers[TIMESTAMP])
+        self.write_region(chunk, self.region(indices))
+
+    def write_region(self, dataset: xr.Dataset, region: dict) -> None:
+        """
+        Writes variables already in the store to a region of it
+        :param dataset: variables without coordinates
+        :param region: slice of every outer dimension the variables are written to
+        :rtype: None
+        """
+        if region:
+            dataset.to_zarr(self.filename, region=region)
+        else:  # the region is the whole store
+            dataset.to_zarr(self.filename, mode="a")
+
+    def append(self, variables: dict, coords: dict = None, chunks: dict = None) -> None:
+        """
+        Adds datasets to the store, EX: reductions
+        :param variables: datasets in the form {name: ([dimension], values)}
+        :param coords: coordinates of dimensions not in the store yet
+        :param chunks: chunk shape of every dataset, one chunk by default
+        :rtype: None
+        """
+        encoding = {name: {"compressor": compressor} for name in variables}
+        for name, chunk in (chunks or {}).items():
+            encoding[name]["chunks"] = chunk
+        dataset = xr.Dataset(variables, coords=coords, attrs=self.attrs)
+        dataset.to_zarr(self.filename, mode="a", encoding=encoding, consolidated=True)
+
+    def update_attrs(self, attrs: dict) -> None:
+        """
+        Updates the attributes of the store
+        :param attrs: attributes to set
+        :rtype: None
+        """
+        self.attrs.update(attrs)  # appending datasets writes self.attrs again
+        group = zarr.open_group(self.filename, mode="a")
+        group.attrs.update(attrs)
+        zarr.consolidate_metadata(self.filename)
@@ -0,0 +1,107 @@
+"""
+Houses the per step timings recorded while gathering data
+"""
+import json
+from collections import deque
+
+import numpy as np
+
+from .. import utils
+
+
+class Telemetry:
+    """
+    Ring buffer of the latest steps of a scan. Every record holds the step number, when its frame was captured
+    (time), seconds spent in every action (the step functions of the instruments and readout, copying the previous
+    frame into the chunk buffer), get_frame, write (handing a chunk to the writers, waiting if the queue is full),
+    persist (writing chunks, done by the writers in the background) and duration (the whole step), plus queue, the
+    chunks waiting for the writers
+    """
+
+    def __init__(self, size: int = 1000):
+        """
+        :param size: number of steps kept
+        :type size: int
+        """
+        self.records = deque(maxlen=size)
+        self.count = 0  # records ever added
+        self.sent = 0  # records returned by new
+
+    def add(self, record: dict) -> None:
+        """
+        Adds the record of a step, dropping the oldest once full
+        :param record: record of the step
+        :rtype: None
+        """
+        self.records.append(record)
+        self.count += 1
+
+    def extend(self, records: list) -> None:
+        """
+        Adds records of several steps
+        :param records: records
+        :rtype: None
+        """
+        for record in records:
+            self.add(record)
+
+    def new(self) -> list:
+        """
+        Records added since the last call, used to forward them from the worker
+        :return: records
+        :rtype: list
+        """
+        count = min(self.count - self.sent, len(self.records))
+        self.sent = self.count
+        return list(self.records)[len(self.records) - count:]
+
+    def stages(self) -> dict:
+        """
+        Average seconds per step of every stage over the buffer
+        :return: mapping from stage to seconds
+        :rtype: dict
+        """
+        totals = {}
+        for record in self.records:
+            for stage, seconds in {**record["actions"], "get_frame": record["get_frame"],
+                                   "write": record["write"], "persist": record["persist"],
+                                   "duration": record["duration"]}.items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return {stage: seconds / len(self.records) for stage, seconds in totals.items()}
+
+    def eta(self, remaining: int) -> float:
+        """
+        Estimated seconds left from the average duration of the buffered steps
+        :param remaining: steps left
+        :type remaining: int
+        :return: seconds
+        :rtype: float
+        """
+        if not self.records:
+            return 0.0
+        return remaining * float(np.mean([record["duration"] for record in self.records]))
+
+    def summary(self, step: int, total: int) -> dict:
+        """
+        Progress, ETA, average stage timings and queue depths
+        :param step: steps done
+        :param total: steps in the scan
+        :return: summary
+        :rtype: dict
+        """
+        queues = [record["queue"] for record in self.records] or [0]
+        eta = self.eta(total - step)
+        return {"step": step, "total": total, "eta": eta, "eta_text": utils.convert(eta), "stages": self.stages(),
+                "queue": {"latest": queues[-1], "max": max(queues)}}
+
+    def json(self, step: int, total: int, records: int = 100) -> str:
+        """
+        Summary and the latest records as JSON
+        :param step: steps done
+        :param total: steps in the scan
+        :param records: number of latest records included
+        :return: JSON
+        :rtype: str
+        """
+        latest = list(self.records)[-records:] if records else []
+        return json.dumps({**self.summary(step, total), "records": latest})
@@ -0,0 +1,218 @@
+"""
+Houses the worker process running acquisition away from the panel server
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+
+import dask
+import numpy as np
+
+from .acquisition import Acquisition
+
+
+class SharedFrames:
+    """
+    Latest frame of every dataset, kept in shared memory so the GUI can read it without talking to the worker
+    """
+
+    def __init__(self, shapes: dict, dtypes: dict, context=multiprocessing):
+        """
+        :param shapes: frame shape of every dataset
+        :type shapes: dict
+        :param dtypes: dtype of every dataset
+        :type dtypes: dict
+        :param context: multiprocessing context the lock and counter are created in
+        """
+        self.shapes = shapes
+        self.dtypes = dtypes
+        self.memory = {dataset: shared_memory.SharedMemory(
+            create=True, size=max(int(np.prod(shape)) * np.dtype(dtypes[dataset]).itemsize, 1))
+            for dataset, shape in shapes.items()}
+        self.lock = context.Lock()
+        self.sequence = context.Value("L", 0, lock=False)
+        self.seen = 0
+
+    def _array(self, dataset: str) -> np.ndarray:
+        """
+        Array backed by the shared memory of a dataset
+        """
+        return np.ndarray(self.shapes[dataset], dtype=self.dtypes[dataset], buffer=self.memory[dataset].buf)
+
+    def write(self, data: dict) -> None:
+        """
+        Publishes a frame, called by the worker
+        :param data: frame returned by get_frame
+        :rtype: None
+        """
+        with self.lock:
+            for dataset in self.shapes:
+                self._array(dataset)[...] = data[dataset]
+            self.sequence.value += 1
+
+    def read(self) -> Optional[dict]:
+        """
+        Copies the latest frame, called by the GUI
+        :return: frame or None if nothing new was published since the last read
+        :rtype: Optional[dict]
+        """
+        with self.lock:
+            if self.sequence.value == self.seen:
+                return None
+            self.seen = self.sequence.value
+            return {dataset: self._array(dataset).copy() for dataset in self.shapes}
+
+    def close(self) -> None:
+        """
+        Frees the shared memory
+
+        :rtype: None
+        """
+        for memory in self.memory.values():
+            memory.close()
+            memory.unlink()
+        self.memory = {}
+
+
+class AcquisitionProcess:
+    """
+    Runs an acquisition in a forked process. The process inherits the already initialized instruments, receives
+    commands over one queue and reports its status over another. The latest frame is published through SharedFrames
+
+    Forking is needed because instruments hold open handles, EX: serial ports, which can't be pickled for a spawned
+    process nor opened twice. Forking a threaded panel server is only safe because the worker never touches anything
+    owned by the server's threads: the tornado loop, the catalog and its sqlite connection, the watcher and their locks
+    are left alone, only the acquisition, its store (numpy chunks written by zarr) and the queues are used. The dask
+    Client a viewer may have set as the default talks to the server's loop, so the worker switches dask back to its
+    threaded scheduler before anything else
+    """
+
+    def __init__(self, acquisition: Acquisition, interval: float = 0.5):
+        """
+        :param acquisition: acquisition to run
+        :type acquisition: Acquisition
+        :param interval: minimum seconds between published frames
+        :type interval: float
+        """
+        self.acquisition = acquisition
+        self.interval = interval
+        context = multiprocessing.get_context("fork")  # instruments can't be pickled, see above for why it's safe
+        self.commands = context.Queue()
+        self.status = context.Queue()
+        store = acquisition.store
+        self.frames = SharedFrames({dataset: store.frame_shape(dataset) for dataset in store.dimensions},
+                                   store.dtypes, context)
+        self.process = context.Process(target=self._run, name="acquisition", daemon=True)
+        self.state = "created"
+        self.step = 0
+        self.published = 0.0
+
+    def _listen(self) -> None:
+        """
+        Handles commands inside the worker
+
+        :rtype: None
+        """
+        while True:
+            command = self.commands.get()
+            if command == "stop":
+                self.acquisition.stop()
+                return
+
+    def _on_frame(self, data: dict, step: int) -> None:
+        """
+        Reports progress and publishes the frame if interval has passed
+        """
+        now = time.monotonic()
+        if now - self.published >= self.interval:
+            self.published = now
+            self.frames.write(data)
+            self.status.put({"state": "running", "step": step + 1, "total": self.acquisition.total,
+                             "telemetry": self.acquisition.telemetry.new()})
+
+    def _on_fit(self, record: dict) -> None:
+        """
+        Reports a fitted sweep
+        """
+        self.status.put({"state": "running", "fit": record})
+
+    def _run(self) -> None:
+        """
+        Entry point of the worker
+
+        :rtype: None
+        """
+        dask.config.set(scheduler="threads")  # the inherited Client's connection lives in the server's threads
+        threading.Thread(target=self._listen, daemon=True).start()
+        try:
+            self.acquisition.run(self._on_frame, self._on_fit)
+        except Exception as ex:
+            self.status.put({"state": "error", "error": repr(ex)})
+        else:
+            self.status.put({"state": "finished", "step": self.acquisition.total, "total": self.acquisition.total,
+                             "timings": dict(self.acquisition.timings), "telemetry": self.acquisition.telemetry.new()})
+
+    def start(self) -> None:
+        """
+        Starts the worker
+
+        :rtype: None
+        """
+        self.process.start()
+        self.state = "running"
+
+    def poll(self) -> list[dict]:
+        """
+        Collects every status message sent since the last poll
+        :return: status messages
+        :rtype: list[dict]
+        """
+        messages = self._drain()
+        if self.state == "running" and not self.process.is_alive():
+            # the worker may have sent finished or stopped between draining and checking it's alive
+            messages += self._drain(timeout=0.5)
+            if self.state == "running":
+                self.state = "error"
+                messages.append({"state": "error", "error": f"worker exited with code {self.process.exitcode}"})
+        return messages
+
+    def _drain(self, timeout: float = 0) -> list[dict]:
+        """
+        Reads every queued status message
+        :param timeout: seconds to wait for the first message, messages of an exited worker can still be in the pipe
+        :return: status messages
+        """
+        messages = []
+        while True:
+            try:
+                message = self.status.get(timeout=timeout) if timeout else self.status.get_nowait()
+            except queue.Empty:
+                return messages
+            timeout = 0
+            self.state = message["state"]
+            self.step = message.get("step", self.step)
+            messages.append(message)
+
+    @property
+    def running(self) -> bool:
+        """
+        :return: whether the worker is still gathering data
+        :rtype: bool
+        """
+        return self.process.is_alive()
+
+    def stop(self) -> None:
+        """
+        Asks the worker to stop after the current frame, waits for it to write everything gathered and frees the
+        shared memory
+
+        :rtype: None
+        """
+        if self.process.is_alive():
+            self.commands.put("stop")
+            self.process.join()
+        self.poll()
+        self.frames.close()
@@ -0,0 +1,115 @@
+"""
+Houses the write-behind queue persisting chunks while the next frames are captured
+"""
+import queue
+import threading
+import time
+
+from .store import Store
+
+
+class Writer:
+    """
+    Bounded write-behind queue with a pool of worker threads. Compression and zarr writes release the GIL so the
+    capture loop keeps running while finished chunks are persisted. Chunk buffers are recycled through a pool, once
+    queue_depth chunks are waiting for the disk acquire blocks until a worker frees one (backpressure).
+    """
+
+    def __init__(self, store: Store, workers: int = 2, queue_depth: int = 4):
+        """
+        :param store: store to write to
+        :type store: Store
+        :param workers: number of writer threads
+        :type workers: int
+        :param queue_depth: maximum number of chunks waiting to be written
+        :type queue_depth: int
+        """
+        self.store = store
+        self.pending = queue.Queue(maxsize=max(queue_depth, 1))
+        self.free = queue.Queue()
+        self.limit = max(queue_depth, 1) + max(workers, 1) + 1  # queued, being written and being filled
+        self.allocated = 0
+        self.error = None
+        self.persisted = 0.0  # seconds spent writing chunks
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, daemon=True, name=f"writer-{i}")
+                        for i in range(max(workers, 1))]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self) -> None:
+        """
+        Worker loop, writes chunks until it receives None
+        :rtype: None
+        """
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                return
+            buffers, indices = item
+            try:
+                if self.error is None:
+                    start = time.perf_counter()
+                    self.store.write(buffers, indices)
+                    with self.lock:
+                        self.persisted += time.perf_counter() - start
+            except Exception as ex:
+                self.error = ex
+            finally:
+                self.free.put(buffers)
+                self.pending.task_done()
+
+    def _check(self) -> None:
+        """
+        Reraises the first exception raised by a worker
+        :rtype: None
+        """
+        if self.error is not None:
+            raise self.error
+
+    def acquire(self) -> dict:
+        """
+        Gets a set of chunk buffers, blocking while every buffer is queued or being written. Recycled buffers are
+        refilled with the fill values
+        :return: buffers for every dataset
+        :rtype: dict
+        """
+        self._check()
+        try:
+            return self.store.reset(self.free.get_nowait())
+        except queue.Empty:
+            if self.allocated < self.limit:
+                self.allocated += 1
+                return self.store.allocate()
+        return self.store.reset(self.free.get())
+
+    def put(self, buffers: dict, indices: tuple) -> None:
+        """
+        Queues a chunk to be written, blocking while the queue is full
+        :param buffers: buffers for every dataset, handed over to the writer
+        :param indices: indices of any frame in the chunk
+        :rtype: None
+        """
+        self._check()
+        self.pending.put((buffers, indices))
+
+    def qsize(self) -> int:
+        """
+        :return: number of chunks waiting to be written
+        :rtype: int
+        """
+        return self.pending.qsize()
+
+    def drain(self) -> None:
+        """
+        Writes every queued chunk and stops the workers
+
+        :rtype: None
+        """
+        for _ in self.threads:
+            self.pending.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self._check()
@@ -0,0 +1,187 @@
+"""
+Estimates the parameters of the RASHG model from its harmonics without iterating. Expanding utils.rashg,
+(A cos(3φ-3δ) + B cos(φ-3δ+2θ))² + C, leaves only even harmonics of φ:
+
+- 0: (A² + B²) / 2 + C
+- 2φ: B²/2 e^(i(4θ-6δ)) + AB e^(-2iθ)
+- 4φ: AB e^(i(2θ-6δ))
+- 6φ: A²/2 e^(-6iδ)
+
+so the 6φ and 4φ harmonics give A, δ and θ, the rest of the 2φ harmonic gives B and the mean gives C
+"""
+from collections.abc import Callable
+
+import numpy as np
+import xarray as xr
+from scipy.optimize import curve_fit
+
+from . import utils
+
+PARAM_NAMES = ["delta", "A", "B", "theta", "C"]
+ORDERS = np.array([0, 2, 4, 6])
+
+
+def _uniform_bins(phi: np.ndarray):
+    """
+    :return: FFT bins of ORDERS if phi is uniformly spaced over whole periods of the model (π) and sampled finely
+             enough to resolve 6φ, otherwise None
+    """
+    if phi.size < 2:
+        return None
+    step = (phi[-1] - phi[0]) / (phi.size - 1)
+    periods = phi.size * step / np.pi
+    if step <= 0 or not np.allclose(np.diff(phi), step, rtol=1e-6, atol=1e-9) or \
+            not np.isclose(periods, round(periods), atol=1e-6):
+        return None
+    bins = ORDERS * round(periods) // 2
+    if bins[-1] >= phi.size / 2:
+        return None
+    return bins
+
+
+def harmonics(phi: np.ndarray, curves: np.ndarray) -> np.ndarray:
+    """
+    Complex amplitudes z of the 0, 2φ, 4φ and 6φ harmonics, every curve is sum(Re(z e^(inφ))) plus the harmonics the
+    model doesn't have. Uses an FFT if phi is uniform over whole periods, like Polarization, least squares otherwise
+    :param phi: polarization in radians
+    :type phi: np.ndarray
+    :param curves: curves along the last axis
+    :type curves: np.ndarray
+    :return: amplitudes along the last axis, NaN for curves which aren't finite
+    :rtype: np.ndarray
+    """
+    phi = np.asarray(phi, dtype=np.float64)
+    curves = np.asarray(curves, dtype=np.float64)
+    bins = _uniform_bins(phi)
+    if bins is not None:
+        spectrum = np.fft.rfft(curves, axis=-1)[..., bins] * (2 / phi.size) * np.exp(-1j * ORDERS * phi[0])
+        spectrum[..., 0] /= 2
+        return spectrum
+    basis = np.concatenate([np.ones((phi.size, 1)), np.cos(np.outer(phi, ORDERS[1:])),
+                            np.sin(np.outer(phi, ORDERS[1:]))], axis=1)
+    coefficients = curves @ np.linalg.pinv(basis).T
+    return np.concatenate([coefficients[..., :1] + 0j, coefficients[..., 1:4] - 1j * coefficients[..., 4:]], axis=-1)
+
+
+def parameters(amplitudes: np.ndarray) -> np.ndarray:
+    """
+    Parameters of the model from the amplitudes returned by harmonics. A and B are positive, δ is in (-π/6, π/6] and θ
+    in (-π/2, π/2], every other solution is the same curve
+    :param amplitudes: amplitudes along the last axis
+    :type amplitudes: np.ndarray
+    :return: delta, A, B, theta and C along the last axis
+    :rtype: np.ndarray
+    """
+    z0, z2, z4, z6 = np.moveaxis(amplitudes, -1, 0)
+    a = np.sqrt(2 * np.abs(z6))
+    delta = -np.angle(z6) / 6
+    theta = np.angle(z4 * np.exp(6j * delta)) / 2
+    # when A is small the 4φ harmonic is mostly noise and θ is better read from what's left of 2φ, 4θ-6δ, so try both
+    # and keep whichever matches the 2φ and 4φ harmonics best
+    rest = z2 - np.abs(z4) * np.exp(-2j * theta)
+    quarter = (np.angle(rest) + 6 * delta) / 4
+    with np.errstate(divide="ignore", invalid="ignore"):
+        from_4 = np.abs(z4) / a
+    best, error = None, None
+    for candidate, b in [(theta, from_4), (theta, None), (quarter, None), (quarter + np.pi / 2, None)]:
+        if b is None:  # B²/2 + AB cos(6θ-6δ) along the phase of B²/2 in the 2φ harmonic
+            psi = 4 * candidate - 6 * delta
+            along = a * np.cos(6 * candidate - 6 * delta)
+            b = -along + np.sqrt(np.maximum(along ** 2 + 2 * np.real(z2 * np.exp(-1j * psi)), 0))
+        b = np.where(np.isfinite(b), b, 0)
+        model_2 = b ** 2 / 2 * np.exp(1j * (4 * candidate - 6 * delta)) + a * b * np.exp(-2j * candidate)
+        mismatch = np.abs(z2 - model_2) + np.abs(z4 - a * b * np.exp(1j * (2 * candidate - 6 * delta)))
+        if best is None:
+            best, error = np.stack([candidate, b]), mismatch
+        else:
+            better = mismatch < error
+            best, error = np.where(better, np.stack([candidate, b]), best), np.where(better, mismatch, error)
+    theta, b = best
+    theta = np.angle(np.exp(2j * theta)) / 2
+    c = z0.real - (a ** 2 + b ** 2) / 2
+    return np.stack([delta, a, b, theta, c], axis=-1)
+
+
+def estimate(phi: np.ndarray, curves: np.ndarray) -> np.ndarray:
+    """
+    Estimates the parameters of every curve in one vectorized pass
+    :param phi: polarization in radians
+    :type phi: np.ndarray
+    :param curves: curves along the last axis
+    :type curves: np.ndarray
+    :return: delta, A, B, theta and C along the last axis
+    :rtype: np.ndarray
+    """
+    return parameters(harmonics(phi, curves))
+
+
+def estimate_array(data: xr.DataArray, dim: str = "Polarization") -> xr.DataArray:
+    """
+    Estimates the parameters of every curve of a dataset along dim, lazily if it's backed by dask
+    :param data: dataset, dim must be one chunk
+    :type data: xr.DataArray
+    :param dim: dimension the model is fitted along, in radians
+    :type dim: str
+    :return: parameters laid out like curvefit's coefficients, with dim replaced by param
+    :rtype: xr.DataArray
+    """
+    phi = np.asarray(data.coords[dim].values, dtype=np.float64)
+    estimated = xr.apply_ufunc(lambda curves: estimate(phi, curves), data, input_core_dims=[[dim]],
+                               output_core_dims=[["param"]],
+                               dask="parallelized", output_dtypes=[np.float64],
+                               dask_gufunc_kwargs={"output_sizes": {"param": len(PARAM_NAMES)}})
+    return estimated.assign_coords(param=PARAM_NAMES)
+
+
+def seed(x: np.ndarray, curve: np.ndarray) -> list:
+    """
+    Starting parameters for curve_fit
+    :param x: polarization in radians
+    :type x: np.ndarray
+    :param curve: intensity
+    :type curve: np.ndarray
+    :return: p0
+    :rtype: list
+    """
+    return estimate(x, curve).tolist()
+
+
+def curvefit(data: xr.DataArray, dim: str = "Polarization", function: Callable = utils.rashg,
+             kwargs: dict = None) -> xr.Dataset:
+    """
+    xarray's curvefit along dim, with every curve starting from its estimate so it converges in a few iterations
+    :param data: dataset
+    :type data: xr.DataArray
+    :param dim: dimension the model is fitted along, in radians
+    :type dim: str
+    :param function: model, utils.rashg or an equivalent
+    :type function: Callable
+    :param kwargs: passed to scipy.optimize.curve_fit
+    :type kwargs: dict
+    :return: curvefit_coefficients and curvefit_covariance, laid out like xarray's curvefit
+    :rtype: xr.Dataset
+    """
+    kwargs = kwargs or {}
+    size = len(PARAM_NAMES)
+
+    def fit_curve(curve, p0):
+        finite = np.isfinite(curve)
+        if np.count_nonzero(finite) < size:
+            return np.full(size, np.nan), np.full((size, size), np.nan)
+        if not np.all(np.isfinite(p0)):  # curves with gaps, EX: empty fly scan bins, are estimated from what's there
+            p0 = estimate(x[finite], curve[finite])
+        if not np.all(np.isfinite(p0)):
+            return np.full(size, np.nan), np.full((size, size), np.nan)
+        try:
+            return curve_fit(function, x[finite], curve[finite], p0=p0, **kwargs)
+        except RuntimeError:
+            return np.full(size, np.nan), np.full((size, size), np.nan)
+
+    x = np.asarray(data.coords[dim].values, dtype=np.float64)
+    seeds = estimate_array(data, dim)
+    coefficients, covariance = xr.apply_ufunc(fit_curve, data, seeds, input_core_dims=[[dim], ["param"]],
+                                              output_core_dims=[["param"], ["cov_i", "cov_j"]], vectorize=True,
+                                              dask="parallelized", output_dtypes=[np.float64, np.float64],
+                                              dask_gufunc_kwargs={"output_sizes": {"cov_i": size, "cov_j": size}})
+    return xr.Dataset({"curvefit_coefficients": coefficients, "curvefit_covariance": covariance},
+                      coords={"param": PARAM_NAMES, "cov_i": PARAM_NAMES, "cov_j": PARAM_NAMES})
@@ -0,0 +1,198 @@
+"""
+Fits the RASHG model to every pixel: a batched Levenberg-Marquardt solver with the analytic Jacobian of utils.rashg,
+run in parallel with numba, writing parameter maps to the store
+"""
+import time
+from datetime import timedelta
+from itertools import product
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+from numba import njit, prange
+
+from . import harmonics, utils
+
+PARAM_NAMES = harmonics.PARAM_NAMES
+SPATIAL = ["x", "y"]
+
+
+@njit(cache=True)
+def _residuals(phi, y, p, r):
+    """
+    Fills r with y minus the model and returns the sum of squares
+    """
+    cost = 0.0
+    for k in range(phi.shape[0]):
+        s = p[1] * np.cos(3 * phi[k] - 3 * p[0]) + p[2] * np.cos(phi[k] - 3 * p[0] + 2 * p[3])
+        r[k] = y[k] - (s * s + p[4])
+        cost += r[k] * r[k]
+    return cost
+
+
+@njit(cache=True)
+def _normal_equations(phi, p, r, jtj, jtr):
+    """
+    Fills jtj and jtr with J^T J and J^T r using the analytic Jacobian of the model
+    """
+    jtj[:] = 0.0
+    jtr[:] = 0.0
+    jac = np.empty(5)
+    for k in range(phi.shape[0]):
+        u = 3 * phi[k] - 3 * p[0]
+        v = phi[k] - 3 * p[0] + 2 * p[3]
+        cos_u, sin_u, cos_v, sin_v = np.cos(u), np.sin(u), np.cos(v), np.sin(v)
+        s2 = 2 * (p[1] * cos_u + p[2] * cos_v)
+        jac[0] = s2 * 3 * (p[1] * sin_u + p[2] * sin_v)  # delta
+        jac[1] = s2 * cos_u  # A
+        jac[2] = s2 * cos_v  # B
+        jac[3] = -s2 * 2 * p[2] * sin_v  # theta
+        jac[4] = 1.0  # C
+        for i in range(5):
+            jtr[i] += jac[i] * r[k]
+            for j in range(i + 1):
+                jtj[i, j] += jac[i] * jac[j]
+    for i in range(5):
+        for j in range(i):
+            jtj[j, i] = jtj[i, j]
+
+
+@njit(cache=True)
+def _solve(a, b, x):
+    """
+    Solves a x = b by Gaussian elimination with partial pivoting, overwriting a and b
+    :return: False if a is singular
+    """
+    n = b.shape[0]
+    for col in range(n):
+        pivot = col
+        for row in range(col + 1, n):
+            if abs(a[row, col]) > abs(a[pivot, col]):
+                pivot = row
+        if a[pivot, col] == 0.0 or not np.isfinite(a[pivot, col]):
+            return False
+        if pivot != col:
+            for j in range(n):
+                a[col, j], a[pivot, j] = a[pivot, j], a[col, j]
+            b[col], b[pivot] = b[pivot], b[col]
+        for row in range(col + 1, n):
+            factor = a[row, col] / a[col, col]
+            for j in range(col, n):
+                a[row, j] -= factor * a[col, j]
+            b[row] -= factor * b[col]
+    for row in range(n - 1, -1, -1):
+        total = b[row]
+        for j in range(row + 1, n):
+            total -= a[row, j] * x[j]
+        x[row] = total / a[row, row]
+    return True
+
+
+@njit(parallel=True, cache=True)
+def levenberg_marquardt(phi, curves, seeds, max_iter=100, tol=1e-10):
+    """
+    Fits the RASHG model to every curve at once, one curve per thread
+    :param phi: polarization in radians
+    :param curves: curves, one per row
+    :param seeds: starting parameters (delta, A, B, theta, C), one row per curve
+    :param max_iter: maximum accepted steps per curve
+    :param tol: stops once a step lowers the sum of squares by less than this fraction
+    :return: parameters, sum of squared residuals and iterations per curve, NaN where the curve isn't finite
+    """
+    count = curves.shape[0]
+    params = np.empty((count, 5))
+    costs = np.empty(count)
+    iterations = np.zeros(count, dtype=np.int64)
+    for c in prange(count):
+        y = curves[c]
+        p = seeds[c].copy()
+        if not (np.all(np.isfinite(y)) and np.all(np.isfinite(p))):
+            params[c] = np.nan
+            costs[c] = np.nan
+            continue
+        r = np.empty(phi.shape[0])
+        r_new = np.empty(phi.shape[0])
+        jtj = np.empty((5, 5))
+        jtr = np.empty(5)
+        a = np.empty((5, 5))
+        b = np.empty(5)
+        step = np.empty(5)
+        trial = np.empty(5)
+        damping = 1e-3
+        cost = _residuals(phi, y, p, r)
+        for iteration in range(max_iter):
+            _normal_equations(phi, p, r, jtj, jtr)
+            improved = False
+            while damping < 1e12:
+                a[:] = jtj
+                for i in range(5):
+                    a[i, i] += damping * max(jtj[i, i], 1e-12)
+                b[:] = jtr
+                if _solve(a, b, step):
+                    trial[:] = p + step
+                    new_cost = _residuals(phi, y, trial, r_new)
+                    if new_cost < cost:
+                        improved = True
+                        break
+                damping *= 10
+            if not improved:
+                break
+            iterations[c] = iteration + 1
+            p[:] = trial
+            r[:] = r_new
+            gain = cost - new_cost
+            cost = new_cost
+            damping = max(damping / 10, 1e-15)
+            if gain <= tol * cost:
+                break
+        params[c] = p
+        costs[c] = cost
+    return params, costs, iterations
+
+
+def fit_maps(filename, dataset: str = "ds1", dim: str = "Polarization", block_bytes: int = 256 * 2 ** 20,
+             max_iter: int = 100) -> None:
+    """
+    Fits every pixel of every slice of a dataset and writes parameter_maps (the parameters, laid out like fitted with
+    the spatial dimensions added) and parameter_maps_rss (sum of squared residuals) to the store. Pixels are read and
+    fitted in blocks of rows so memory stays bounded. Every pixel starts from its harmonic estimate, see harmonics
+    :param filename: zarr store
+    :param dataset: dataset to fit
+    :type dataset: str
+    :param dim: dimension the model is fitted along, in radians
+    :type dim: str
+    :param block_bytes: approximate bytes of curves fitted at once
+    :type block_bytes: int
+    :param max_iter: maximum steps per pixel
+    :type max_iter: int
+    :rtype: None
+    """
+    start = time.time()
+    ds = utils.open_store(filename)
+    data = ds[dataset]
+    outer = [d for d in data.dims if d != dim and d not in SPATIAL]
+    dims = outer + SPATIAL + ["param"]
+    phi = np.asarray(ds.coords[dim].values, dtype=np.float64)
+    rows = max(1, min(data.sizes[SPATIAL[0]], block_bytes // (data.sizes[SPATIAL[1]] * phi.size * 8)))
+    shape = tuple(data.sizes[d] for d in outer + SPATIAL)
+    chunks = (1,) * len(outer) + (rows, data.sizes[SPATIAL[1]])
+    template = xr.Dataset({"parameter_maps": (dims, da.full(shape + (5,), np.nan, chunks=chunks + (5,))),
+                           "parameter_maps_rss": (dims[:-1], da.full(shape, np.nan, chunks=chunks))},
+                          coords={"param": PARAM_NAMES})
+    template.to_zarr(filename, mode="a", compute=False, consolidated=True)
+    for indices in product(*[range(data.sizes[d]) for d in outer]):
+        selection = dict(zip(outer, indices))
+        for row in range(0, data.sizes[SPATIAL[0]], rows):
+            block = data.isel({**selection, SPATIAL[0]: slice(row, row + rows)}).transpose(*SPATIAL, dim)
+            curves = np.asarray(block.values, dtype=np.float64)
+            pixels = curves.shape[:2]
+            curves = curves.reshape(-1, phi.size)
+            params, costs, _ = levenberg_marquardt(phi, curves, harmonics.estimate(phi, curves), max_iter)
+            region = {**{d: slice(i, i + 1) for d, i in selection.items()},
+                      SPATIAL[0]: slice(row, row + pixels[0]), SPATIAL[1]: slice(0, pixels[1])}
+            index = (np.newaxis,) * len(outer)
+            xr.Dataset({"parameter_maps": (dims, params.reshape(pixels + (5,))[index]),
+                        "parameter_maps_rss": (dims[:-1], costs.reshape(pixels)[index])}).to_zarr(filename,
+                                                                                                region=region)
+    ds.close()
+    print(f"fitted every pixel in {str(timedelta(seconds=time.time() - start))}")
@@ -0,0 +1,194 @@
+"""
+Exports the polar plots of a RASHG dataset: every curve and its fit are computed from the stored arrays up front, the
+figures are rendered in a process pool. Images already written are skipped, so an interrupted export resumes
+"""
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+from . import harmonics, summed_area, utils
+
+LAYOUTS = ["files", "tiled", "html"]
+LOOP = ["power", "Orientation", "wavelength"]  # order polars_to_file always wrote them in
+
+
+def curves(filename, box: Optional[tuple] = None) -> xr.Dataset:
+    """
+    Every curve plotted and its fit, in one pass over the stored arrays
+    :param filename: zarr store
+    :param box: x0, x1, y0, y1 averaged over, None for every pixel
+    :type box: Optional[tuple]
+    :return: raw and fitted along Polarization, with a degrees coordinate
+    :rtype: xr.Dataset
+    """
+    ds = utils.open_store(filename)
+    if box is None:
+        if "heatmap_all" in ds:
+            raw = ds["heatmap_all"].load()
+        else:  # the viewer never opened the store, computed like Grapher._update_dataset
+            raw = ds["ds1"].mean(dim=["x", "y"], dtype=np.float64).compute()
+        params = ds["fitted"].load() if "fitted" in ds else None
+    else:
+        roi = summed_area.SummedArea.open_or_build(filename)
+        raw = summed_area.average(ds["ds1"], *box) if roi is None else roi.mean(*box)
+        params = None
+    if params is None:
+        params = harmonics.curvefit(raw).curvefit_coefficients
+    phi = np.asarray(raw.coords["Polarization"].values, dtype=np.float64)
+    fitted = xr.apply_ufunc(lambda p: utils.rashg(phi, *[p[..., i, np.newaxis] for i in range(p.shape[-1])]),
+                            params.sel(param=harmonics.PARAM_NAMES), input_core_dims=[["param"]],
+                            output_core_dims=[["Polarization"]]).assign_coords(Polarization=raw.coords["Polarization"])
+    degrees = ds.coords["degrees"].values if "degrees" in ds.coords else np.degrees(phi)
+    ds.close()
+    return xr.Dataset({"raw": raw, "fitted": fitted.transpose(*raw.dims)}).assign_coords(
+        degrees=("Polarization", np.asarray(degrees, dtype=np.float64)))
+
+
+def _figure(theta: np.ndarray, raw: np.ndarray, fitted: np.ndarray, selected: bool):
+    """
+    Polar plot of a curve and its fit, like Grapher.polar
+    """
+    import pandas as pd
+    import plotly.express as px
+    region = ("Raw Data, over selected region", "Fitted Data, to selected points") if selected else \
+        ("Raw Data, over all points", "Fitted Data, to all points")
+    data_frame = pd.DataFrame({"Intensity": np.concatenate([raw, fitted]),
+                               "Polarization": np.concatenate([theta, theta]), "Data": np.repeat(region, theta.size)})
+    return px.scatter_polar(data_frame, theta="Polarization", r="Intensity", color="Data", start_angle=0,
+                            direction="counterclockwise",
+                            range_r=(data_frame["Intensity"].min() * 0.8, data_frame["Intensity"].max() * 1.2))
+
+
+def _tiled(theta: np.ndarray, raw: np.ndarray, fitted: np.ndarray, titles: list, columns: int = 4):
+    """
+    Grid of polar plots, one per row of raw and fitted
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    rows = -(-len(titles) // columns)
+    figure = make_subplots(rows=rows, cols=columns, specs=[[{"type": "polar"}] * columns] * rows,
+                           subplot_titles=titles)
+    for i, title in enumerate(titles):
+        row, column = i // columns + 1, i % columns + 1
+        figure.add_trace(go.Scatterpolar(r=raw[i], theta=theta, mode="markers", name="Raw Data",
+                                         marker={"color": "#636efa"}, showlegend=i == 0), row=row, col=column)
+        figure.add_trace(go.Scatterpolar(r=fitted[i], theta=theta, mode="markers", name="Fitted Data",
+                                         marker={"color": "#ef553b"}, showlegend=i == 0), row=row, col=column)
+    figure.update_polars(angularaxis={"rotation": 0, "direction": "counterclockwise"})
+    figure.update_layout(width=350 * columns, height=350 * rows)
+    return figure
+
+
+def _render(path: str, kind: str, args: tuple) -> str:
+    """
+    Renders one image in a worker, written under a temporary name first so a killed export never leaves a partial image
+    that resuming would skip
+    """
+    figure = _figure(*args) if kind == "files" else _tiled(*args)
+    partial = f"{path}.part"
+    figure.write_image(partial, format=Path(path).suffix[1:])
+    os.replace(partial, path)
+    return path
+
+
+def _print_progress(done: int, total: int) -> None:
+    print(f"\rexported {done} of {total}", end="" if done < total else "\n", flush=True)
+
+
+def export_polars(filename, folder: str = None, box: Optional[tuple] = None, layout: str = "files",
+                  workers: int = None, image_format: str = "png",
+                  progress: Optional[Callable[[int, int], None]] = _print_progress) -> list:
+    """
+    Exports the polar plot of every power, Orientation and wavelength
+    :param filename: zarr store
+    :param folder: written to, defaults to the store's name without its extension next to it
+    :type folder: str
+    :param box: x0, x1, y0, y1 averaged over, None for every pixel
+    :type box: Optional[tuple]
+    :param layout: files for one image per plot, tiled for one image of every wavelength per power and Orientation,
+                   html for a single page with every plot
+    :type layout: str
+    :param workers: processes rendering images, defaults to one per CPU
+    :type workers: int
+    :param image_format: png, svg, pdf or anything else plotly's write_image supports
+    :type image_format: str
+    :param progress: called with the images done and the total after every image, images skipped count as done
+    :type progress: Optional[Callable[[int, int], None]]
+    :return: files written or skipped
+    :rtype: list
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {LAYOUTS}, not {layout}")
+    start = time.time()
+    if folder is None:
+        folder = str(filename).replace(f".{utils.extension(filename)}", '')
+    os.makedirs(folder, exist_ok=True)
+    data = curves(filename, box).transpose(*LOOP, "Polarization")
+    theta = data.coords["degrees"].values
+    region = "" if box is None else "X{}:{}Y{}:{},".format(*box)
+    jobs = {}  # path to (kind, arguments)
+    if layout == "files":
+        for power, orientation, wavelength in np.ndindex(*data["raw"].shape[:3]):
+            labels = {dim: data.coords[dim].values[i].item() for dim, i in zip(LOOP, (power, orientation, wavelength))}
+            path = os.path.join(folder, f"Polar_{region}O{labels['Orientation']}W{labels['wavelength']}"
+                                        f"P{labels['power']}.{image_format}")
+            jobs[path] = ("files", (theta, data["raw"].values[power, orientation, wavelength],
+                                    data["fitted"].values[power, orientation, wavelength], box is not None))
+    elif layout == "tiled":
+        for power, orientation in np.ndindex(*data["raw"].shape[:2]):
+            labels = {dim: data.coords[dim].values[i].item() for dim, i in zip(LOOP, (power, orientation))}
+            path = os.path.join(folder, f"Polars_{region}O{labels['Orientation']}P{labels['power']}.{image_format}")
+            titles = [f"W{wavelength}" for wavelength in data.coords["wavelength"].values.tolist()]
+            jobs[path] = ("tiled", (theta, data["raw"].values[power, orientation],
+                                    data["fitted"].values[power, orientation], titles))
+    else:
+        path = os.path.join(folder, f"Polars{region.rstrip(',')}.html")
+        if not os.path.isfile(path):
+            _html(data, theta, box, path, progress)
+        return [path]
+    pending = {path: job for path, job in jobs.items() if not os.path.isfile(path)}
+    done = len(jobs) - len(pending)
+    if progress is not None:
+        progress(done, len(jobs))
+    if pending:
+        context = multiprocessing.get_context("spawn")  # forking a threaded panel server isn't safe
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            futures = [executor.submit(_render, path, kind, args) for path, (kind, args) in pending.items()]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if progress is not None:
+                    progress(done, len(jobs))
+    print(f"exported {len(pending)} polars ({len(jobs) - len(pending)} already exported) in "
+          f"{str(timedelta(seconds=time.time() - start))}")
+    return list(jobs)
+
+
+def _html(data: xr.Dataset, theta: np.ndarray, box: Optional[tuple], path: str,
+          progress: Optional[Callable[[int, int], None]]) -> None:
+    """
+    Writes every polar plot to one page, plotly.js is included once
+    """
+    shape = data["raw"].shape[:3]
+    total = int(np.prod(shape))
+    parts = []
+    for done, (power, orientation, wavelength) in enumerate(np.ndindex(*shape), start=1):
+        labels = {dim: data.coords[dim].values[i].item() for dim, i in zip(LOOP, (power, orientation, wavelength))}
+        figure = _figure(theta, data["raw"].values[power, orientation, wavelength],
+                         data["fitted"].values[power, orientation, wavelength], box is not None)
+        figure.update_layout(title=f"Orientation: {labels['Orientation']}, wavelength: {labels['wavelength']}, "
+                                   f"power: {labels['power']}")
+        parts.append(figure.to_html(full_html=False, include_plotlyjs="cdn" if done == 1 else False))
+        if progress is not None:
+            progress(done, total)
+    with open(f"{path}.part", "w") as file:
+        file.write("<html><body>\n" + "\n".join(parts) + "\n</body></html>\n")
+    os.replace(f"{path}.part", path)
@@ -0,0 +1,114 @@
+"""
+Houses the registry of plugins, the ensembles and visualizers, found without importing them
+"""
+import ast
+from collections.abc import Mapping
+from importlib import import_module
+from pathlib import Path
+from types import ModuleType
+from typing import Optional
+
+
+def read_constant(filename: Path, variable: str) -> Optional[str]:
+    """
+    Reads a module level string constant from the source of a module without importing it
+    :param filename: source of the module
+    :type filename: Path
+    :param variable: name of the constant, EX: name or DATA_TYPE
+    :type variable: str
+    :return: value or None if it isn't assigned a string
+    :rtype: Optional[str]
+    """
+    tree = ast.parse(filename.read_text(), str(filename))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant):
+            if any(isinstance(target, ast.Name) and target.id == variable for target in node.targets):
+                if isinstance(node.value.value, str):
+                    return node.value.value
+    return None
+
+
+def always_raises(filename: Path) -> bool:
+    """
+    :param filename: source of a module
+    :type filename: Path
+    :return: whether the module raises at module level, so importing it always fails
+    :rtype: bool
+    """
+    tree = ast.parse(filename.read_text(), str(filename))
+    return any(isinstance(node, ast.Raise) for node in tree.body)
+
+
+class Registry(Mapping):
+    """
+    Mapping from the name of every plugin to its module. Plugins are found by reading their source, a module is only
+    imported when it is first looked up, so a plugin whose drivers are missing doesn't break the others. Plugins which
+    raise at module level are skipped, a plugin failing to import when looked up is dropped and kept in failed
+    """
+
+    def __init__(self, package: str, prefix: str, variable: str, exclude: Optional[str] = None):
+        """
+        :param package: package holding a directory of plugins per group, EX: neogidashboard.ensembles
+        :type package: str
+        :param prefix: prefix of the plugin modules, EX: ensemble_
+        :type prefix: str
+        :param variable: module level constant naming the plugin, EX: name
+        :type variable: str
+        :param exclude: modules containing this are skipped
+        :type exclude: str
+        """
+        self.package = package
+        self.paths = {}  # name to module path
+        self.modules = {}  # name to imported module
+        self.failed = {}  # name to the exception importing it raised
+        directory = Path(import_module(package).__file__).resolve().parent
+        for filename in sorted(directory.glob(f"*/{prefix}*.py")):
+            if exclude is not None and exclude in filename.stem:
+                continue
+            try:
+                name = read_constant(filename, variable)
+                broken = always_raises(filename)
+            except (SyntaxError, UnicodeDecodeError) as ex:
+                print(f"{filename.name} can't be read. Exception {ex}")
+                continue
+            if name is None:
+                print(f"{filename.name} doesn't set {variable}")
+                continue
+            if broken:
+                print(f"{filename.name} always raises on import, skipped")
+                continue
+            self.paths[name] = f"{package}.{filename.parent.name}.{filename.stem}"
+
+    def __getitem__(self, name: str) -> ModuleType:
+        """
+        Imports the plugin on first use. A plugin failing to import is dropped, so it isn't offered again
+        :param name: name of the plugin
+        :return: module
+        :rtype: ModuleType
+        """
+        if name not in self.modules:
+            try:
+                self.modules[name] = import_module(self.paths[name])
+            except Exception as ex:
+                print(f"{name} import failed. Exception {ex}")
+                self.failed[name] = ex
+                del self.paths[name]
+                raise
+        return self.modules[name]
+
+    def __iter__(self):
+        yield from self.paths
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, name) -> bool:
+        return name in self.paths
+
+    @property
+    def loaded(self) -> list:
+        """
+        :return: names of the plugins imported so far
+        :rtype: list
+        """
+        return list(self.modules)
@@ -0,0 +1,396 @@
+"""
+Simulated instruments standing in for neogiinstruments. Mirrors the names of neogiinstruments so ensembles can be run,
+profiled and benchmarked without the lab. Select it with backend.simulate() or the NEOGI_SIMULATE environment variable
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+devices = {}  # every simulated instrument by name, instruments read each other from here
+
+
+@dataclass
+class Settings:
+    """
+    Latencies, noise and frame sizes of the simulated instruments. Every field can be set from the environment as
+    NEOGI_SIMULATE_<FIELD>, EX: NEOGI_SIMULATE_TIME_SCALE=0
+    """
+    time_scale: float = 1.0  # multiplies every delay, 0 skips them while the instruments still act as if time passed
+    rotator_speed: float = 20.0  # degrees per second
+    tune_rate: float = 10.0  # nanometers per second the MaiTai tunes at
+    readout: float = 0.0  # seconds to read a camera frame out, added to the exposure
+    sensor: tuple = (2048, 2048)  # camera sensor size
+    counts: float = 1000.0  # camera counts at an intensity of 1
+    noise: float = 1.0  # scale of the noise, 0 for noiseless instruments
+    measure_time: float = 0.1  # seconds the power meter, photodiode and spectrometer integrate for
+    spectrum_points: int = 2048  # spectrometer pixels
+    max_power: float = 20.0  # milliwatts through the attenuator when fully open
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_environment(cls) -> "Settings":
+        """
+        Reads settings from the environment
+        :return: settings
+        :rtype: Settings
+        """
+        values = {}
+        for setting in fields(cls):
+            value = os.environ.get(f"NEOGI_SIMULATE_{setting.name.upper()}")
+            if value is None:
+                continue
+            if setting.name == "sensor":
+                values[setting.name] = tuple(int(size) for size in value.split("x"))
+            elif setting.name in ["spectrum_points", "seed"]:
+                values[setting.name] = int(value)
+            else:
+                values[setting.name] = float(value)
+        return cls(**values)
+
+
+settings = Settings.from_environment()
+rng = np.random.default_rng(settings.seed)
+_clock_lock = threading.Lock()
+_skipped = 0.0
+
+
+def configure(**kwargs) -> Settings:
+    """
+    Changes the settings of every simulated instrument
+    :param kwargs: fields of Settings
+    :return: settings
+    :rtype: Settings
+    """
+    global rng
+    for key, value in kwargs.items():
+        if not hasattr(settings, key):
+            raise ValueError(f"Unknown setting {key}")
+        setattr(settings, key, value)
+    if "seed" in kwargs:
+        rng = np.random.default_rng(settings.seed)
+    return settings
+
+
+def clock() -> float:
+    """
+    Simulated time: real time plus every delay skipped by time_scale
+    :return: seconds
+    :rtype: float
+    """
+    with _clock_lock:
+        return time.monotonic() + _skipped
+
+
+def sleep(seconds: float) -> None:
+    """
+    Waits a simulated delay, scaled by time_scale. The part not waited for is added to the clock. Approximate when
+    several instruments wait at once
+    :param seconds: simulated seconds
+    :rtype: None
+    """
+    global _skipped
+    seconds = max(float(seconds), 0.0)
+    scaled = seconds * settings.time_scale
+    with _clock_lock:
+        _skipped += seconds - scaled
+    if scaled > 0:
+        time.sleep(scaled)
+
+
+def noisy(value: float, relative: float = 0.01) -> float:
+    """
+    Adds gaussian noise
+    :param value: exact value
+    :param relative: standard deviation relative to the value at a noise of 1
+    :return: measured value
+    """
+    return float(value + rng.normal(0, abs(value) * relative * settings.noise + 1e-12))
+
+
+def model(phi: np.ndarray, delta: float = 0.3, A: float = 1.0, B: float = 0.5, theta: float = 0.2,
+          C: float = 0.1) -> np.ndarray:
+    """
+    RASHG model, see utils.rashg
+    :param phi: polarization in radians
+    :return: intensity
+    """
+    return (A * np.cos(3 * phi - 3 * delta) + B * np.cos(phi - 3 * delta + 2 * theta)) ** 2 + C
+
+
+def transmission(rotator_name: str) -> float:
+    """
+    Fraction of the power passing a rotator used as an attenuator, sin squared of its angle
+    :param rotator_name: name of the simulated rotator
+    :return: fraction
+    """
+    device = devices.get(rotator_name)
+    if device is None:
+        return 1.0
+    return float(np.sin(np.radians(device.get_position())) ** 2)
+
+
+def wavelength() -> float:
+    """
+    :return: current wavelength of the simulated MaiTai, 800 if there is none
+    """
+    device = devices.get("MaiTai")
+    return 800.0 if device is None else device.Get_Wavelength()
+
+
+class RotatorInstrument:
+    """
+    Rotation stage moving at a fixed speed. Supports absolute moves and continuous rotation
+    """
+
+    def __init__(self, speed: float = None):
+        """
+        :param speed: degrees per second for absolute moves, defaults to settings.rotator_speed
+        :type speed: float
+        """
+        self.speed = speed
+        self.lock = threading.Lock()
+        self._position = 0.0
+        self._velocity = 0.0
+        self._since = clock()
+
+    def get_position(self) -> float:
+        """
+        :return: current position in degrees
+        :rtype: float
+        """
+        with self.lock:
+            return (self._position + self._velocity * (clock() - self._since)) % 360
+
+    def _set(self, position: float, velocity: float) -> None:
+        with self.lock:
+            self._position = position
+            self._velocity = velocity
+            self._since = clock()
+
+    def move_abs(self, position: float) -> None:
+        """
+        Moves to position, blocking until it gets there
+        :param position: degrees
+        :rtype: None
+        """
+        current = self.get_position()
+        self._set(current, 0.0)
+        speed = self.speed or settings.rotator_speed
+        sleep(abs(float(position) - current) / speed)
+        self._set(float(position) % 360, 0.0)
+
+    def move_continuous(self, velocity: float) -> None:
+        """
+        Starts rotating, returns immediately
+        :param velocity: degrees per second
+        :rtype: None
+        """
+        self._set(self.get_position(), float(velocity))
+
+    def stop(self) -> None:
+        """
+        Stops rotating
+
+        :rtype: None
+        """
+        self._set(self.get_position(), 0.0)
+
+    def home(self) -> None:
+        """
+        Moves to 0
+
+        :rtype: None
+        """
+        self.move_abs(0)
+
+
+class CameraInstrument:
+    """
+    Camera imaging the RASHG model at the polarization of a simulated rotator, scaled by the attenuator, with shot
+    noise
+    """
+
+    def __init__(self, polarizer: str = "rbot", attenuator: str = "atten"):
+        """
+        :param polarizer: name of the simulated rotator setting the polarization
+        :param attenuator: name of the simulated rotator setting the power
+        """
+        self.polarizer = polarizer
+        self.attenuator = attenuator
+        self.shape = tuple(settings.sensor)
+
+    def roi(self, x1: int, x2: int, y1: int, y2: int) -> None:
+        self.shape = (x2 - x1, y2 - y1)
+
+    def binning(self, xbin: int, ybin: int) -> None:
+        self.shape = (self.shape[0] // xbin, self.shape[1] // ybin)
+
+    def get_frame(self, exp_time: float = 0) -> np.ndarray:
+        """
+        Exposes a frame, averaging the polarization over the exposure
+        :param exp_time: exposure in milliseconds
+        :return: frame
+        :rtype: np.ndarray
+        """
+        polarizer = devices.get(self.polarizer)
+        start = polarizer.get_position() if polarizer is not None else 0.0
+        sleep(exp_time / 1000 + settings.readout)
+        end = polarizer.get_position() if polarizer is not None else 0.0
+        if end < start:
+            end += 360
+        mean = model(np.radians((start + end) / 2)) * settings.counts
+        if self.attenuator in devices:
+            mean *= transmission(self.attenuator)
+        if settings.noise > 0:
+            return rng.poisson(mean, size=self.shape).astype(np.uint16)
+        return np.full(self.shape, mean, dtype=np.uint16)
+
+
+class MaiTaiInstrument:
+    """
+    Laser tuning linearly to the set wavelength at settings.tune_rate. Nothing waits for it to tune, so it follows
+    real time divided by time_scale
+    """
+
+    def __init__(self):
+        self._start = 800.0
+        self._target = 800.0
+        self._since = time.monotonic()
+        self.shutter = 0
+
+    def Set_Wavelength(self, wavelength: float) -> None:
+        self._start = self.Get_Wavelength()
+        self._target = float(wavelength)
+        self._since = time.monotonic()
+
+    def Get_Wavelength(self) -> float:
+        duration = abs(self._target - self._start) / settings.tune_rate
+        elapsed = (time.monotonic() - self._since) / settings.time_scale if settings.time_scale > 0 else duration
+        if elapsed >= duration:
+            return self._target
+        return self._start + (self._target - self._start) * elapsed / duration
+
+    def Shutter(self, state: int) -> None:
+        self.shutter = state
+
+
+class PowerMeterInstrument:
+    """
+    Power meter behind the simulated rotator named "rotator"
+    """
+
+    def PowAvg(self) -> tuple:
+        """
+        :return: power in milliwatts and its standard deviation
+        """
+        sleep(settings.measure_time)
+        power = settings.max_power * transmission("rotator")
+        return noisy(power), abs(power) * 0.01 * settings.noise
+
+
+class PhotodiodeInstrument:
+    """
+    Photodiode reading the power behind the simulated rotator named "rotator"
+    """
+
+    def gather_data(self) -> tuple:
+        """
+        :return: voltage and its standard deviation
+        """
+        sleep(settings.measure_time)
+        voltage = 0.1 * settings.max_power * transmission("rotator")
+        return noisy(voltage), abs(voltage) * 0.01 * settings.noise
+
+
+class StellarNetInstrument:
+    """
+    Spectrometer seeing the second harmonic of the simulated MaiTai, scaled by the square of the power
+    """
+
+    def GetSpec(self) -> tuple:
+        """
+        :return: emission wavelengths and spectrum
+        """
+        sleep(settings.measure_time)
+        emission = np.linspace(200, 1100, settings.spectrum_points)
+        power = settings.max_power * transmission("rotator")
+        spectrum = power ** 2 * np.exp(-((emission - wavelength() / 2) / 2) ** 2)
+        if settings.noise > 0:
+            spectrum = spectrum + rng.normal(0, settings.noise, size=emission.shape)
+        return emission, spectrum
+
+
+class Simulated:
+    """
+    Wrapper mirroring the instruments of neogiinstruments: the driver is in instrument and view renders its state
+    """
+
+    def __init__(self, name: str, instrument):
+        self.name = name
+        self.instrument = instrument
+        devices[name] = instrument
+
+    def view(self) -> str:
+        return f"{self.name} (simulated)"
+
+
+class rotator(Simulated):
+    def __init__(self, name: str = "rotator", speed: float = None):
+        super().__init__(name, RotatorInstrument(speed))
+
+    def view(self) -> str:
+        return f"{self.name} (simulated): {self.instrument.get_position():.1f} degrees"
+
+
+class camera(Simulated):
+    def __init__(self, name: str = "Camera", **kwargs):
+        super().__init__(name, CameraInstrument(**kwargs))
+
+    def view(self) -> str:
+        return f"{self.name} (simulated): {self.instrument.shape}"
+
+
+class MaiTai(Simulated):
+    def __init__(self, name: str = "MaiTai"):
+        super().__init__(name, MaiTaiInstrument())
+
+    def view(self) -> str:
+        return f"{self.name} (simulated): {self.instrument.Get_Wavelength():.1f} nm"
+
+
+class PowerMeter(Simulated):
+    def __init__(self, name: str = "PowerMeter"):
+        super().__init__(name, PowerMeterInstrument())
+
+
+class Photodiode(Simulated):
+    def __init__(self, name: str = "Photodiode"):
+        super().__init__(name, PhotodiodeInstrument())
+
+
+class StellarNet(Simulated):
+    def __init__(self, name: str = "StellarNet"):
+        super().__init__(name, StellarNetInstrument())
+
+
+def write_calibration(filename: str, wavelengths: np.ndarray = np.arange(700, 1000, 2),
+                      polarizations: np.ndarray = np.arange(0, 90, 0.5)) -> None:
+    """
+    Writes the calibration a WavelengthPoweredCalib scan of the simulated instruments would give, RASHG and
+    Stellarnet need one
+    :param filename: zarr store to write
+    :param wavelengths: wavelengths in nanometers
+    :param polarizations: attenuator positions in degrees, power has to increase along them
+    :rtype: None
+    """
+    power = settings.max_power * np.sin(np.radians(polarizations)) ** 2
+    pwr = np.broadcast_to(power, (len(wavelengths), len(polarizations)))
+    dataset = xr.Dataset({"Pwr": (["wavelength", "Polarization"], pwr)},
+                         coords={"wavelength": wavelengths, "Polarization": polarizations},
+                         attrs={"data_type": "WavelengthPoweredCalib", "title": "simulated calibration"})
+    dataset.to_zarr(filename, mode="w", consolidated=True)
@@ -0,0 +1,175 @@
+"""
+Houses the summed-area table of a dataset, its cumulative sum over x and y, so the average over any rectangle is read
+from its four corners instead of every pixel inside it. The table is float64, 4 times the size of a uint16 dataset
+before compression, so it's only built on demand
+"""
+import math
+import time
+from datetime import timedelta
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+from . import utils
+
+NAME = "summed_area"
+COUNT = "summed_area_count"  # finite pixels, only for datasets which can have NaN
+SPATIAL = ["x", "y"]
+
+
+def build(filename, dataset: str = "ds1", along: tuple = ("wavelength", "Polarization"),
+          chunk_bytes: int = 8 * 2 ** 20) -> None:
+    """
+    Writes the summed-area table of a dataset to its store. Chunks hold every value along `along` for a small square of
+    pixels, so one rectangle reads four small chunks
+    :param filename: zarr store
+    :param dataset: dataset summed
+    :type dataset: str
+    :param along: dimensions read together, EX: a heatmap of wavelength against Polarization
+    :type along: tuple
+    :param chunk_bytes: approximate bytes per chunk
+    :type chunk_bytes: int
+    :rtype: None
+    """
+    start = time.time()
+    ds = utils.open_store(filename)
+    data = ds[dataset]
+    data = data.drop_vars([coord for coord in data.coords if coord not in data.dims])
+    side = max(1, math.isqrt(chunk_bytes // (8 * math.prod(data.sizes[dim] for dim in along))))
+    chunks = {dim: -1 if dim in along else 1 for dim in data.dims}
+    chunks.update({dim: min(side, data.sizes[dim]) for dim in SPATIAL})
+    tables = {NAME: data.fillna(0).astype(np.float64).cumsum(SPATIAL[0]).cumsum(SPATIAL[1]).chunk(chunks)}
+    if data.dtype.kind == "f":
+        tables[COUNT] = data.notnull().astype(np.float64).cumsum(SPATIAL[0]).cumsum(SPATIAL[1]).chunk(chunks)
+    for table in tables.values():
+        table.encoding = {}
+    xr.Dataset(tables).to_zarr(filename, mode="a", consolidated=True)
+    ds.close()
+    print(f"summed {dataset} in {str(timedelta(seconds=time.time() - start))}")
+
+
+def pixels(data: xr.DataArray, x0: float, x1: float, y0: float, y1: float) -> tuple:
+    """
+    :param data: dataset or its summed-area table
+    :type data: xr.DataArray
+    :param x0: start of the rectangle along x, inclusive
+    :param x1: end of the rectangle along x, inclusive
+    :param y0: start of the rectangle along y, inclusive
+    :param y1: end of the rectangle along y, inclusive
+    :return: slices of the pixels inside the rectangle along x and y, rectangles with the same pixels have the same
+             average
+    :rtype: tuple
+    """
+    slices = []
+    for dim, start, stop in [(SPATIAL[0], x0, x1), (SPATIAL[1], y0, y1)]:
+        indexer = data.indexes[dim].slice_indexer(start, stop)
+        slices.append(slice(*indexer.indices(data.sizes[dim])[:2]))
+    return tuple(slices)
+
+
+def average(data: xr.DataArray, x0: float, x1: float, y0: float, y1: float, **selection) -> xr.DataArray:
+    """
+    Average over x=slice(x0, x1), y=slice(y0, y1) read from every pixel, for stores without a summed-area table
+    :param data: dataset averaged
+    :type data: xr.DataArray
+    :param selection: labels of the other dimensions, EX: Orientation=0, power=10
+    :return: average, NaN if the rectangle has no pixels
+    :rtype: xr.DataArray
+    """
+    return data.sel(selection).sel({SPATIAL[0]: slice(x0, x1), SPATIAL[1]: slice(y0, y1)}).mean(
+        dim=SPATIAL, dtype=np.float64).load()
+
+
+class SummedArea:
+    """
+    Averages of a dataset over rectangles of x and y, from its summed-area table
+    """
+
+    def __init__(self, table: xr.DataArray, count: Optional[xr.DataArray] = None):
+        """
+        :param table: summed-area table written by build
+        :type table: xr.DataArray
+        :param count: summed-area table of finite pixels, None if every pixel is finite
+        :type count: Optional[xr.DataArray]
+        """
+        self.table = table
+        self.count = count
+
+    @classmethod
+    def open(cls, filename) -> "SummedArea":
+        """
+        :param filename: zarr store the table was written to by build
+        :return: averages of the store's dataset
+        :rtype: SummedArea
+        """
+        ds = utils.open_store(filename)
+        return cls(ds[NAME], ds[COUNT] if COUNT in ds else None)
+
+    @classmethod
+    def open_or_build(cls, filename) -> Optional["SummedArea"]:
+        """
+        Opens the table of a store, building it first if the store doesn't have one
+        :param filename: zarr store
+        :return: averages of the store's dataset, None if the table can't be built, EX: the store is on a read-only
+                 share
+        :rtype: Optional[SummedArea]
+        """
+        try:
+            with utils.open_store(filename) as ds:
+                missing = NAME not in ds
+            if missing:
+                build(filename)
+            return cls.open(filename)
+        except Exception as ex:
+            print(f"Summing {filename} failed, averaging every pixel instead. Exception {ex}")
+            return None
+
+    def _corners(self, table: xr.DataArray, x: slice, y: slice) -> xr.DataArray:
+        """
+        Sum over the pixels x, y of table, from its four corners
+        """
+        corners = table.isel({SPATIAL[0]: [max(x.start - 1, 0), x.stop - 1],
+                              SPATIAL[1]: [max(y.start - 1, 0), y.stop - 1]}).load()
+        corners = corners.drop_vars(SPATIAL)
+        total = corners.isel({SPATIAL[0]: 1, SPATIAL[1]: 1})
+        if x.start > 0:
+            total = total - corners.isel({SPATIAL[0]: 0, SPATIAL[1]: 1})
+        if y.start > 0:
+            total = total - corners.isel({SPATIAL[0]: 1, SPATIAL[1]: 0})
+        if x.start > 0 and y.start > 0:
+            total = total + corners.isel({SPATIAL[0]: 0, SPATIAL[1]: 0})
+        return total
+
+    def pixels(self, x0: float, x1: float, y0: float, y1: float) -> tuple:
+        """
+        :param x0: start of the rectangle along x, inclusive
+        :param x1: end of the rectangle along x, inclusive
+        :param y0: start of the rectangle along y, inclusive
+        :param y1: end of the rectangle along y, inclusive
+        :return: slices of the pixels inside the rectangle along x and y, rectangles with the same pixels have the
+                 same average
+        :rtype: tuple
+        """
+        return pixels(self.table, x0, x1, y0, y1)
+
+    def mean(self, x0: float, x1: float, y0: float, y1: float, **selection) -> xr.DataArray:
+        """
+        Average over x=slice(x0, x1), y=slice(y0, y1), like ds1.sel(...).mean(dim=["x", "y"])
+        :param x0: start of the rectangle along x, inclusive
+        :param x1: end of the rectangle along x, inclusive
+        :param y0: start of the rectangle along y, inclusive
+        :param y1: end of the rectangle along y, inclusive
+        :param selection: labels of the other dimensions, EX: Orientation=0, power=10
+        :return: average, NaN if the rectangle has no pixels
+        :rtype: xr.DataArray
+        """
+        table = self.table.sel(selection)
+        x, y = self.pixels(x0, x1, y0, y1)
+        if x.stop <= x.start or y.stop <= y.start:
+            return xr.full_like(table.isel({SPATIAL[0]: 0, SPATIAL[1]: 0}, drop=True), np.nan).load()
+        total = self._corners(table, x, y)
+        if self.count is None:
+            return total / ((x.stop - x.start) * (y.stop - y.start))
+        count = self._corners(self.count.sel(selection), x, y)
+        return total / count.where(count > 0)
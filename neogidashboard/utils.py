@@ -4,14 +4,17 @@ Utilities for various components. Aims to contain any resuable functions needed
 import os
 import pathlib
 import time
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
 import numpy as np
 import xarray as xr
-import zarr.errors
 from numba import vectorize, float64
 from scipy.interpolate import interp1d
 
+from .catalog import catalog
+
 
 @vectorize([float64(float64, float64, float64, float64)])
 def inv_sin_sqr(y, mag, x_offset, y_offset):
@@ -38,6 +41,21 @@ def sin_squared(x, mag, x_offset, y_offset):
     return ((np.sin((x - x_offset) * np.pi / 180)) ** 2) * mag + y_offset
 
 
+@vectorize([float64(float64, float64, float64, float64, float64, float64)])
+def rashg(phi, delta, A, B, theta, C):
+    """
+    RASHG model fitted along Polarization, accelerated using numba
+    :param phi: polarization in radians
+    :param delta:
+    :param A:
+    :param B:
+    :param theta:
+    :param C:
+    :return: intensity
+    """
+    return (A * np.cos(3 * phi - 3 * delta) + B * np.cos(phi - 3 * delta + 2 * theta)) ** 2 + C
+
+
 def interp(old, pol, pwr) -> np.array:
     """
     Interpolates a set of powers for polarization values to generate a new set of polarizations for given power
@@ -50,52 +68,125 @@ def interp(old, pol, pwr) -> np.array:
     return function(pwr)
 
 
-def interpolate(filename: pathlib.PosixPath, pwr: np.array = np.arange(0, 100, 5), throw: int = 0) -> xr.DataArray:
+def invert_calibration(power: np.ndarray, pol: np.ndarray, pwr: np.ndarray, extrapolate: bool = True) -> np.ndarray:
+    """
+    Inverts many calibrations at once: for every row of power finds the polarizations giving the powers in pwr by
+    linear interpolation, the same as interp for each row but in one vectorized pass
+    :param power: powers measured, polarization along the last axis
+    :type power: np.ndarray
+    :param pol: polarization values
+    :type pol: np.ndarray
+    :param pwr: new power values
+    :type pwr: np.ndarray
+    :param extrapolate: continue the line through the two lowest (highest) powers below (above) the measured range,
+    otherwise NaN
+    :type extrapolate: bool
+    :return: polarizations, the last axis replaced by pwr
+    :rtype: np.ndarray
+    """
+    pwr = np.asarray(pwr, dtype=np.float64)
+    order = np.argsort(power, axis=-1, kind="mergesort")
+    x = np.take_along_axis(power, order, axis=-1).astype(np.float64)
+    y = np.asarray(pol, dtype=np.float64)[order]
+    hi = np.count_nonzero(x[..., np.newaxis, :] < pwr[:, np.newaxis], axis=-1)  # searchsorted on every row
+    hi = np.clip(hi, 1, x.shape[-1] - 1)
+    x_lo, x_hi = np.take_along_axis(x, hi - 1, axis=-1), np.take_along_axis(x, hi, axis=-1)
+    y_lo, y_hi = np.take_along_axis(y, hi - 1, axis=-1), np.take_along_axis(y, hi, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = (y_hi - y_lo) / (x_hi - x_lo) * (pwr - x_lo) + y_lo
+    if not extrapolate:
+        result[(pwr < x[..., :1]) | (pwr > x[..., -1:])] = np.nan
+    return result
+
+
+def mtime(filename: pathlib.PosixPath) -> int:
+    """
+    Latest modification of a zarr store: the store itself, its metadata and its arrays
+    :param filename: zarr store
+    :type filename: pathlib.PosixPath
+    :return: nanoseconds since the epoch
+    :rtype: int
+    """
+    path = Path(filename)
+    return max([path.stat().st_mtime_ns] + [child.stat().st_mtime_ns for child in path.iterdir()])
+
+
+def open_store(filename, **kwargs) -> xr.Dataset:
+    """
+    Opens a zarr store lazily. Integer datasets keep their fill value in _FillValue so chunks never written read back as
+    it, mask_and_scale is off so they stay integers instead of every pixel equal to it turning into NaN. _FillValue is
+    moved back to the encoding, so the dataset can be written to a store again
+    :param filename: zarr store
+    :param kwargs: passed to xr.open_zarr, EX: chunks
+    :return: dataset
+    :rtype: xr.Dataset
+    """
+    dataset = xr.open_zarr(filename, mask_and_scale=False, **kwargs)
+    for variable in dataset.variables.values():
+        if "_FillValue" in variable.attrs:
+            variable.encoding["_FillValue"] = variable.attrs.pop("_FillValue")
+    return dataset
+
+
+@lru_cache(maxsize=32)
+def _interpolate(filename: str, modified: int, pwr: tuple, throw: float, extrapolate: bool) -> xr.DataArray:
+    """
+    Cached by interpolate, modified makes sure a changed calibration is read again
     """
-    Interpolates a calibration file to get Polarizations for given powers and wavelength
+    with xr.open_dataset(filename, engine="zarr") as dataset:
+        power_calibration = dataset["Pwr"]
+        power_calibration = power_calibration.where(power_calibration.Polarization > throw, drop=True)
+        power_calibration = power_calibration.transpose(..., "Polarization").load()
+    dims = [dim for dim in power_calibration.dims if dim != "Polarization"]
+    pc_reverse = xr.DataArray(invert_calibration(power_calibration.values,
+                                                 power_calibration.coords["Polarization"].values, np.array(pwr),
+                                                 extrapolate),
+                              dims=dims + ["power"],
+                              coords={**{dim: power_calibration.coords[dim] for dim in dims if
+                                         dim in power_calibration.coords}, "power": np.array(pwr)},
+                              name=power_calibration.name, attrs=power_calibration.attrs)
+    return pc_reverse
+
+
+def interpolate(filename: pathlib.PosixPath, pwr: np.array = np.arange(0, 100, 5), throw: int = 0,
+                extrapolate: bool = True) -> xr.DataArray:
+    """
+    Interpolates a calibration file to get Polarizations for given powers and wavelength. Results are cached per
+    process by file, modification time, powers and throw so calling it again is free until the file changes
     :param throw: throw everything at this polarization and lower
     :type throw: int
     :param filename: calibration file to interpolate from
     :type filename: pathlib.PosixPath
     :param pwr: powers to interpolate to
     :type pwr: np.array
-    :return: Reversed calibration
+    :param extrapolate: extrapolate linearly outside the calibrated powers, otherwise NaN
+    :type extrapolate: bool
+    :return: Reversed calibration, shared with other callers so don't modify it in place
     :rtype: xr.DataArray
     """
-    power_calibration = xr.open_dataset(filename, engine="zarr")["Pwr"]
-    power_calibration = power_calibration.where(power_calibration.Polarization > throw, drop=True)
-    pc_pol = power_calibration.coords["Polarization"].values
-    pc_reverse = xr.apply_ufunc(interp, power_calibration, input_core_dims=[["Polarization"]], vectorize=True,
-                                output_core_dims=[["power"]], kwargs={"pwr": pwr, "pol": pc_pol})
-    pc_reverse.coords["power"] = pwr
-    pc_reverse.load()
-    power_calibration.close()
-    return pc_reverse
+    path = Path(filename).resolve()
+    pwr = tuple(np.asarray(pwr).tolist())
+    return _interpolate(str(path), mtime(path), pwr, throw, extrapolate).copy(deep=False)
 
 
-def scan_directory(extensions: dict) -> dict:
+def scan_directory(extensions: dict, complete: Optional[bool] = None) -> dict:
     """
-    Scans for readable files
+    Scans for readable files using the catalog, only stores which changed since the last scan are read. Nothing is
+    read while a Watcher keeps the catalog up to date
 
     :return:
     :param extensions: A mapping from data types to modules
     :type extensions: dict
+    :param complete: only stores which were (True) or weren't (False) gathered completely, None for both
+    :type complete: Optional[bool]
     :return: Mapping from files to modules
     :rtype: dict
     """
-    # parses directories for valid files
-    files = list(Path("").rglob("*.zarr"))
-    file_dict = {}
-    for file in files:
-        try:
-            dataset = xr.open_dataset(file, engine="zarr")
-            data_type = dataset.attrs["data_type"]
-            dataset.close()
-            if data_type in extensions:
-                file_dict[file] = extensions[data_type]
-        except zarr.errors.GroupNotFoundError:
-            print(f"{file} open failed. No data in folder")
-    return file_dict
+    files = catalog()
+    if not files.watched:
+        files.refresh()
+    stores = files.query(data_type=list(extensions), complete=complete)
+    return {file: extensions[data_type] for file, data_type in stores.items()}
 
 
 def extension(file: str) -> os.path:
@@ -0,0 +1,92 @@
+"""
+Houses the cache of results viewers compute from a selection, EX: the average over a box and its fit
+"""
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+import numpy as np
+
+
+def size_of(value) -> int:
+    """
+    :param value: cached value, EX: a numpy array, DataArray or a tuple of them
+    :return: approximate bytes held by value
+    :rtype: int
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(size_of(item) for item in value)
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    Least recently used results, dropped once they hold more than max_bytes. Shared by every viewer in the process, so
+    keys must say which file and which version of it a result came from
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2 ** 20):
+        """
+        :param max_bytes: bytes held before the least recently used results are dropped
+        :type max_bytes: int
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key to (value, bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable):
+        """
+        :param key: what the result depends on
+        :type key: Hashable
+        :param compute: computes the result if it isn't cached
+        :type compute: Callable
+        :return: result, arrays are read only since they are shared
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        value = compute()  # outside the lock, a slow read shouldn't block other viewers
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        size = size_of(value)
+        with self.lock:
+            if key not in self.entries and size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, (_, dropped) = self.entries.popitem(last=False)
+                    self.bytes -= dropped
+        return value
+
+    def clear(self) -> None:
+        """
+        Drops every result, keeps the statistics
+
+        :rtype: None
+        """
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """
+        :return: hits, misses, hit rate, results held and their bytes
+        :rtype: dict
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+results = ResultCache()
@@ -7,7 +7,6 @@ import holoviews as hv
 import numpy as np
 import panel as pn
 import param
-import xarray as xr
 
 from ..visualizer_base import GrapherBase
 from ... import utils
@@ -32,7 +31,7 @@ class Grapher(GrapherBase):
         Opens selected dataset
         """
         self.interpolate()
-        self.data = xr.open_zarr(self.filename)
+        self.data = utils.open_store(self.filename)
         self.param['wavelength'].objects = self.data["Pwr"].coords['wavelength'].values.tolist()
         self.wavelength = self.data["Pwr"].coords["wavelength"].min().values
 
@@ -88,5 +87,4 @@ class Grapher(GrapherBase):
         return pn.Param(self.param, widgets=widgets)
 
     def close(self):
-        self.pc_reverse.close()
-        self.data.close()
+        self.data.close()  # pc_reverse is shared with other viewers through the cache of utils.interpolate
@@ -1,10 +1,11 @@
 """
 Visualizer for RASHG data
 """
-import os
+import threading
 import time
 from datetime import timedelta
 from pathlib import Path
+from typing import Optional
 
 import holoviews as hv
 import numpy as np
@@ -14,37 +15,16 @@ import param
 import plotly.express as px
 import xarray as xr
 from holoviews import streams
-from numba import vectorize, float64
+from ..cache import results
 from ..visualizer_base import GrapherBase
-from ... import utils
+from ... import utils, pixelfit, harmonics, summed_area, polar_export
 
 pn.extension('plotly')
 hv.extension('bokeh')
 
 DATA_TYPE = "RASHG"
 
-
-@vectorize([float64(float64, float64, float64, float64, float64, float64)])
-def function(phi: float64, delta: float64, A: float64, B: float64, theta: float64, C: float64) -> float64:
-    """
-    Function to fit to, accelerated using numba
-    :param phi:
-    :type phi:
-    :param delta:
-    :type delta:
-    :param A:
-    :type A:
-    :param B:
-    :type B:
-    :param theta:
-    :type theta:
-    :param C:
-    :type C:
-    :return:
-    :rtype: float64
-
-    """
-    return (A * np.cos(3 * phi - 3 * delta) + B * np.cos(phi - 3 * delta + 2 * theta)) ** 2 + C
+function = utils.rashg  # Function to fit to, shared with the ensemble fitting while gathering data
 
 
 class Grapher(GrapherBase):
@@ -60,8 +40,14 @@ class Grapher(GrapherBase):
     y0 = param.Number(default=0, precedence=-1)
     y1 = param.Number(default=1, precedence=-1)
     selected = param.Boolean(default=False, precedence=-1)
+    quick_fit = param.Boolean(default=False, doc="Fit the selection with the harmonic estimate instead of curvefit")
     colorMap = param.ObjectSelector(default="fire", objects=hv.plotting.list_cmaps())
+    map_param = param.ObjectSelector(default="A", objects=pixelfit.PARAM_NAMES)
+    export_layout = param.ObjectSelector(default="files", objects=polar_export.LAYOUTS,
+                                         doc="One image per polar plot, one tiled image per power and Orientation, or "
+                                             "one html page")
     button = pn.widgets.Button(name='Plot all Polar plots and save to file', button_type='primary')
+    fit_button = pn.widgets.Button(name='Fit every pixel and save to file', button_type='primary')
 
     def __init__(self, filename, client_input):
         super().__init__(filename, client_input)
@@ -70,11 +56,15 @@ class Grapher(GrapherBase):
         self.client = client_input
         self.filename = Path(filename)
         self._update_dataset()
+        self.export = None
+        self.exported = (0, 0)
+        self.export_error = None  # exception the last export stopped on
+        self.export_status = pn.pane.Markdown("", visible=False)
+        self.export_callback = pn.state.add_periodic_callback(self.show_export, period=1000, start=False)
 
     def _update_dataset(self):
-        self.ds = xr.open_dataset(self.filename,
-                                  chunks={'Orientation': 1, 'wavelength': -1, 'x': -1, 'y': -1, 'Polarization': -1},
-                                  engine="zarr")  # chunked for heatmap selected
+        self.ds = utils.open_store(self.filename, chunks={'Orientation': 1, 'wavelength': -1, 'x': -1, 'y': -1,
+                                                          'Polarization': -1})  # chunked for heatmap selected
         try:
             fit_ver = self.ds.attrs["fit_version"]
         except:
@@ -85,18 +75,29 @@ class Grapher(GrapherBase):
             data_ver = 0
         current_fit_version = 1
         current_data_version = 2
+        # a store still being gathered is written by the acquisition, results are only kept in memory
+        writable = self.ds.attrs.get("complete", True)
         if fit_ver < current_fit_version:
             time1 = time.time()
             self.ds = self.ds.drop_vars(["fitted", "covariance"], errors="ignore")
-            self.ds["navigation"] = self.ds["ds1"].mean(dim='Polarization').compute()  # chunked for navigation
-            self.ds["heatmap_all"] = self.ds["ds1"].mean(dim=['x', 'y']).compute()  # chunked for heatmap all
-            self.ds = self.ds.merge(self.ds["heatmap_all"].curvefit(["Polarization"], function,
-                                                                    param_names=["delta", "A", "B", "theta", "C"]
-                                                                    , kwargs={"maxfev": 1000000, "xtol": 10 ** -9,
-                                                                              "ftol": 10 ** -9}).compute())
+            # written by the acquisition when present, older stores don't have them so they're computed here. ds1 may
+            # be stored as uint16 or float32, average in float64
+            if "navigation" in self.ds:
+                self.ds["navigation"].load()
+            else:
+                self.ds["navigation"] = self.ds["ds1"].mean(dim='Polarization', dtype=np.float64).compute()
+            if "heatmap_all" in self.ds:
+                self.ds["heatmap_all"].load()
+            else:
+                self.ds["heatmap_all"] = self.ds["ds1"].mean(dim=['x', 'y'], dtype=np.float64).compute()
+            # every curve starts from its harmonic estimate, so it converges without a huge maxfev
+            self.ds = self.ds.merge(harmonics.curvefit(self.ds["heatmap_all"], "Polarization", function,
+                                                       kwargs={"maxfev": 10000, "xtol": 10 ** -9,
+                                                               "ftol": 10 ** -9}).compute())
             self.ds.attrs["fit_version"] = current_fit_version
             self.ds = self.ds.rename({"curvefit_coefficients": "fitted", "curvefit_covariance": "covariance"})
-            self.ds.to_zarr(self.filename, mode="a", compute=True)
+            if writable:
+                self.ds.to_zarr(self.filename, mode="a", compute=True)
             time2 = time.time()
             print(f"finished in {str(timedelta(seconds=time2 - time1))}")
         else:
@@ -108,7 +109,12 @@ class Grapher(GrapherBase):
             self.ds.attrs["data_version"] = current_data_version
             self.ds.coords['Polarization'] = np.arange(0, 180, 1) / 90 * np.pi
             self.ds.coords['degrees'] = ("Polarization", np.arange(0, 360, 2))
-            self.ds.to_zarr(self.filename, mode="a", compute=True)
+            if writable:
+                self.ds.to_zarr(self.filename, mode="a", compute=True)
+        # averages over a selection read four corners of the summed-area table, built when a box is first selected
+        self.roi = summed_area.SummedArea.open(self.filename) if summed_area.NAME in self.ds else None
+        self.roi_failed = not writable  # boxes are averaged from every pixel instead
+        self.version = (self.ds.attrs.get("fit_version", 0), utils.mtime(self.filename))  # keys cached results
         self.coords = self.ds["ds1"].coords
         self.attrs = {**self.ds["ds1"].attrs, **self.ds.attrs}
         self.fname = self.attrs["title"]
@@ -128,15 +134,69 @@ class Grapher(GrapherBase):
         Fits the currently selected data. Only used when selected, otherwise fitted at load time and saved to file
         :return: curve fit results
         """
+        selection = {"Orientation": self.orientation, "wavelength": self.wavelength, "power": self.power}
+        if self.selected:
+            output = self.roi_mean(**selection)
+        else:
+            output = self.ds["heatmap_all"].sel(selection)
+        if self.quick_fit:
+            return results.get(self._key("quick_fit", selection),
+                               lambda: harmonics.estimate(output.coords["Polarization"].values, output.values))
+
+        def curvefit():
+            # least squares over every pixel of the selection has the same minimum as over their average
+            return harmonics.curvefit(output, "Polarization", function).curvefit_coefficients.values
+
+        return results.get(self._key("fit", selection), curvefit)
+
+    def _key(self, kind: str, selection: dict) -> tuple:
+        """
+        Key of a result cached for the selected box, boxes with the same pixels share results
+        :param kind: what the result is, EX: fit
+        :param selection: labels of the other dimensions
+        :return: key
+        """
         if self.selected:
-            output = self.ds["ds1"].sel(Orientation=self.orientation, wavelength=self.wavelength, power=self.power).sel(
-                x=slice(self.x0, self.x1), y=slice(self.y0, self.y1))
+            x, y = summed_area.pixels(self.ds["ds1"], self.x0, self.x1, self.y0, self.y1)
+            box = (x.start, x.stop, y.start, y.stop)
         else:
-            output = self.ds["ds1"].sel(Orientation=self.orientation, wavelength=self.wavelength, power=self.power)
-        curvefit = output.curvefit(["Polarization"], function, reduce_dims=["x", "y"],
-                                   param_names=["delta", "A", "B", "theta", "C"])
-        curvefit_coefficients = curvefit.curvefit_coefficients  # idk what to do with the covars
-        return curvefit_coefficients.values
+            box = None
+        labels = tuple((dim, np.asarray(label).item()) for dim, label in sorted(selection.items()))
+        return str(self.filename.resolve()), self.version, kind, labels, box
+
+    def summed(self) -> Optional[summed_area.SummedArea]:
+        """
+        Summed-area table of ds1, built the first time it's needed
+        :return: table, None if it can't be built, EX: the store is on a read-only share
+        """
+        if self.roi is None and not self.roi_failed:
+            self.roi = summed_area.SummedArea.open_or_build(self.filename)
+            self.roi_failed = self.roi is None
+        return self.roi
+
+    def roi_mean(self, **selection) -> xr.DataArray:
+        """
+        Average over the selected box, cached. Read from every pixel of the box if there's no summed-area table
+        :param selection: labels of the other dimensions, EX: Orientation=0, power=10
+        :return: average
+        """
+        def mean():
+            roi = self.summed()
+            if roi is None:
+                return summed_area.average(self.ds["ds1"], self.x0, self.x1, self.y0, self.y1, **selection)
+            return roi.mean(self.x0, self.x1, self.y0, self.y1, **selection)
+
+        return results.get(self._key("mean", selection), mean)
+
+    @param.depends('orientation', 'wavelength', 'x1', 'x0', 'y0', 'y1', 'selected', 'power', 'quick_fit')
+    def cache_stats(self):
+        """
+        renders the hits and misses of the cache of averages and fits
+        :return:
+        """
+        stats = results.stats()
+        return pn.pane.Markdown(f"Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} results, "
+                                f"{stats['bytes'] / 2 ** 20:.1f} of {stats['max_bytes'] / 2 ** 20:.0f} MiB")
 
     @param.depends('orientation', 'wavelength', 'colorMap', 'power')
     def nav(self):
@@ -155,6 +215,38 @@ class Grapher(GrapherBase):
                               cmap=self.colorMap, tools=['hover'], framewise=True, logz=True)]
         return hv.Image(output, vdims=self.zdim).opts(opts).redim(x=self.x, y=self.y) * polys
 
+    @param.depends('orientation', 'wavelength', 'colorMap', 'power', 'map_param')
+    def parameter_map(self):
+        """
+        renders the map of a parameter fitted to every pixel, for the specified Orientation, wavelength, and power.
+        Shows the harmonic estimate of every pixel (quick fit) until every pixel is fitted
+        :return:
+        """
+        if "parameter_maps" in self.ds:
+            output = self.ds["parameter_maps"].sel(Orientation=self.orientation, wavelength=self.wavelength,
+                                                   power=self.power, param=self.map_param)
+            label = self.map_param
+        else:
+            data = self.ds["ds1"].sel(Orientation=self.orientation, wavelength=self.wavelength, power=self.power)
+            output = harmonics.estimate_array(data.load()).sel(param=self.map_param)
+            label = f"{self.map_param} (quick fit)"
+        opts = [hv.opts.Image(colorbar=True, height=600,
+                              width=round(600 * self.ds["ds1"].coords['x'].size / self.ds["ds1"].coords['y'].size),
+                              title=f"{label}, Wavelength: {self.wavelength}, Orientation: {self.orientation}",
+                              cmap=self.colorMap, tools=['hover'], framewise=True)]
+        return hv.Image(output, vdims=self.map_param).opts(opts).redim(x=self.x, y=self.y)
+
+    def fit_pixels(self, event=None):
+        """
+        Fits every pixel and saves the parameter maps to file
+        :param event: required for the button
+        :return:
+        """
+        self.ds.close()
+        pixelfit.fit_maps(self.filename)
+        self._update_dataset()
+        self.param.trigger('map_param')
+
     def poly_generate(self):
         """
         regenerates existing polygons if they exist. This allows selections to persist across wavelengths/orientations/powers
@@ -210,11 +302,7 @@ class Grapher(GrapherBase):
             output = self.ds["heatmap_all"].sel(Orientation=self.orientation, power=self.power)
             title = f'''{self.fname}: Orientation: {self.orientation}, Average across all points'''
         else:
-            output = self.ds["ds1"].sel(Orientation=self.orientation, power=self.power).sel(
-                x=slice(self.x0, self.x1),
-                y=slice(self.y0,
-                        self.y1)).mean(
-                dim=['x', 'y'])
+            output = self.roi_mean(Orientation=self.orientation, power=self.power)
             title = f'''{self.fname}: Orientation: {self.orientation}, x0: {self.x0},x1: {self.x1}, y0: {self.y0}, y1: 
                     {self.y1}'''
         line = hv.HLine(self.wavelength).opts(line_width=600 / self.coords['wavelength'].values.size, alpha=0.6)
@@ -224,7 +312,7 @@ class Grapher(GrapherBase):
         return hv.Image(output).opts(opts).redim(wavelength=self.wavelength_dim,
                                                  Polarization=self.polarization_dim) * line
 
-    @param.depends('orientation', 'wavelength', 'x1', 'x0', 'y0', 'y1', 'selected', 'power')
+    @param.depends('orientation', 'wavelength', 'x1', 'x0', 'y0', 'y1', 'selected', 'power', 'quick_fit')
     def polar(self, dataset="Polarization"):
         """
         Generates the polar plot. If self.selected, then filter to x1,x0,y0,y1
@@ -234,8 +322,7 @@ class Grapher(GrapherBase):
         theta_values = self.coords[dataset].values  # units, plotly, radians and degrees are a mess.
         theta_radians = self.coords['Polarization'].values
         if self.selected:
-            output = self.ds["ds1"].sel(Orientation=self.orientation, wavelength=self.wavelength, power=self.power,
-                                        x=slice(self.x0, self.x1), y=slice(self.y0, self.y1)).mean(dim=['x', 'y'])
+            output = self.roi_mean(Orientation=self.orientation, wavelength=self.wavelength, power=self.power)
             data_frame = pd.DataFrame(
                 np.vstack((output, theta_values, np.tile("Raw Data, over selected region", 180))).T,
                 columns=['Intensity', 'Polarization', 'Data'], index=theta_values)
@@ -263,44 +350,48 @@ class Grapher(GrapherBase):
 
     def polars_to_file(self, event=None):
         """
-        Plots all the polars to a file
+        Exports the polar plots of every power, Orientation and wavelength in the background, over the selected box if
+        there is one. Plots already exported are skipped
         :param event: required for the button
         :return:
         """
-        start = time.time()
-        ori_wavelength, ori_orientation, ori_power = self.wavelength, self.orientation, self.power
-        self.param["Orientation"].precedence = -1
-        self.param["wavelength"].precedence = -1
-        self.param["power"].precedence = -1
-        wavelengths = self.ds["ds1"].coords['wavelength'].values.tolist()
-        orientations = self.ds["ds1"].coords['Orientation'].values.tolist()
-        powers = self.ds["ds1"].coords['power'].values.tolist()
-        folder = str(self.filename).replace(f".{utils.extension(self.filename)}", '')
-        if not os.path.isdir(folder):
-            os.mkdir(folder)
-        for power in powers:
-            self.power = power
-            for orientation in orientations:
-                selected = self.selected
-                self.orientation = orientation
-                self.selected = selected
-                for wavelength in wavelengths:
-                    selected = self.selected
-                    self.wavelength = wavelength
-                    self.selected = selected  # prevent it resetting like it should
-                    if self.selected:
-                        title = f"{folder}/Polar_X{self.x0}:{self.x1}Y{self.y0}:{self.y1},O{orientation}W{wavelength}" \
-                                f"P{power}.png "
-                    else:
-                        title = f"{folder}/Polar_O{orientation}W{wavelength}.png"
-                    self.polar("degrees").write_image(title)
-        self.nav()
-        self.param["Orientation"].precedence = 1
-        self.param["wavelength"].precedence = 1
-        self.param["power"].precedence = 1
-        self.wavelength, self.orientation, self.power = ori_wavelength, ori_orientation, self.power
-        end = time.time()
-        print(end - start)
+        if self.export is not None and self.export.is_alive():
+            return
+        box = (self.x0, self.x1, self.y0, self.y1) if self.selected else None
+        self.exported = (0, 0)
+        self.export_error = None
+        self.export = threading.Thread(target=self._export, args=(box, self.export_layout), name="export",
+                                       daemon=True)
+        self.export.start()
+        self.export_callback.start()
+
+    def _export(self, box, layout):
+        try:
+            polar_export.export_polars(self.filename, box=box, layout=layout, progress=self._export_progress)
+        except Exception as ex:
+            self.export_error = ex  # shown by show_export
+            print(f"Exporting polars failed. Exception {ex}")
+
+    def _export_progress(self, done, total):
+        self.exported = (done, total)
+
+    def show_export(self):
+        """
+        Shows the progress of the export and why it stopped if it failed, from a periodic callback
+        :return:
+        """
+        done, total = self.exported
+        running = self.export is not None and self.export.is_alive()
+        if running:
+            state = ""
+        elif self.export_error is not None:
+            state = f", failed: {self.export_error}"
+        else:
+            state = ", finished"
+        self.export_status.object = f"Exported {done} of {total} polar plots{state}"
+        self.export_status.visible = True
+        if not running:
+            self.export_callback.stop()
 
     def xarray(self) -> pn.panel:
         """
@@ -314,7 +405,8 @@ class Grapher(GrapherBase):
         Renders everything but the widgets as a view
         :return: view of graphs and title
         """
-        return pn.Column(self.title, pn.Row(self.nav, self.heat_map), pn.Row(self.polar, self.xarray))
+        return pn.Column(self.title, pn.Row(self.nav, self.heat_map), pn.Row(self.polar, self.xarray),
+                         self.parameter_map)
 
     def widgets(self) -> pn.Column:
         """
@@ -322,13 +414,16 @@ class Grapher(GrapherBase):
         :return: the widgets
         """
         self.button.on_click(self.polars_to_file)
+        self.fit_button.on_click(self.fit_pixels)
         if self.ds["ds1"].coords["power"].size > 1:
             widgets = {"wavelength": pn.widgets.DiscreteSlider, "power": pn.widgets.DiscreteSlider}
         else:
             widgets = {"wavelength": pn.widgets.DiscreteSlider}
             self.param["power"].precedence = -1  # effectively a 5d graph
-        return pn.Column(pn.Param(self.param, widgets=widgets), self.button)
+        return pn.Column(pn.Param(self.param, widgets=widgets), self.button, self.export_status, self.fit_button,
+                         self.cache_stats)
 
     def close(self):
         """Closes the dataset"""
+        self.export_callback.stop()
         self.ds.close()
@@ -3,7 +3,6 @@ from pathlib import Path
 import holoviews as hv
 import panel as pn
 import param
-import xarray as xr
 
 from neogidashboard import utils
 from ..visualizer_base import GrapherBase
@@ -19,7 +18,7 @@ class Grapher(GrapherBase):
         """
         Opens selected dataset
         """
-        self.data = xr.open_zarr(self.filename)
+        self.data = utils.open_store(self.filename)
         self.param['wavelength'].objects = self.data["Stellarnet"].coords['wavelength'].values.tolist()
         self.wavelength = self.data["Stellarnet"].coords["wavelength"].min().values
         self.power_dim = hv.Dimension("power", range=utils.get_range("power", self.data["Stellarnet"].coords))
@@ -7,7 +7,7 @@ import panel as pn
 import param
 from dask.distributed import Client
 
-from neogidashboard import utils
+from neogidashboard.watcher import watcher
 from .visualizer_base import GrapherBase
 
 
@@ -24,13 +24,18 @@ class Viewer(param.Parameterized):
         """        
         :param filename: specify default filename, otherwise choose files
         :type filename: str
-        :param types: dictionary matching datatypes to modules to open them
-        :type types: dict
+        :param types: mapping from data types to the modules opening them, EX: visualizer.types
+        :type types: Mapping
         :rtype: Viewer
         """
         super().__init__()
         self.client = Client()
+        self.file_dict = {}
+        self.subscription = watcher().subscribe(list(self.types))
         self.reload_files()
+        if len(self.file_dict) == 0:
+            raise Exception("must have at least one file")
+        self.callback = pn.state.add_periodic_callback(self.reload_files, period=2000)
         if filename is None:
             self.filename = self.files[0]
         else:
@@ -39,15 +44,25 @@ class Viewer(param.Parameterized):
 
     def reload_files(self) -> None:
         """
-        Checks for files with given extensions
+        Applies the files created, changed or deleted since the last call, as reported by the watcher. Never reads
+        the directory tree itself. Stores still being gathered aren't listed, opening one would write to it while the
+        acquisition does
 
         :rtype: None
 
         """
-        self.file_dict = utils.scan_directory(self.types)
-        if len(self.file_dict) == 0:
-            raise Exception("must have at least one file")
-        self.files = list(self.file_dict.keys())
+        updated, removed = self.subscription.drain()
+        if not updated and not removed:
+            return
+        files = watcher().catalog
+        for file in removed:
+            self.file_dict.pop(file, None)
+        for file, data_type in updated.items():
+            if files.complete(file):
+                self.file_dict[file] = data_type
+            else:
+                self.file_dict.pop(file, None)
+        self.files = sorted(self.file_dict)
         self.param["filename"].objects = self.files
 
     @param.depends('filename', watch=True)
@@ -55,8 +70,7 @@ class Viewer(param.Parameterized):
         """
         Loads currently selected file
         """
-        self.reload_files()  # temp solution
-        visualizer = self.file_dict[self.filename].Grapher
+        visualizer = self.types[self.file_dict[self.filename]].Grapher  # only imports the visualizer of this file
         self.grapher = visualizer(self.filename, self.client)
 
     @param.depends('filename')
@@ -96,5 +110,6 @@ class Viewer(param.Parameterized):
         Currently doesn't do anything
         :return:
         """
+        self.callback.stop()
+        watcher().unsubscribe(self.subscription)
         self.client.close()
-        pass
@@ -0,0 +1,164 @@
+"""
+Houses the watcher keeping the catalog up to date in the background and reporting which datasets appeared, changed or
+disappeared
+"""
+import os
+import queue
+import threading
+from functools import lru_cache
+from typing import Optional
+
+from .catalog import Catalog, catalog
+
+
+class Subscription:
+    """
+    Changes to the stores of some data types, queued by the watcher and drained by whoever shows them, EX: from a
+    periodic callback of the panel server
+    """
+
+    def __init__(self, data_types: Optional[list]):
+        """
+        :param data_types: data types reported, None for every data type
+        :type data_types: Optional[list]
+        """
+        self.data_types = None if data_types is None else set(data_types)
+        self.changes = queue.SimpleQueue()
+
+    def put(self, updated: dict, removed: dict) -> None:
+        """
+        Queues the changes this subscription is interested in, called by the watcher
+        :param updated: mapping from stores created or changed to their data type
+        :param removed: mapping from stores deleted to their data type
+        :rtype: None
+        """
+        if self.data_types is not None:
+            updated = {store: data_type for store, data_type in updated.items() if data_type in self.data_types}
+            removed = {store: data_type for store, data_type in removed.items() if data_type in self.data_types}
+        if updated or removed:
+            self.changes.put((updated, set(removed)))
+
+    def drain(self) -> tuple[dict, set]:
+        """
+        Merges every queued change
+        :return: stores created or changed with their data type, stores deleted
+        :rtype: tuple[dict, set]
+        """
+        updated, removed = {}, set()
+        while True:
+            try:
+                new, gone = self.changes.get_nowait()
+            except queue.Empty:
+                return updated, removed
+            for store in gone:
+                updated.pop(store, None)
+            removed = (removed - set(new)) | set(gone)
+            updated.update(new)
+
+
+class Watcher:
+    """
+    Refreshes a catalog on a background thread every interval seconds. Refreshing only lists directories whose
+    modification time changed, so polling is cheap even on network shares where inotify doesn't work
+    """
+
+    def __init__(self, files: Catalog, interval: float = 2.0):
+        """
+        :param files: catalog kept up to date
+        :type files: Catalog
+        :param interval: seconds between refreshes
+        :type interval: float
+        """
+        self.catalog = files
+        self.interval = interval
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.catalog.refresh()
+        self.stores = self._stores()  # store to (data type, modification time, complete)
+        self.thread = threading.Thread(target=self._run, name="watcher", daemon=True)
+        self.thread.start()
+        self.catalog.watched = True
+
+    def _stores(self) -> dict:
+        types = self.catalog.query()
+        return {store: (types[store], mtime, complete) for store, (mtime, complete) in self.catalog.mtimes().items()
+                if store in types}
+
+    def subscribe(self, data_types: Optional[list] = None) -> Subscription:
+        """
+        Subscribes to changes, the stores already cataloged are queued as created
+        :param data_types: data types reported, None for every data type
+        :type data_types: Optional[list]
+        :return: subscription
+        :rtype: Subscription
+        """
+        subscription = Subscription(data_types)
+        with self.lock:
+            subscription.put({store: data_type for store, (data_type, *_) in self.stores.items()}, {})
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        :param subscription: subscription returned by subscribe
+        :rtype: None
+        """
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def poll(self) -> None:
+        """
+        Refreshes the catalog and queues the changes for every subscription, a store finishing counts as updated
+
+        :rtype: None
+        """
+        self.catalog.refresh()
+        stores = self._stores()
+        with self.lock:
+            updated = {store: state[0] for store, state in stores.items() if self.stores.get(store) != state}
+            removed = {store: data_type for store, (data_type, *_) in self.stores.items() if store not in stores}
+            self.stores = stores
+            for subscription in self.subscriptions:
+                subscription.put(updated, removed)
+
+    def _run(self) -> None:
+        while not self.stopping.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as ex:  # keep watching, EX: a network share dropping out for a moment
+                print(f"Watching {self.catalog.root} failed. Exception {ex}")
+
+    def stop(self) -> None:
+        """
+        Stops watching, scan_directory reads the tree again from then on
+
+        :rtype: None
+        """
+        self.stopping.set()
+        self.thread.join()
+        self.catalog.watched = False
+
+
+@lru_cache(maxsize=None)
+def _watcher(directory: str, root: str) -> Watcher:
+    """
+    Cached by watcher, directory keeps relative roots apart when the working directory changes
+    """
+    return Watcher(catalog(root))
+
+
+def watcher(root: str = ".") -> Watcher:
+    """
+    Watcher of a directory shared by the whole process, started on first use
+    :param root: directory searched for zarr stores
+    :type root: str
+    :return: watcher
+    :rtype: Watcher
+    """
+    shared = _watcher(os.path.abspath(root), root)
+    if shared.stopping.is_set():
+        _watcher.cache_clear()
+        shared = _watcher(os.path.abspath(root), root)
+    return shared
@@ -0,0 +1,16 @@
+"""
+Startup time budget of the dashboard and the plugin registry it relies on
+"""
+from neogidashboard import benchmark
+from neogidashboard.ensembles import instruments
+
+
+def test_startup_within_budget():
+    seconds, plugins = benchmark.startup()
+    assert seconds <= benchmark.STARTUP_BUDGET
+    assert plugins == []
+
+
+def test_registry_skips_plugins_raising_on_import():
+    assert "RASHG_PID" not in instruments
+    assert {"RASHG", "WavelengthPoweredCalib"} <= set(instruments)